@@ -0,0 +1,102 @@
+"""
+分類結果ZIPエクスポートのベンチマーク
+
+一時ディレクトリにダミー画像と分類結果の階層構造を作成し、
+- 従来方式: Utils.create_classification_download_package（一時フォルダへコピー → ZIP作成）
+- ストリーミング方式: Utils.stream_classification_zip
+の最初のバイトまでの時間（TTFB）と全体のスループットを比較する。
+
+使い方（backend/ で実行）:
+    python -m benchmarks.export_benchmark --images 2000 --image-size 200000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from clustering.utils import Utils
+
+
+def build_dataset(root: Path, image_count: int, image_size: int, leaf_size: int = 50) -> tuple[dict, dict]:
+    """ダミー画像と3階層（トップ → 中間 → リーフ）の分類結果を作成する"""
+    images_path = root / "images"
+    images_path.mkdir(parents=True, exist_ok=True)
+
+    leaves = {}
+    all_nodes = {}
+    for i in range(image_count):
+        name = f"image_{i:06d}.png"
+        with open(images_path / name, "wb") as f:
+            f.write(os.urandom(image_size))
+        leaf_id = f"leaf_{i // leaf_size}"
+        leaves.setdefault(leaf_id, {})[f"cid_{i}"] = name
+
+    middles = {}
+    for j, (leaf_id, data) in enumerate(leaves.items()):
+        middle_id = f"middle_{j // 10}"
+        middles.setdefault(middle_id, {})[leaf_id] = {"data": data, "is_leaf": True, "name": leaf_id, "parent_id": middle_id}
+        all_nodes[leaf_id] = {"name": leaf_id, "is_leaf": True, "parent_id": middle_id}
+
+    result = {
+        "top": {
+            "data": {middle_id: {"data": data, "is_leaf": False, "name": middle_id, "parent_id": "top"} for middle_id, data in middles.items()},
+            "is_leaf": False,
+            "name": "top",
+            "parent_id": None,
+        }
+    }
+    return result, all_nodes
+
+
+def bench_legacy(result: dict, all_nodes: dict, images_path: Path) -> tuple[float, float, int]:
+    start = time.perf_counter()
+    zip_path = Utils.create_classification_download_package(result, all_nodes, images_path, "benchmark_project")
+    ready = time.perf_counter()
+    total_bytes = 0
+    with open(zip_path, "rb") as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            total_bytes += len(data)
+    end = time.perf_counter()
+    os.remove(zip_path)
+    return ready - start, end - start, total_bytes
+
+
+def bench_streaming(result: dict, all_nodes: dict, images_path: Path) -> tuple[float, float, int]:
+    start = time.perf_counter()
+    ttfb = None
+    total_bytes = 0
+    for chunk in Utils.stream_classification_zip(result, all_nodes, images_path):
+        if chunk and ttfb is None:
+            ttfb = time.perf_counter() - start
+        total_bytes += len(chunk)
+    end = time.perf_counter()
+    return ttfb or 0.0, end - start, total_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分類結果ZIPエクスポートのベンチマーク")
+    parser.add_argument("--images", type=int, default=2000, help="画像枚数")
+    parser.add_argument("--image-size", type=int, default=200000, help="1枚あたりのバイト数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        root = Path(temp_dir_str)
+        print(f"📦 データ作成中: {args.images} 枚 x {args.image_size} bytes")
+        result, all_nodes = build_dataset(root, args.images, args.image_size)
+        images_path = root / "images"
+
+        for label, bench in (("従来方式", bench_legacy), ("ストリーミング", bench_streaming)):
+            ttfb, total, total_bytes = bench(result, all_nodes, images_path)
+            throughput = total_bytes / total / (1024 * 1024) if total > 0 else 0.0
+            print(f"📊 {label}: TTFB {ttfb * 1000:.1f} ms / 合計 {total:.2f} s / {total_bytes / (1024 * 1024):.1f} MB / {throughput:.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,506 @@
+"""
+MySQLクエリの実行計画・レイテンシの回帰チェック
+
+ベンチマーク用のデータベース（デフォルト: pss_db_bench）を InitDB.sql のスキーマで作成し、
+実運用に近い件数（大きなプロジェクト1つに画像3万枚・メンバー20人など）を投入したうえで、
+db_utils/*_queries.py の全クエリ関数を実行して
+- EXPLAIN の結果: 想定したインデックスを使っているか、想定外のフルスキャン（type=ALL）が無いか
+- レイテンシ: 読み取りは複数回実行した中央値、書き込みは1回の実行時間が上限以内か
+を確認する。クエリ関数を追加した場合は CASES にも追加すること（未登録の関数があると失敗する）。
+
+使い方（backend/ で実行、MySQLは別途起動しておく）:
+    python -m benchmarks.query_plan_benchmark --reset               # DBを作り直してデータを投入してから計測
+    python -m benchmarks.query_plan_benchmark                       # 投入済みのDBで計測のみ
+    python -m benchmarks.query_plan_benchmark --reset --scale 0.1   # 件数を1/10にして実行
+
+書き込み系のクエリは実行ごとに作成したユーザー・プロジェクト・画像を対象にし、最後に削除する。
+一部のユーザーのクラスタリング状態は更新されるため、件数を揃えて比較する場合は --reset を付けて実行する。
+"""
+
+import argparse
+import inspect
+import os
+import re
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from config import MYSQL_ROOT_PASSWORD, MYSQL_HOST, DATABASE_PORT_IN_CONTAINER
+from db_utils import (
+    action_queries,
+    auth_queries,
+    images_queries,
+    project_memberships_queries,
+    projects_queries,
+    user_image_clustering_states_queries,
+    users_queries,
+)
+
+QUERY_MODULES = [
+    action_queries,
+    auth_queries,
+    images_queries,
+    project_memberships_queries,
+    projects_queries,
+    user_image_clustering_states_queries,
+    users_queries,
+]
+
+INIT_SQL_PATH = Path(__file__).resolve().parents[2] / "database" / "sql" / "initdb.d" / "InitDB.sql"
+
+# 投入するデータ量（scale=1のとき）
+USER_COUNT = 200
+PROJECT_COUNT = 20
+BIG_PROJECT_IMAGES = 30000
+SMALL_PROJECT_IMAGES = 1000
+BIG_PROJECT_MEMBERS = 20
+SMALL_PROJECT_MEMBERS = 5
+
+BIG_PROJECT_ID = 1
+SMALL_PROJECT_ID = 2
+OTHER_PROJECT_ID = 3
+
+
+def server_url(database: str = "") -> str:
+    return f"mysql://root:{MYSQL_ROOT_PASSWORD}@{MYSQL_HOST}:{DATABASE_PORT_IN_CONTAINER}/{database}?charset=utf8mb4"
+
+
+def load_schema_statements() -> list[str]:
+    """InitDB.sql からテーブル・インデックス定義のみを取り出す（USE文・初期データは除く）"""
+    sql = INIT_SQL_PATH.read_text(encoding="utf-8")
+    sql = sql.split("-- 初期データの挿入")[0]
+    lines = [re.sub(r"--.*$", "", line) for line in sql.splitlines()]
+    statements = [statement.strip() for statement in "\n".join(lines).split(";")]
+    return [statement for statement in statements if statement and not statement.upper().startswith("USE ")]
+
+
+def reset_database(database: str):
+    """ベンチマーク用のデータベースを作り直す"""
+    server = create_engine(server_url())
+    with server.begin() as conn:
+        conn.execute(text(f"DROP DATABASE IF EXISTS `{database}`"))
+        conn.execute(text(f"CREATE DATABASE `{database}` CHARACTER SET utf8mb4"))
+    server.dispose()
+
+
+def seed(engine, scale: float, chunk_size: int = 5000):
+    """実運用に近い件数のデータを投入する"""
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        for statement in load_schema_statements():
+            conn.execute(text(statement))
+
+    user_count = max(BIG_PROJECT_MEMBERS + 10, int(USER_COUNT * scale))
+    big_images = max(100, int(BIG_PROJECT_IMAGES * scale))
+    small_images = max(50, int(SMALL_PROJECT_IMAGES * scale))
+
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO users (name, password, email, authority) VALUES (:name, :password, :email, :authority)"),
+            [{"name": f"bench_user_{i}", "password": "bench", "email": f"bench_user_{i}@example.com", "authority": int(i == 1)}
+             for i in range(1, user_count + 1)]
+        )
+        conn.execute(
+            text("INSERT INTO projects (name, password, description, original_images_folder_path, owner_id) "
+                 "VALUES (:name, :password, :description, :path, 1)"),
+            [{"name": f"bench_project_{i}", "password": "bench", "description": "benchmark", "path": f"bench_project_{i}"}
+             for i in range(1, PROJECT_COUNT + 1)]
+        )
+        memberships = []
+        for project_id in range(1, PROJECT_COUNT + 1):
+            member_count = BIG_PROJECT_MEMBERS if project_id == BIG_PROJECT_ID else SMALL_PROJECT_MEMBERS
+            for user_id in range(1, member_count + 1):
+                memberships.append({
+                    "user_id": user_id,
+                    "project_id": project_id,
+                    "mongo_result_id": uuid.uuid4().hex[:22]
+                })
+        conn.execute(
+            text("INSERT INTO project_memberships (user_id, project_id, init_clustering_state, continuous_clustering_state, mongo_result_id) "
+                 "VALUES (:user_id, :project_id, 2, 2, :mongo_result_id)"),
+            memberships
+        )
+
+    image_query = text(
+        "INSERT INTO images (name, is_created_caption, caption, project_id, clustering_id, chromadb_sentence_id, chromadb_image_id, uploaded_user_id) "
+        "VALUES (:name, :is_created_caption, :caption, :project_id, :clustering_id, :sentence_id, :image_id, :uploaded_user_id)"
+    )
+    for project_id in range(1, PROJECT_COUNT + 1):
+        image_count = big_images if project_id == BIG_PROJECT_ID else small_images
+        for offset in range(0, image_count, chunk_size):
+            rows = [
+                {
+                    "name": f"image_{i:06d}.png",
+                    "is_created_caption": int(i % 50 != 0),
+                    "caption": f"The main object is a sample object number {i}. It's used for benchmarking. Its category is test.",
+                    "project_id": project_id,
+                    "clustering_id": uuid.uuid4().hex[:22],
+                    "sentence_id": uuid.uuid4().hex[:22],
+                    "image_id": uuid.uuid4().hex[:22],
+                    "uploaded_user_id": 1 + i % SMALL_PROJECT_MEMBERS
+                }
+                for i in range(offset, min(offset + chunk_size, image_count))
+            ]
+            with engine.begin() as conn:
+                conn.execute(image_query, rows)
+
+    with engine.begin() as conn:
+        # メンバー全員分の状態（1割を未クラスタリングにする）
+        conn.execute(text("""
+            INSERT INTO user_image_clustering_states (user_id, image_id, project_id, is_clustered, executed_clustering_count, clustered_at)
+            SELECT pm.user_id, i.id, i.project_id,
+                   IF(i.id % 10 = 0, 0, 1),
+                   IF(i.id % 10 = 0, NULL, 0),
+                   IF(i.id % 10 = 0, NULL, CURRENT_TIMESTAMP(6))
+            FROM images i
+            JOIN project_memberships pm ON pm.project_id = i.project_id
+        """))
+        for table in ("users", "projects", "project_memberships", "images", "user_image_clustering_states"):
+            conn.execute(text(f"ANALYZE TABLE {table}"))
+
+    with engine.connect() as conn:
+        counts = {
+            table: conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+            for table in ("users", "projects", "project_memberships", "images", "user_image_clustering_states")
+        }
+    print(f"🌱 データ投入完了 ({time.perf_counter() - started:.1f}秒): {counts}")
+
+
+def build_context(engine) -> dict:
+    """クエリに渡す実データ（clustering_idなど）を取得する"""
+    run_id = uuid.uuid4().hex[:8]
+    with engine.connect() as conn:
+        big_images = conn.execute(text(
+            f"SELECT id, clustering_id FROM images WHERE project_id = {BIG_PROJECT_ID} ORDER BY id LIMIT 1000"
+        )).mappings().all()
+        other_image_ids = conn.execute(text(
+            f"SELECT id FROM images WHERE project_id = {OTHER_PROJECT_ID} ORDER BY id"
+        )).scalars().all()
+        small_image_id = conn.execute(text(
+            f"SELECT id FROM images WHERE project_id = {SMALL_PROJECT_ID} ORDER BY id LIMIT 1"
+        )).scalar()
+        mongo_result_id = conn.execute(text(
+            f"SELECT mongo_result_id FROM project_memberships WHERE project_id = {BIG_PROJECT_ID} AND user_id = 1"
+        )).scalar()
+    return {
+        "run_id": run_id,
+        "clustering_id": big_images[0]["clustering_id"],
+        "image_id": big_images[0]["id"],
+        "clustering_ids": [row["clustering_id"] for row in big_images],
+        "image_ids_str": ", ".join(str(row["id"]) for row in big_images[:200]),
+        "other_image_ids": other_image_ids,
+        "small_image_id": small_image_id,
+        "mongo_result_id": mongo_result_id,
+        "new_image_clustering_id": f"bench{run_id}".ljust(22, "0")[:22],
+    }
+
+
+def case(func, args=None, keys=None, full_scan=(), max_ms=20.0, repeat=5, store=None):
+    """
+    1つのクエリ関数の計測条件
+
+    Args:
+        func: クエリ関数
+        args: コンテキストを受け取り、session以外の引数（dict）を返す関数
+        keys: EXPLAINのテーブル名（別名） → 使用を想定するインデックス名の集合
+        full_scan: フルスキャンを許容するテーブル名（小さなマスタテーブルなど）
+        max_ms: レイテンシの上限（ミリ秒、--latency-factor倍される）
+        repeat: 実行回数（書き込みは1）
+        store: 戻り値の LAST_INSERT_ID を保存するコンテキストのキー
+    """
+    return {
+        "func": func,
+        "args": args or (lambda ctx: {}),
+        "keys": keys or {},
+        "full_scan": set(full_scan),
+        "max_ms": max_ms,
+        "repeat": repeat,
+        "store": store,
+    }
+
+
+B, S, O = BIG_PROJECT_ID, SMALL_PROJECT_ID, OTHER_PROJECT_ID
+IMAGES_BY_PROJECT = {"idx_images_project_id_is_created_caption", "uq_images_project_id_name"}
+UICS_BY_USER_PROJECT = {"idx_user_image_clustering_states_user_project_clustered"}
+UICS_BY_USER_PROJECT_OR_PK = UICS_BY_USER_PROJECT | {"PRIMARY"}
+PM_BY_PROJECT = {"idx_project_memberships_project_id_init_state"}
+
+CASES = [
+    # --- 読み取り: メンバーシップ・プロジェクト ---
+    case(action_queries.get_membership_init_and_mongo, lambda c: {"user_id": 1, "project_id": B}, {"project_memberships": {"PRIMARY"}}),
+    case(action_queries.get_membership_mongo_and_init, lambda c: {"user_id": 1, "project_id": B}, {"project_memberships": {"PRIMARY"}}),
+    case(action_queries.get_membership_clustering_states, lambda c: {"user_id": 1, "project_id": B}, {"project_memberships": {"PRIMARY"}}),
+    case(action_queries.get_membership_and_project_info, lambda c: {"project_id": B, "user_id": 1},
+         {"project_memberships": {"PRIMARY"}, "projects": {"PRIMARY"}}),
+    case(action_queries.get_user_info, lambda c: {"user_id": 1}, {"users": {"PRIMARY"}}),
+    case(action_queries.get_executed_clustering_count, lambda c: {"user_id": 1, "project_id": B}, {"project_memberships": {"PRIMARY"}}),
+    case(action_queries.get_project_info_and_mongo, lambda c: {"project_id": B, "user_id": 1}, {"p": {"PRIMARY"}, "pm": {"PRIMARY"}}),
+    case(action_queries.get_project_name, lambda c: {"project_id": B}, {"projects": {"PRIMARY"}}),
+    case(action_queries.membership_exists, lambda c: {"project_id": B, "user_id": 1}, {"project_memberships": {"PRIMARY"}}),
+    case(auth_queries.query_user_login, lambda c: {"name": "bench_user_1", "email": "bench_user_1@example.com", "password": "bench"},
+         full_scan={"users"}),
+    case(auth_queries.verify_project_password, lambda c: {"project_id": B, "password": "bench"}, {"projects": {"PRIMARY"}}),
+    case(images_queries.get_project_original_images_folder_path, lambda c: {"project_id": B}, {"projects": {"PRIMARY"}}),
+    case(images_queries.select_project_members, lambda c: {"project_id": B}, {"project_memberships": PM_BY_PROJECT}),
+    case(project_memberships_queries.get_memberships_by_project, lambda c: {"project_id": B}, {"project_memberships": PM_BY_PROJECT}),
+    case(project_memberships_queries.get_memberships_by_user, lambda c: {"user_id": 1}, {"project_memberships": {"PRIMARY"}}),
+    case(project_memberships_queries.get_all_memberships, full_scan={"project_memberships"}, max_ms=50),
+    case(project_memberships_queries.project_exists, lambda c: {"project_id": B}, {"projects": {"PRIMARY"}}),
+    case(project_memberships_queries.get_memberships_by_project_after_update, lambda c: {"project_id": B}, {"project_memberships": PM_BY_PROJECT}),
+    case(project_memberships_queries.get_completed_clustering_users, lambda c: {"project_id": B},
+         {"pm": PM_BY_PROJECT, "u": {"PRIMARY"}}),
+    case(projects_queries.get_projects, full_scan={"projects"}),
+    case(projects_queries.get_projects_for_user, lambda c: {"user_id": 1}, {"project_memberships": {"PRIMARY"}}, full_scan={"projects"}),
+    case(projects_queries.get_project, lambda c: {"project_id": B}, {"projects": {"PRIMARY"}}),
+    case(projects_queries.get_project_for_user, lambda c: {"project_id": B, "user_id": 1},
+         {"projects": {"PRIMARY"}, "project_memberships": {"PRIMARY"}}),
+    case(users_queries.select_all_users, full_scan={"users"}),
+
+    # --- 読み取り: 画像（clustering_id・名前による検索） ---
+    case(action_queries.get_chromadb_image_id_by_clustering_id, lambda c: {"clustering_id": c["clustering_id"], "project_id": B},
+         {"images": {"uq_images_clustering_id"}}),
+    case(action_queries.get_chromadb_sentence_id_by_clustering_id, lambda c: {"clustering_id": c["clustering_id"], "project_id": B},
+         {"images": {"uq_images_clustering_id"}}),
+    case(action_queries.get_image_name_by_id, lambda c: {"image_id": c["image_id"]}, {"images": {"PRIMARY"}}),
+    case(images_queries.check_image_exists, lambda c: {"name": "image_000123.png", "project_id": B},
+         {"images": {"uq_images_project_id_name"}}),
+    case(images_queries.select_image_id_by_clustering_id, lambda c: {"clustering_id": c["clustering_id"]},
+         {"images": {"uq_images_clustering_id"}}),
+    case(images_queries.select_caption_by_clustering_id, lambda c: {"clustering_id": c["clustering_id"]},
+         {"images": {"uq_images_clustering_id"}}),
+    case(images_queries.iter_captions_by_clustering_ids, lambda c: {"clustering_ids": c["clustering_ids"]},
+         {"images": {"uq_images_clustering_id"}}, max_ms=100),
+    case(images_queries.select_captions_by_clustering_ids, lambda c: {"clustering_ids": c["clustering_ids"]},
+         {"images": {"uq_images_clustering_id"}}, max_ms=100),
+    case(images_queries.get_folder_names_by_clustering_ids, lambda c: {"clustering_ids": c["clustering_ids"]},
+         {"images": {"uq_images_clustering_id"}}, max_ms=100),
+    case(images_queries.select_images_for_delete, lambda c: {"image_ids": [int(i) for i in c["image_ids_str"].split(", ")]},
+         {"i": {"PRIMARY"}, "p": {"PRIMARY"}}, max_ms=100),
+    case(images_queries.select_member_mongo_result_ids, lambda c: {"project_ids": [B]}, {"project_memberships": PM_BY_PROJECT}),
+
+    # --- 読み取り: プロジェクト全体（大きなプロジェクト） ---
+    case(action_queries.select_images_for_init, lambda c: {"project_id": B}, {"images": IMAGES_BY_PROJECT}, max_ms=1000),
+    case(action_queries.get_unclustered_images, lambda c: {"project_id": B, "user_id": 1},
+         {"i": IMAGES_BY_PROJECT, "uics": {"PRIMARY"}}, max_ms=1000),
+    case(action_queries.get_unclustered_count_for_project, lambda c: {"user_id": 1, "project_id": B},
+         {"i": IMAGES_BY_PROJECT, "uics": {"PRIMARY"}}, max_ms=500),
+    case(action_queries.get_user_clustering_states_by_clustering_id, lambda c: {"user_id": 1, "project_id": B},
+         {"uics": UICS_BY_USER_PROJECT_OR_PK, "i": {"PRIMARY"}}, max_ms=1000),
+    case(action_queries.get_image_counts_for_clustering_counts, lambda c: {"user_id": 1, "project_id": B},
+         {"uics": UICS_BY_USER_PROJECT_OR_PK, "i": {"PRIMARY"}}, max_ms=1000),
+    case(action_queries.get_clustering_count_totals, lambda c: {"user_id": 1, "project_id": B},
+         {"uics": UICS_BY_USER_PROJECT_OR_PK, "i": {"PRIMARY"}}, max_ms=500),
+    case(auth_queries.select_images_by_project, lambda c: {"project_id": B}, {"images": IMAGES_BY_PROJECT}, max_ms=500),
+    case(images_queries.get_images_by_project, lambda c: {"project_id": B}, {"images": IMAGES_BY_PROJECT}, max_ms=1500),
+    case(user_image_clustering_states_queries.get_user_image_clustering_states,
+         lambda c: {"where_clause": f"uics.user_id = 1 AND uics.project_id = {B}"},
+         {"uics": UICS_BY_USER_PROJECT_OR_PK, "i": {"PRIMARY"}}, max_ms=1500),
+    # is_clustered だけの絞り込み（user_id を指定しない一覧）は複合インデックスを使えない
+    case(user_image_clustering_states_queries.get_user_image_clustering_states,
+         lambda c: {"where_clause": "uics.is_clustered = 0"},
+         {"uics": {"idx_user_image_clustering_states_is_clustered"}, "i": {"PRIMARY"}}, max_ms=1500),
+    case(user_image_clustering_states_queries.get_unclustered_count, lambda c: {"user_id": 1, "project_id": B},
+         {"user_image_clustering_states": UICS_BY_USER_PROJECT}),
+    case(user_image_clustering_states_queries.get_clustered_count_after_mark_all, lambda c: {"user_id": 1, "project_id": B},
+         {"user_image_clustering_states": UICS_BY_USER_PROJECT}, max_ms=100),
+
+    # --- 書き込み: 状態の更新（ユーザーごとに対象を分けて読み取り系の件数に影響させない） ---
+    case(action_queries.update_init_state, lambda c: {"user_id": 2, "project_id": B, "state": 2},
+         {"project_memberships": {"PRIMARY"}}, repeat=1),
+    case(action_queries.update_continuous_state, lambda c: {"user_id": 2, "project_id": B, "new_state": 2},
+         {"project_memberships": {"PRIMARY"}}, repeat=1),
+    case(action_queries.update_project_executed_clustering_count, lambda c: {"user_id": 2, "project_id": B, "new_count": 1},
+         {"project_memberships": {"PRIMARY"}}, repeat=1),
+    case(action_queries.update_user_image_state_for_image, lambda c: {"user_id": 2, "image_id": c["image_id"], "new_count": 1},
+         {"user_image_clustering_states": {"PRIMARY"}}, repeat=1),
+    case(action_queries.commit_continuous_clustering_states,
+         lambda c: {"user_id": 2, "project_id": B, "image_ids": [int(i) for i in c["image_ids_str"].split(", ")], "new_count": 1},
+         max_ms=500, repeat=1),
+    case(action_queries.mark_user_images_clustered, lambda c: {"user_id": 3, "project_id": B},
+         {"user_image_clustering_states": UICS_BY_USER_PROJECT}, max_ms=500, repeat=1),
+    case(action_queries.mark_user_images_clustered_with_executed_count, lambda c: {"user_id": 4, "project_id": B, "executed_count": 1},
+         {"user_image_clustering_states": UICS_BY_USER_PROJECT}, max_ms=500, repeat=1),
+    case(action_queries.copy_clustering_states_by_clustering_id, lambda c: {"source_user_id": 1, "target_user_id": 5, "project_id": B},
+         {"target_uics": UICS_BY_USER_PROJECT_OR_PK, "target_img": {"PRIMARY", "uq_images_clustering_id"},
+          "source_img": {"PRIMARY", "uq_images_clustering_id"}, "source_uics": UICS_BY_USER_PROJECT_OR_PK}, max_ms=5000, repeat=1),
+    case(user_image_clustering_states_queries.mark_images_as_clustered,
+         lambda c: {"user_id": 6, "project_id": B, "image_ids_str": c["image_ids_str"]},
+         {"user_image_clustering_states": {"PRIMARY"} | UICS_BY_USER_PROJECT}, max_ms=100, repeat=1),
+    case(user_image_clustering_states_queries.mark_all_images_as_clustered, lambda c: {"user_id": 7, "project_id": B},
+         {"user_image_clustering_states": UICS_BY_USER_PROJECT}, max_ms=500, repeat=1),
+    case(images_queries.update_project_members_continuous_state, lambda c: {"project_id": B},
+         {"project_memberships": PM_BY_PROJECT}, repeat=1),
+    case(project_memberships_queries.update_project_membership_state, lambda c: {"user_id": 2, "project_id": S, "init_clustering_state": 2},
+         {"project_memberships": {"PRIMARY"}}, repeat=1),
+    case(project_memberships_queries.update_all_members_continuous_state, lambda c: {"project_id": S},
+         {"project_memberships": PM_BY_PROJECT}, repeat=1),
+
+    # --- 書き込み: 実行ごとに作成して最後に削除するデータ ---
+    case(users_queries.insert_user, lambda c: {"name": f"bench_{c['run_id']}", "password": "bench",
+                                               "email": f"bench_{c['run_id']}@example.com", "authority": 0},
+         repeat=1, store="new_user_id"),
+    case(auth_queries.insert_project_membership, lambda c: {"user_id": c["new_user_id"], "project_id": S, "mongo_result_id": c["run_id"]},
+         repeat=1),
+    case(project_memberships_queries.insert_project_membership, lambda c: {"user_id": c["new_user_id"], "project_id": O, "mongo_result_id": c["run_id"]},
+         repeat=1),
+    case(auth_queries.insert_user_image_state, lambda c: {"user_id": c["new_user_id"], "image_id": c["small_image_id"], "project_id": S},
+         repeat=1),
+    case(auth_queries.insert_user_image_states_for_project, lambda c: {"user_id": c["new_user_id"], "project_id": S},
+         {"i": IMAGES_BY_PROJECT, "s": {"PRIMARY"}}, max_ms=500, repeat=1),
+    case(auth_queries.bulk_insert_user_image_states, lambda c: {"user_ids": [c["new_user_id"]], "image_ids": c["other_image_ids"], "project_id": O},
+         max_ms=500, repeat=1),
+    case(images_queries.insert_image, lambda c: {"name": f"bench_{c['run_id']}.png", "is_created_for_sql": "TRUE", "caption_sql_value": "'benchmark'",
+                                                 "project_id": O, "clustering_id": c["new_image_clustering_id"], "sentence_id": c["run_id"],
+                                                 "image_id": c["run_id"], "uploaded_user_id": 1},
+         repeat=1, store="new_image_id"),
+    case(images_queries.delete_image, lambda c: {"image_id": c["new_image_id"]}, {"images": {"PRIMARY"}}, repeat=1),
+    case(images_queries.delete_images, lambda c: {"image_ids": [c["new_image_id"]]}, {"images": {"PRIMARY"}}, repeat=1),
+    case(projects_queries.insert_project, lambda c: {"name": f"bench_{c['run_id']}", "password": "bench", "description": "benchmark",
+                                                     "original_images_folder_path": f"bench_{c['run_id']}", "owner_id": 1},
+         repeat=1, store="new_project_id"),
+    case(projects_queries.delete_project, lambda c: {"project_id": c["new_project_id"]}, {"projects": {"PRIMARY"}}, repeat=1),
+    case(users_queries.delete_user, lambda c: {"user_id": c["new_user_id"]}, {"users": {"PRIMARY"}}, repeat=1),
+]
+
+
+class StatementRecorder:
+    """エンジンで実行されたSQL（パラメータ付き）を記録する"""
+
+    def __init__(self, engine):
+        self.statements = []
+        event.listen(engine, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if "LAST_INSERT_ID" not in statement and not statement.lstrip().upper().startswith("EXPLAIN"):
+            self.statements.append((statement, parameters))
+
+    def pop(self) -> list:
+        statements, self.statements = self.statements, []
+        return statements
+
+
+def explain(engine, statement: str, parameters) -> list[dict]:
+    with engine.connect() as conn:
+        result = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters if parameters else None)
+        return [dict(row) for row in result.mappings().all()]
+
+
+def call(func, session, kwargs: dict):
+    """クエリ関数を実行し、(成功したか, LAST_INSERT_ID) を返す"""
+    result = func(session, **kwargs)
+    if inspect.isgenerator(result):
+        return len(list(result)) > 0, None
+    if isinstance(result, tuple):
+        return result[0] is not None, result[1]
+    return result is not None, None
+
+
+def check_plan(plan: list[dict], expected_keys: dict, full_scan: set) -> list[str]:
+    """EXPLAINの結果から問題点を列挙する"""
+    problems = []
+    for row in plan:
+        table = row.get("table")
+        if not table or table.startswith("<") or row.get("select_type") == "INSERT":
+            continue
+        if row.get("type") == "ALL" and table not in full_scan:
+            problems.append(f"フルスキャン: {table} (rows={row.get('rows')})")
+    for table, keys in expected_keys.items():
+        rows = [row for row in plan if row.get("table") == table]
+        if not rows:
+            problems.append(f"{table} が実行計画にありません")
+        for row in rows:
+            if row.get("key") not in keys:
+                problems.append(f"{table}: key={row.get('key')}（想定: {'/'.join(sorted(keys))}）")
+    return problems
+
+
+def format_plan(plan: list[dict]) -> str:
+    return " ".join(f"{row.get('table')}:{row.get('type')}:{row.get('key')}" for row in plan if row.get("table"))
+
+
+def run_cases(engine, latency_factor: float) -> int:
+    session_factory = sessionmaker(bind=engine)
+    recorder = StatementRecorder(engine)
+    ctx = build_context(engine)
+    failures = 0
+
+    covered = {case_["func"] for case_ in CASES}
+    missing = [
+        f"{module.__name__}.{name}"
+        for module in QUERY_MODULES
+        for name, func in inspect.getmembers(module, inspect.isfunction)
+        if func.__module__ == module.__name__ and func not in covered
+    ]
+    for name in missing:
+        print(f"❌ 計測条件が未登録のクエリ関数: {name}")
+        failures += 1
+
+    print(f"{'query':<58} {'ms':>9} {'limit':>7}  plan")
+    for case_ in CASES:
+        func = case_["func"]
+        name = f"{func.__module__.split('.')[-1]}.{func.__name__}"
+        problems = []
+        try:
+            kwargs = case_["args"](ctx)
+            recorder.pop()
+            timings = []
+            last_id = None
+            for _ in range(case_["repeat"]):
+                started = time.perf_counter()
+                ok, last_id = call(func, session_factory(), kwargs)
+                timings.append((time.perf_counter() - started) * 1000)
+                if not ok:
+                    problems.append("クエリの実行に失敗しました")
+                    break
+            statements = recorder.pop()
+            if case_["store"]:
+                ctx[case_["store"]] = last_id
+
+            plan = explain(engine, *statements[0]) if statements else []
+            problems += check_plan(plan, case_["keys"], case_["full_scan"])
+            latency = statistics.median(timings)
+            limit = case_["max_ms"] * latency_factor
+            if latency > limit:
+                problems.append(f"レイテンシ超過: {latency:.1f}ms > {limit:.0f}ms")
+        except Exception as e:
+            problems.append(f"{type(e).__name__}: {e}")
+            plan, latency, limit = [], float("nan"), case_["max_ms"] * latency_factor
+
+        mark = "✅" if not problems else "❌"
+        print(f"{mark} {name:<56} {latency:>9.2f} {limit:>7.0f}  {format_plan(plan)}")
+        for problem in problems:
+            print(f"     ⚠️ {problem}")
+        failures += bool(problems)
+
+    print(f"\n{'✅ すべてのクエリが条件を満たしました' if failures == 0 else f'❌ {failures}件のクエリが条件を満たしていません'} ({len(CASES)}件)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MySQLクエリの実行計画・レイテンシの回帰チェック")
+    parser.add_argument("--database", default="pss_db_bench", help="ベンチマーク用のデータベース名（既存のDBとは別にすること）")
+    parser.add_argument("--reset", action="store_true", help="データベースを作り直してデータを投入する")
+    parser.add_argument("--scale", type=float, default=1.0, help="投入するデータ量の倍率")
+    parser.add_argument("--latency-factor", type=float, default=1.0, help="レイテンシ上限の倍率（遅い環境で実行する場合に大きくする）")
+    args = parser.parse_args()
+
+    if args.reset:
+        reset_database(args.database)
+        engine = create_engine(server_url(args.database))
+        seed(engine, args.scale)
+    else:
+        engine = create_engine(server_url(args.database))
+
+    failures = run_cases(engine, args.latency_factor)
+    engine.dispose()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
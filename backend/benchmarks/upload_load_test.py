@@ -0,0 +1,137 @@
+"""
+バッチアップロード中の他エンドポイントのレイテンシ計測
+
+起動中のサーバーに対して
+1. ベースライン: 無関係なエンドポイント（デフォルト: GET /）を一定間隔で呼び出してレイテンシを計測
+2. 負荷時: 50ファイルのバッチアップロード（POST /images/batch、wait=trueで完了まで待機）を送信しつつ、同じエンドポイントを計測
+を行い、p50 / p95 / p99 / 最大値を比較する。
+アップロード処理がイベントループをブロックしている場合、負荷時のp99がアップロード1件分の処理時間程度まで悪化する。
+
+使い方（backend/ で実行、サーバーは別途起動しておく）:
+    python -m benchmarks.upload_load_test --project-id 1 --user-id 1 --images-dir ./sample_images
+
+--images-dir を省略した場合はランダムなノイズ画像（JPEG）を生成して送信する。
+アップロードした画像はプロジェクトに登録されるため、検証用のプロジェクトで実行すること。
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from io import BytesIO
+from pathlib import Path
+
+import httpx
+
+
+def load_files(images_dir: str | None, count: int, size: int) -> list[tuple[str, bytes, str]]:
+    """送信する画像ファイル（ファイル名, 内容, MIMEタイプ）を用意する"""
+    if images_dir:
+        paths = sorted(p for p in Path(images_dir).iterdir() if p.suffix.lower() in ('.png', '.jpg', '.jpeg'))[:count]
+        return [(p.name, p.read_bytes(), 'image/png' if p.suffix.lower() == '.png' else 'image/jpeg') for p in paths]
+
+    from PIL import Image
+
+    files = []
+    run_id = uuid.uuid4().hex[:8]
+    for i in range(count):
+        image = Image.frombytes('RGB', (size, size), os.urandom(size * size * 3))
+        buffer = BytesIO()
+        image.save(buffer, format='JPEG', quality=90)
+        files.append((f"loadtest_{run_id}_{i:03d}.jpg", buffer.getvalue(), 'image/jpeg'))
+    return files
+
+
+async def probe(client: httpx.AsyncClient, path: str, interval: float, stop: asyncio.Event) -> list[float]:
+    """stopがセットされるまで一定間隔でエンドポイントを呼び出し、レイテンシ（ミリ秒）を記録する"""
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.get(path)
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(label: str, latencies: list[float]):
+    if not latencies:
+        print(f"{label}: 計測なし")
+        return
+    print(
+        f"{label}: n={len(latencies)} "
+        f"p50={statistics.median(latencies):.1f}ms "
+        f"p95={percentile(latencies, 95):.1f}ms "
+        f"p99={percentile(latencies, 99):.1f}ms "
+        f"max={max(latencies):.1f}ms"
+    )
+
+
+async def run(args):
+    files = load_files(args.images_dir, args.files, args.image_size)
+    print(f"📦 送信ファイル数: {len(files)}")
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=None) as probe_client, \
+            httpx.AsyncClient(base_url=args.base_url, timeout=None) as upload_client:
+        # ベースライン
+        stop = asyncio.Event()
+        probe_task = asyncio.create_task(probe(probe_client, args.probe_path, args.interval, stop))
+        await asyncio.sleep(args.baseline_seconds)
+        stop.set()
+        baseline = await probe_task
+
+        # バッチアップロード中
+        stop = asyncio.Event()
+        probe_task = asyncio.create_task(probe(probe_client, args.probe_path, args.interval, stop))
+        started = time.perf_counter()
+        response = await upload_client.post(
+            '/images/batch',
+            data={
+                'project_id': str(args.project_id),
+                'uploaded_user_id': str(args.user_id),
+                'max_concurrent': str(args.max_concurrent),
+                'upload_delay': '0',
+                'wait': 'true',
+            },
+            files=[('files', file) for file in files],
+        )
+        upload_seconds = time.perf_counter() - started
+        stop.set()
+        under_load = await probe_task
+
+    print(f"⏱️ バッチアップロード: status={response.status_code} {upload_seconds:.2f}秒")
+    report("ベースライン", baseline)
+    report("アップロード中", under_load)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="バッチアップロード中の他エンドポイントのレイテンシ計測")
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--project-id', type=int, required=True)
+    parser.add_argument('--user-id', type=int, required=True)
+    parser.add_argument('--images-dir', default=None, help='送信する画像のディレクトリ（省略時はノイズ画像を生成）')
+    parser.add_argument('--files', type=int, default=50, help='送信するファイル数（最大50）')
+    parser.add_argument('--image-size', type=int, default=512, help='生成するノイズ画像の一辺（px）')
+    parser.add_argument('--max-concurrent', type=int, default=3)
+    parser.add_argument('--probe-path', default='/', help='レイテンシを計測するエンドポイント')
+    parser.add_argument('--interval', type=float, default=0.05, help='計測リクエストの間隔（秒）')
+    parser.add_argument('--baseline-seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    if args.files > 50:
+        print("❌ /images/batch は一度に50ファイルまでです")
+        sys.exit(1)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
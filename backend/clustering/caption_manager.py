@@ -1,16 +1,20 @@
+import asyncio
 import base64
 import json
 from glob import glob
 import os
+import random
+import time
 from datetime import datetime
 import re
-from openai import OpenAI
+from threading import Lock
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
 from pathlib import Path
 
 import sys
 sys.path.append('../')
-from config import OPENAI_API_KEY
+from config import OPENAI_API_KEY, CAPTION_CONCURRENCY, CAPTION_REQUESTS_PER_MINUTE, CAPTION_MAX_RETRIES
 
 # .envファイルの内容を読み込見込む
 load_dotenv()
@@ -89,6 +93,49 @@ class CaptionManager:
         "Its category is [free text]."
     )
     
+    # APIキーごとに共有するクライアント（リクエストごとに接続を作り直さない）
+    _clients: dict = {}
+    _async_clients: dict = {}
+    _clients_lock = Lock()
+
+    @classmethod
+    def get_client(cls, openai_api_key: str, base_url: str | None = None) -> OpenAI:
+        """APIキー・接続先ごとに共有の同期クライアントを返す"""
+        key = (openai_api_key, base_url)
+        with cls._clients_lock:
+            if key not in cls._clients:
+                cls._clients[key] = OpenAI(api_key=openai_api_key, base_url=base_url)
+            return cls._clients[key]
+
+    @classmethod
+    def get_async_client(cls, openai_api_key: str, base_url: str | None = None) -> AsyncOpenAI:
+        """
+        APIキー・接続先ごとに共有の非同期クライアントを返す（base_urlでモックサーバーも指定可能）
+        リトライは generate_caption_async がトークンバケットを通して行うため、SDK側のリトライは無効にする
+        """
+        key = (openai_api_key, base_url)
+        with cls._clients_lock:
+            if key not in cls._async_clients:
+                cls._async_clients[key] = AsyncOpenAI(api_key=openai_api_key, base_url=base_url, max_retries=0)
+            return cls._async_clients[key]
+
+    @classmethod
+    def _build_messages(cls, encoded_image: str) -> list[dict]:
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": cls.PROMPT},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpg;base64,{encoded_image}"
+                        }
+                    }
+                ]
+            }
+        ]
+
     @classmethod
     def encode_image(cls, image_path: Path) -> str | None:
         try:
@@ -150,7 +197,7 @@ class CaptionManager:
         Returns:
             tuple[bool, str|None]: (成功フラグ, キャプション)
         """
-        client = OpenAI(api_key=openai_api_key)
+        client = cls.get_client(openai_api_key)
         
         for attempt in range(max_retries):
             try:
@@ -158,20 +205,7 @@ class CaptionManager:
                 
                 response = client.chat.completions.create(
                     model="gpt-4o",
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": cls.PROMPT},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpg;base64,{encoded_image}"
-                                    }
-                                }
-                            ]
-                        }
-                    ],
+                    messages=cls._build_messages(encoded_image),
                     max_tokens=220
                 )
                 
@@ -190,35 +224,265 @@ class CaptionManager:
 
         return False, None
 
-    
+    @classmethod
+    async def generate_caption_async(
+        cls,
+        client: AsyncOpenAI,
+        encoded_image: str,
+        rate_limiter: "TokenBucket",
+        stats: "CaptionPipelineStats",
+        max_retries: int = CAPTION_MAX_RETRIES,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0
+    ) -> tuple[bool, str | None]:
+        """
+        共有の非同期クライアントでキャプション生成（レート制限・指数バックオフ付き）
+
+        Args:
+            client: 共有のAsyncOpenAIクライアント
+            encoded_image: Base64エンコードされた画像
+            rate_limiter: リクエスト送信前にトークンを取得するトークンバケット
+            stats: リトライ等の統計を記録するオブジェクト
+            max_retries: 最大試行回数
+            base_delay: バックオフの初期待機秒数
+            max_delay: バックオフの最大待機秒数
+
+        Returns:
+            tuple[bool, str|None]: (成功フラグ, キャプション)
+        """
+        for attempt in range(max_retries):
+            if attempt > 0:
+                stats.retries += 1
+            await rate_limiter.acquire()
+            stats.requests += 1
+            try:
+                response = await client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=cls._build_messages(encoded_image),
+                    max_tokens=220
+                )
+
+                raw_caption = response.choices[0].message.content or ""
+                caption = cls._sanitize_single_line(raw_caption)
+
+                # 結果は必ず厳密フォーマットで再検証する
+                if cls._check_format(caption):
+                    return True, caption
+
+                stats.format_failures += 1
+                print(f"  ⚠️ 試行 {attempt + 1} 失敗: 形式が不正 ({caption})")
+
+            except Exception as e:
+                stats.api_errors += 1
+                if attempt == max_retries - 1:
+                    # 最後の試行では待機せずに終了する
+                    print(f"  ❌ 試行 {attempt + 1} 失敗: {str(e)}")
+                    break
+                # 指数バックオフ（ジッター付き）
+                delay = min(max_delay, base_delay * (2 ** attempt)) * (0.5 + random.random() / 2)
+                print(f"  ❌ 試行 {attempt + 1} 失敗: {str(e)} ({delay:.1f}秒後に再試行)")
+                await asyncio.sleep(delay)
+
+        return False, None
+
+    @classmethod
+    def load_finished_paths(cls, jsonl_path: Path) -> dict[str, dict]:
+        """再開用: 既存のJSONLから処理済み（成功済み）の結果をパスをキーとして読み込む"""
+        finished = {}
+        if not jsonl_path.exists():
+            return finished
+        with open(jsonl_path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で中断された行は無視する
+                    continue
+                if record.get("is_success"):
+                    finished[record["path"]] = record
+        return finished
+
+    @classmethod
+    async def run_pipeline(
+        cls,
+        image_paths: list[str],
+        jsonl_path: Path,
+        openai_api_key: str,
+        concurrency: int = CAPTION_CONCURRENCY,
+        requests_per_minute: int = CAPTION_REQUESTS_PER_MINUTE,
+        max_retries: int = CAPTION_MAX_RETRIES,
+        base_url: str | None = None,
+        client: AsyncOpenAI | None = None
+    ) -> "CaptionPipelineStats":
+        """
+        画像群のキャプションを並行生成し、結果を1件ずつJSONLに追記する
+        既にJSONLで成功している画像はスキップするため、中断後に同じパスで再実行すれば再開できる
+
+        Args:
+            image_paths: 画像パスの配列
+            jsonl_path: 結果を追記するJSONLファイル
+            openai_api_key: OpenAI APIキー
+            concurrency: 同時に処理する画像数の上限
+            requests_per_minute: 1分あたりのリクエスト上限（トークンバケット）
+            max_retries: 1画像あたりの最大試行回数
+            base_url: APIの接続先（モックサーバー等を使う場合に指定）
+            client: 使用するクライアント（省略時は get_async_client の共有クライアント）
+
+        Returns:
+            CaptionPipelineStats: 実行統計
+        """
+        jsonl_path = Path(jsonl_path)
+        finished = cls.load_finished_paths(jsonl_path)
+        targets = [p for p in image_paths if os.path.basename(p) not in finished]
+
+        stats = CaptionPipelineStats()
+        stats.skipped = len(image_paths) - len(targets)
+        print(f"📊 キャプション生成: 対象 {len(targets)} 件 / スキップ(処理済み) {stats.skipped} 件")
+
+        if client is None:
+            client = cls.get_async_client(openai_api_key, base_url=base_url)
+        rate_limiter = TokenBucket(rate_per_minute=requests_per_minute, capacity=max(1, concurrency))
+        semaphore = asyncio.Semaphore(concurrency)
+        write_lock = asyncio.Lock()
+
+        with open(jsonl_path, 'a', encoding='utf-8') as out:
+            async def process_one(image_path: str):
+                async with semaphore:
+                    encoded_image = await asyncio.to_thread(cls.encode_image, image_path)
+                    if encoded_image is None:
+                        stats.failed += 1
+                        return
+                    success, caption = await cls.generate_caption_async(
+                        client, encoded_image, rate_limiter, stats, max_retries=max_retries
+                    )
+                record = {
+                    "path": os.path.basename(image_path),
+                    "is_success": success,
+                    "caption": caption if caption else "Failed to generate caption"
+                }
+                if success:
+                    stats.succeeded += 1
+                else:
+                    stats.failed += 1
+                async with write_lock:
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+
+            await asyncio.gather(*(process_one(p) for p in targets))
+
+        stats.finish()
+        stats.print_summary()
+        return stats
+
+
+class TokenBucket:
+    """asyncio用のトークンバケット（1分あたりのリクエスト数を制限）"""
+
+    def __init__(self, rate_per_minute: int, capacity: int = 1):
+        self._rate_per_second = max(rate_per_minute, 1) / 60.0
+        self._capacity = max(capacity, 1)
+        self._tokens = float(self._capacity)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """トークンを1つ取得する（不足している場合は補充されるまで待機）"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate_per_second)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate_per_second)
+
+
+class CaptionPipelineStats:
+    """キャプション生成パイプラインの実行統計"""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.requests = 0
+        self.retries = 0
+        self.api_errors = 0
+        self.format_failures = 0
+
+    def finish(self):
+        self.finished_at = time.monotonic()
+
+    @property
+    def elapsed_seconds(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def captions_per_minute(self) -> float:
+        elapsed = self.elapsed_seconds
+        return self.succeeded / elapsed * 60 if elapsed > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "requests": self.requests,
+            "retries": self.retries,
+            "api_errors": self.api_errors,
+            "format_failures": self.format_failures,
+            "elapsed_seconds": round(self.elapsed_seconds, 2),
+            "captions_per_minute": round(self.captions_per_minute, 2)
+        }
+
+    def print_summary(self):
+        print("📊 キャプション生成結果")
+        print(f"  ✅ 成功: {self.succeeded} 件 / ❌ 失敗: {self.failed} 件 / スキップ: {self.skipped} 件")
+        print(f"  リクエスト数: {self.requests} (リトライ {self.retries}, APIエラー {self.api_errors}, 形式不正 {self.format_failures})")
+        print(f"  経過時間: {self.elapsed_seconds:.1f}秒 / {self.captions_per_minute:.1f} captions/min")
+
+
 # メイン関数
 def main():
-    json_output_path = f"captions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    results = []
+    # 引数で既存のJSONLを指定すると、その続きから再開する
+    if len(sys.argv) > 1:
+        jsonl_output_path = Path(sys.argv[1])
+    else:
+        jsonl_output_path = Path(f"captions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
 
-    image_paths = glob("imgs/*.jpg")
-    
-    for idx, image_path in enumerate(image_paths):
-        encoded_image = CaptionManager.encode_image(image_path)
-        if encoded_image is None:
-            continue
-
-        success, caption = CaptionManager.generate_caption(encoded_image,openai_api_key=OPENAI_API_KEY)
-
-        result = {
-            "index": idx,
-            "path": os.path.basename(image_path),
-            "is_success": success,
-            "caption": caption if caption else "Failed to generate caption"
-        }
-        results.append(result)
+    image_paths = sorted(glob("imgs/*.jpg"))
 
-        # 毎ループごとにJSON保存
-        try:
-            with open(json_output_path, 'w', encoding='utf-8') as f:
-                json.dump(results, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Failed to write JSON at index {idx}: {e}")
+    asyncio.run(CaptionManager.run_pipeline(
+        image_paths,
+        jsonl_output_path,
+        openai_api_key=OPENAI_API_KEY,
+        base_url=os.environ.get('OPENAI_BASE_URL')
+    ))
+
+    # キャプションキャッシュ（EXPAMPLE_JSON_PATHS）と同じ「ファイル名 → 結果」形式のJSONにまとめる
+    results = {}
+    with open(jsonl_output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # 同じ画像の結果が複数ある場合は成功した結果を優先
+            if record["path"] not in results or record["is_success"]:
+                results[record["path"]] = {"is_success": record["is_success"], "caption": record["caption"]}
+
+    json_output_path = jsonl_output_path.with_suffix('.json')
+    try:
+        with open(json_output_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✅ JSONを書き出しました: {json_output_path} ({len(results)} 件)")
+    except Exception as e:
+        print(f"Failed to write JSON: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,176 @@
+"""
+コンパイル済みキャプションストア
+
+キャプションJSON（ファイル名 → {is_success, caption}）を以下の2ファイルに変換し、
+メモリマップで参照することで、起動時の全件json.loadとヒープ消費をなくす。
+
+- <prefix>.idx : ヘッダ + キーでソートされた固定長レコード（二分探索用）
+- <prefix>.blob: キーとキャプションのUTF-8バイト列を連結したもの
+
+検索はインデックスの二分探索で O(log n)。実際に参照したページのみが読み込まれる。
+
+変換ツール:
+    python -m clustering.caption_store captions_store captions_a.json captions_b.json
+（後に指定したJSONのエントリが優先される）
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from pathlib import Path
+from threading import Lock
+
+_MAGIC = b"PSSCAP01"
+# ヘッダ: マジック(8) + レコード数(uint64)
+_HEADER = struct.Struct("<8sQ")
+# レコード: key_offset, key_length, caption_offset, caption_length, is_success
+_RECORD = struct.Struct("<QIQIB")
+
+
+def _store_paths(prefix: str | Path) -> tuple[Path, Path]:
+    """プレフィックスからインデックスファイルとblobファイルのパスを返す"""
+    return Path(f"{prefix}.idx"), Path(f"{prefix}.blob")
+
+
+class CaptionStore:
+    """メモリマップしたキャプションストア（読み取り専用）"""
+
+    def __init__(self, prefix: str | Path):
+        idx_path, blob_path = _store_paths(prefix)
+        self._idx_file = open(idx_path, "rb")
+        self._blob_file = open(blob_path, "rb")
+        self._idx = mmap.mmap(self._idx_file.fileno(), 0, access=mmap.ACCESS_READ)
+        # 空のファイルはmmapできないため、キャプションが無い場合はNoneのままにする
+        blob_size = os.fstat(self._blob_file.fileno()).st_size
+        self._blob = mmap.mmap(self._blob_file.fileno(), 0, access=mmap.ACCESS_READ) if blob_size > 0 else None
+
+        magic, self._count = _HEADER.unpack_from(self._idx, 0)
+        if magic != _MAGIC:
+            self.close()
+            raise ValueError(f"不正なキャプションストアです: {prefix}")
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _record(self, i: int) -> tuple:
+        return _RECORD.unpack_from(self._idx, _HEADER.size + i * _RECORD.size)
+
+    def _key(self, record: tuple) -> bytes:
+        key_offset, key_length = record[0], record[1]
+        return self._blob[key_offset:key_offset + key_length]
+
+    def get(self, path: str) -> dict | None:
+        """
+        ファイル名からキャプション情報を取得する
+
+        Args:
+            path: 画像ファイル名
+
+        Returns:
+            dict | None: {"is_success": bool, "caption": str}（存在しない場合はNone）
+        """
+        target = path.encode("utf-8")
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = self._record(mid)
+            key = self._key(record)
+            if key < target:
+                lo = mid + 1
+            elif key > target:
+                hi = mid
+            else:
+                _, _, caption_offset, caption_length, is_success = record
+                caption = self._blob[caption_offset:caption_offset + caption_length].decode("utf-8")
+                return {"is_success": bool(is_success), "caption": caption}
+        return None
+
+    def __contains__(self, path: str) -> bool:
+        return self.get(path) is not None
+
+    def close(self):
+        if self._blob is not None:
+            self._blob.close()
+        self._idx.close()
+        self._blob_file.close()
+        self._idx_file.close()
+
+    @classmethod
+    def exists(cls, prefix: str | Path) -> bool:
+        idx_path, blob_path = _store_paths(prefix)
+        return idx_path.exists() and blob_path.exists()
+
+    @classmethod
+    def build(cls, prefix: str | Path, json_paths: list[str | Path]) -> int:
+        """
+        キャプションJSONからストアを作成する（一時ファイルに書いてから置き換える）
+
+        Args:
+            prefix: 出力ファイルのプレフィックス（.idx / .blob を付与）
+            json_paths: 入力JSONの配列（後のファイルが優先）
+
+        Returns:
+            int: 書き込んだキャプション数
+        """
+        idx_path, blob_path = _store_paths(prefix)
+        merged = {}
+        for json_path in json_paths:
+            with open(json_path, encoding="utf-8") as f:
+                data = json.load(f)
+            merged.update(data)
+            print(f"✅ 読み込み: {Path(json_path).name} ({len(data)} 件)")
+
+        entries = sorted(((key.encode("utf-8"), value) for key, value in merged.items()), key=lambda entry: entry[0])
+
+        idx_tmp = Path(f"{idx_path}.tmp")
+        blob_tmp = Path(f"{blob_path}.tmp")
+        with open(idx_tmp, "wb") as idx_out, open(blob_tmp, "wb") as blob_out:
+            idx_out.write(_HEADER.pack(_MAGIC, len(entries)))
+            offset = 0
+            for key, value in entries:
+                caption = str(value.get("caption", "No caption found.")).encode("utf-8")
+                blob_out.write(key)
+                blob_out.write(caption)
+                idx_out.write(_RECORD.pack(
+                    offset, len(key),
+                    offset + len(key), len(caption),
+                    1 if value.get("is_success", False) else 0
+                ))
+                offset += len(key) + len(caption)
+
+        os.replace(blob_tmp, blob_path)
+        os.replace(idx_tmp, idx_path)
+        print(f"✅ キャプションストアを作成しました: {prefix} ({len(entries)} 件)")
+        return len(entries)
+
+
+# モジュールレベルで一度だけ開く
+_caption_store = None
+_caption_store_lock = Lock()
+
+
+def get_caption_store(prefix: str | Path) -> CaptionStore | None:
+    """CaptionStore を一度だけ開いて返す（ストアが無い場合はNone）"""
+    global _caption_store
+    if _caption_store is None:
+        with _caption_store_lock:
+            if _caption_store is None and CaptionStore.exists(prefix):
+                try:
+                    _caption_store = CaptionStore(prefix)
+                    print(f"✅ キャプションストアを開きました: {prefix} ({len(_caption_store)} 件)")
+                except Exception as e:
+                    print(f"⚠️ キャプションストアを開けませんでした ({prefix}): {e}")
+    return _caption_store
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("使い方: python -m clustering.caption_store <出力プレフィックス> <captions.json> [<captions.json> ...]")
+        sys.exit(1)
+    CaptionStore.build(sys.argv[1], sys.argv[2:])
+
+
+if __name__ == "__main__":
+    main()
@@ -215,6 +215,31 @@ class ChromaDBManager:
             'embeddings': results['embeddings'],
         }
     
+    def get_embeddings_by_ids(
+        self,
+        ids: list[str],
+        batch_size: int = 1000
+    ) -> dict[str, list[float]]:
+        """
+        複数IDの埋め込みベクトルのみをまとめて取得する（メタデータ・ドキュメントは取得しない）
+
+        Args:
+            ids: 取得するIDのリスト
+            batch_size: 1回のgetで問い合わせるID数
+
+        Returns:
+            dict: id -> 埋め込みベクトル（存在しないIDは含まれない）
+        """
+        embeddings = {}
+        for start in range(0, len(ids), batch_size):
+            results = self.collection.get(
+                ids=ids[start:start + batch_size],
+                include=["embeddings"]
+            )
+            for result_id, embedding in zip(results['ids'], results['embeddings']):
+                embeddings[result_id] = embedding
+        return embeddings
+
     def get_data_by_id(
         self,
         id:str
@@ -1,25 +1,184 @@
 import json
 import os
 from pathlib import Path
-import shutil
 import numpy as np
 import copy
+from functools import lru_cache
 import matplotlib.pyplot as plt
 from sklearn.cluster import AgglomerativeClustering
 from sklearn.metrics import silhouette_score
 from .chroma_db_manager import ChromaDBManager
+from .init_image_index import InitImageIndex
 import re
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.feature_extraction import text
+from sklearn.preprocessing import normalize
+from scipy import sparse
 from .embeddings_manager.sentence_embeddings_manager import SentenceEmbeddingsManager
 from .embeddings_manager.image_embeddings_manager import ImageEmbeddingsManager
 from .utils import Utils
-from config import DEFAULT_IMAGE_PATH, MAJOR_COLORS, MAJOR_SHAPES, CAPTION_STOPWORDS
+from config import DEFAULT_IMAGE_PATH, MAJOR_COLORS, MAJOR_SHAPES, CAPTION_STOPWORDS, OUTPUT_MATERIALIZE_MODE
+
+# ベースのストップワード（呼び出しごとにlist化しないようにモジュールロード時に一度だけ作成）
+BASE_STOP_WORDS = frozenset(text.ENGLISH_STOP_WORDS)
+
+
+class ProjectTfidfModel:
+    """
+    プロジェクト全体のキャプションで一度だけ学習するTF-IDFモデル
+    
+    語彙・IDF・文書ごとのTF-IDF行（正規化前）を保持しておき、
+    任意の文書部分集合の上位語は「疎行列の行スライス + 列マスク + 合計」だけで求める。
+    ストップワードの緩和はベクトライザの再学習ではなく列マスクの切り替えで行う。
+    """
+    
+    def __init__(self, documents: list[str]):
+        """
+        Args:
+            documents: プロジェクト内の全キャプション
+        """
+        self._vectorizer = TfidfVectorizer(stop_words=None, norm=None)
+        self._row_index = {}
+        self._stop_masks = {}
+        try:
+            self._matrix = self._vectorizer.fit_transform(documents).tocsr()
+            self._terms = self._vectorizer.get_feature_names_out()
+        except ValueError as e:
+            if "empty vocabulary" not in str(e):
+                raise e
+            print("警告: TF-IDFモデルの語彙が空です")
+            self._matrix = None
+            self._terms = np.array([], dtype=object)
+            return
+        
+        # 同一文書は同じ行を参照する
+        for row, document in enumerate(documents):
+            self._row_index.setdefault(document, row)
+    
+    @property
+    def vocabulary_size(self) -> int:
+        return len(self._terms)
+    
+    def _stop_mask(self, stop_words: frozenset) -> np.ndarray:
+        """ストップワード集合に対応する列の残存マスク（1.0=残す, 0.0=除外）をキャッシュして返す"""
+        mask = self._stop_masks.get(stop_words)
+        if mask is None:
+            mask = np.array([0.0 if term in stop_words else 1.0 for term in self._terms])
+            self._stop_masks[stop_words] = mask
+        return mask
+    
+    def _rows_for_documents(self, documents: list[str]):
+        """文書配列に対応するTF-IDF行（正規化前）を疎行列で返す。学習時に無い文書はその場で変換する"""
+        known_rows = []
+        unknown_documents = []
+        for document in documents:
+            row = self._row_index.get(document)
+            if row is None:
+                unknown_documents.append(document)
+            else:
+                known_rows.append(row)
+        
+        blocks = []
+        if known_rows:
+            blocks.append(self._matrix[known_rows])
+        if unknown_documents:
+            blocks.append(self._vectorizer.transform(unknown_documents))
+        if len(blocks) == 1:
+            return blocks[0]
+        return sparse.vstack(blocks, format='csr')
+    
+    def top_terms(
+        self,
+        documents: list[str],
+        max_words: int = 10,
+        order: str = 'high',
+        stop_word_configurations: tuple = None
+    ) -> list[tuple[str, float]]:
+        """
+        文書部分集合についてTF-IDFスコアの高い/低い語を取得する
+        
+        Args:
+            documents: 対象文書の配列
+            max_words: 取得する最大語数
+            order: 'high'（高い順）または 'low'（低い順）
+            stop_word_configurations: 順に試すストップワード集合のタプル（Noneの要素はストップワードなし）
+        
+        Returns:
+            list[tuple[str, float]]: (語, スコア)のタプルの配列
+        """
+        if order.lower() not in ('high', 'low'):
+            raise ValueError("order parameter must be 'high' or 'low'")
+        if not documents or self._matrix is None:
+            return []
+        
+        rows = self._rows_for_documents(documents)
+        stop_word_configurations = stop_word_configurations or (None,)
+        
+        for attempt, stop_words in enumerate(stop_word_configurations, 1):
+            if stop_words:
+                scored_rows = rows.multiply(self._stop_mask(stop_words)).tocsr()
+            else:
+                scored_rows = rows
+            
+            # TfidfVectorizerのデフォルト(norm='l2')と同様に、ストップワード除外後に行ごとに正規化する
+            scored_rows = normalize(scored_rows, norm='l2', copy=True)
+            sum_scores = np.asarray(scored_rows.sum(axis=0))[0]
+            
+            # 部分集合に出現する語のみを対象にする（部分集合で学習した場合の語彙と同じ）
+            present_idx = np.flatnonzero(sum_scores)
+            if len(present_idx) == 0:
+                print(f"TF-IDF試行 {attempt}: 空の語彙エラー - ストップワードを調整して再試行")
+                continue
+            
+            present_scores = sum_scores[present_idx]
+            if order.lower() == 'high':
+                # 高い順（降順）
+                sorted_idx = present_idx[present_scores.argsort()[::-1]]
+            else:
+                # 低い順（昇順）
+                sorted_idx = present_idx[present_scores.argsort()]
+            
+            result = [(self._terms[idx], float(sum_scores[idx])) for idx in sorted_idx[:max_words]]
+            
+            if attempt > 1:
+                print(f"TF-IDF成功: {attempt}回目の試行でストップワード設定を調整しました")
+            
+            return result
+        
+        # 全ての試行が失敗した場合
+        print("警告: TF-IDFで語彙を取得できませんでした。空のリストを返します。")
+        return []
+
 
 class ClusteringUtils:
     @classmethod
-    def get_tfidf_from_documents_array(cls, documents: list[str], max_words: int = 10, order: str = 'high',extra_stop_words:list[str]=None) -> list[tuple[str, float]]:
+    @lru_cache(maxsize=64)
+    def get_stop_word_configurations(cls, extra_stop_words: tuple = ()) -> tuple:
+        """
+        段階的にストップワードを減らしていくための設定をキャッシュして返す
+        
+        Args:
+            extra_stop_words: 追加ストップワード（キャッシュのためタプルで渡す）
+        
+        Returns:
+            tuple: frozenset または None のタプル（先頭から順に試行する）
+        """
+        return (
+            # 1回目: 全てのストップワードを使用
+            BASE_STOP_WORDS | frozenset(extra_stop_words),
+            # 2回目: MAJOR_COLORSを除外
+            BASE_STOP_WORDS | frozenset(word for word in extra_stop_words if word not in MAJOR_COLORS),
+            # 3回目: 'shape'も除外
+            BASE_STOP_WORDS | frozenset(word for word in extra_stop_words if word not in MAJOR_COLORS and word != 'shape'),
+            # 4回目: ベースのストップワードのみ
+            BASE_STOP_WORDS,
+            # 5回目: ストップワードなし
+            None
+        )
+    
+    @classmethod
+    def get_tfidf_from_documents_array(cls, documents: list[str], max_words: int = 10, order: str = 'high',extra_stop_words:list[str]=None, tfidf_model: ProjectTfidfModel = None) -> list[tuple[str, float]]:
         """
         文書配列からTF-IDFを使用してスコアの高い/低い語を取得する
         空の語彙エラーが発生した場合、段階的にストップワードを減らして再試行する
@@ -29,6 +188,7 @@ class ClusteringUtils:
             max_words: 取得する最大語数（デフォルト: 10）
             order: ソート順 'high'（高い順）または 'low'（低い順）（デフォルト: 'high'）
             extra_stop_words: 追加ストップワード設定
+            tfidf_model: プロジェクト全体で学習済みのモデル（省略時はdocumentsで一度だけ学習する）
         
         Returns:
             list[tuple[str, float]]: (語, スコア)のタプルの配列
@@ -36,65 +196,18 @@ class ClusteringUtils:
         if not documents or len(documents) == 0:
             return []
         
-        # ベースのストップワードを設定
-        base_stop_words = list(text.ENGLISH_STOP_WORDS)
-        extra_stop_words = extra_stop_words or []
+        stop_word_configurations = cls.get_stop_word_configurations(tuple(extra_stop_words or ()))
         
-        # 段階的にストップワードを減らして試行
-        stop_word_configurations = [
-            # 1回目: 全てのストップワードを使用
-            base_stop_words + extra_stop_words,
-            # 2回目: MAJOR_COLORSを除外
-            base_stop_words + [word for word in extra_stop_words if word not in MAJOR_COLORS],
-            # 3回目: 'shape'も除外
-            base_stop_words + [word for word in extra_stop_words if word not in MAJOR_COLORS and word != 'shape'],
-            # 4回目: ベースのストップワードのみ
-            base_stop_words,
-            # 5回目: ストップワードなし
-            None
-        ]
+        # モデル未指定の場合もストップワードなしで一度だけ学習し、緩和は列マスクで行う
+        if tfidf_model is None:
+            tfidf_model = ProjectTfidfModel(documents)
         
-        for attempt, stop_words in enumerate(stop_word_configurations, 1):
-            try:
-                vectorizer = TfidfVectorizer(stop_words=stop_words)
-                tfidf_matrix = vectorizer.fit_transform(documents)
-                
-                # 各語彙のスコア（文書全体での合計スコア）
-                sum_scores = np.asarray(tfidf_matrix.sum(axis=0))[0]
-                terms = vectorizer.get_feature_names_out()
-                
-                # スコア順に並べる
-                if order.lower() == 'high':
-                    # 高い順（降順）
-                    sorted_idx = sum_scores.argsort()[::-1]
-                elif order.lower() == 'low':
-                    # 低い順（昇順）
-                    sorted_idx = sum_scores.argsort()
-                else:
-                    raise ValueError("order parameter must be 'high' or 'low'")
-                
-                # 指定された最大語数まで結果を取得
-                result = []
-                for i, idx in enumerate(sorted_idx[:max_words]):
-                    word = terms[idx]
-                    score = sum_scores[idx]
-                    result.append((word, float(score)))
-                
-                if attempt > 1:
-                    print(f"TF-IDF成功: {attempt}回目の試行でストップワード設定を調整しました")
-                
-                return result
-                
-            except ValueError as e:
-                if "empty vocabulary" in str(e):
-                    print(f"TF-IDF試行 {attempt}: 空の語彙エラー - ストップワードを調整して再試行")
-                    continue
-                else:
-                    raise e
-        
-        # 全ての試行が失敗した場合
-        print("警告: TF-IDFで語彙を取得できませんでした。空のリストを返します。")
-        return []
+        return tfidf_model.top_terms(
+            documents=documents,
+            max_words=max_words,
+            order=order,
+            stop_word_configurations=stop_word_configurations
+        )
         
         
 class InitClusteringManager:
@@ -700,9 +813,10 @@ class InitClusteringManager:
         
         return result
 
-    def _get_folder_name(self, captions: list[str], extra_stop_words: list[str]) -> str:
+    def _get_folder_name(self, captions: list[str], extra_stop_words: list[str], tfidf_model: ProjectTfidfModel = None) -> str:
         """
         TF-IDFを使用してフォルダ名を決定する（最上位1語を日本語に翻訳）
+        tfidf_modelが渡された場合はプロジェクト全体で学習済みのモデルから行を集計する
         """
         if not captions:
             return Utils.generate_uuid()
@@ -710,7 +824,8 @@ class InitClusteringManager:
         important_words = ClusteringUtils.get_tfidf_from_documents_array(
             documents=captions,
             max_words=1,
-            extra_stop_words=extra_stop_words
+            extra_stop_words=extra_stop_words,
+            tfidf_model=tfidf_model
         )
 
         if not important_words:
@@ -858,9 +973,7 @@ class InitClusteringManager:
         self, 
         sentence_name_db_data: dict[str, list],
         image_db_data: dict[str, list],
-        clustering_id_dict: dict,
-        sentence_id_dict: dict,
-        image_id_dict: dict,
+        image_index: InitImageIndex,
         cluster_num: int, 
         overall_folder_name: str = None,
         output_folder: bool = False, 
@@ -880,7 +993,7 @@ class InitClusteringManager:
         print(f"{'='*80}\n")
         
         # clustering_idのリストを作成
-        clustering_id_list = list(clustering_id_dict.keys())
+        clustering_id_list = list(image_index.clustering_ids)
         print(f"  - 対象clustering_id数: {len(clustering_id_list)}")
         
         # データベースからfolder_nameを取得
@@ -903,8 +1016,8 @@ class InitClusteringManager:
         uncategorized = []  # folder_name=NULLの画像
         
         for clustering_id, metadata in zip(sentence_name_db_data.get('ids', []), sentence_name_db_data.get('metadatas', [])):
-            if clustering_id in sentence_id_dict:
-                actual_clustering_id = sentence_id_dict[clustering_id]['clustering_id']
+            if clustering_id in image_index:
+                actual_clustering_id = image_index.clustering_id_of(clustering_id)
                 path = metadata.path if hasattr(metadata, 'path') else metadata.get('path', 'N/A')
                 
                 # folder_nameを取得
@@ -1018,9 +1131,7 @@ class InitClusteringManager:
         self, 
         sentence_name_db_data: dict[str, list],
         image_db_data: dict[str, list],
-        clustering_id_dict: dict,
-        sentence_id_dict: dict,
-        image_id_dict: dict,
+        image_index: InitImageIndex,
         cluster_num: int, 
         overall_folder_name: str = None,
         output_folder: bool = False, 
@@ -1037,26 +1148,19 @@ class InitClusteringManager:
         print(f"=== 新3段階クラスタリングアルゴリズム開始 ===")
         print(f"Total documents: {len(sentence_name_db_data['ids'])}")
         
-        # JSON出力オプションまたはフォルダ出力オプションがTrueの場合、output_base_pathをクリアして新たに作成
+        # JSON出力オプションまたはフォルダ出力オプションがTrueの場合、output_base_pathを作成
+        # （フォルダ出力は差分のみ更新するため、ここでは削除しない）
         if output_json or output_folder:
-            if self.output_base_path.exists():
-                shutil.rmtree(self.output_base_path)
-                os.makedirs(self.output_base_path, exist_ok=True)
+            os.makedirs(self.output_base_path, exist_ok=True)
         
         # 画像埋め込みベクトルの辞書を作成（sentence_id -> image_embedding）
+        # （image_db_dataの位置を先に索引化し、画像ごとの線形探索をしない）
         image_embeddings_dict = {}
-        for sentence_id in sentence_id_dict.keys():
-            clustering_id = sentence_id_dict[sentence_id]['clustering_id']
-            # clustering_idからimage_idを取得
-            for cid, ids_dict in clustering_id_dict.items():
-                if cid == clustering_id and 'image_id' in ids_dict:
-                    image_id = ids_dict['image_id']
-                    # image_db_dataからembeddingを取得
-                    for i, iid in enumerate(image_db_data['ids']):
-                        if iid == image_id:
-                            image_embeddings_dict[sentence_id] = image_db_data['embeddings'][i]
-                            break
-                    break
+        image_positions = {iid: i for i, iid in enumerate(image_db_data['ids'])}
+        for sentence_id, image_id in zip(image_index.sentence_ids, image_index.image_ids):
+            position = image_positions.get(image_id)
+            if position is not None:
+                image_embeddings_dict[sentence_id] = image_db_data['embeddings'][position]
         
         # ========================================
         # 第1段階: usage + category でクラスタリング（大カテゴリ分類）
@@ -1064,8 +1168,8 @@ class InitClusteringManager:
         print("\n【第1段階】usage + category でクラスタリング")
         
         # usage + categoryの埋め込みを取得（2文目と3文目）
-        usage_data = self._sentence_usage_db.get_data_by_sentence_ids(sentence_id_dict.keys())
-        category_data = self._sentence_category_db.get_data_by_sentence_ids(sentence_id_dict.keys())
+        usage_data = self._sentence_usage_db.get_data_by_sentence_ids(image_index.sentence_ids)
+        category_data = self._sentence_category_db.get_data_by_sentence_ids(image_index.sentence_ids)
         
         # usage + categoryの埋め込みを結合
         combined_embeddings = []
@@ -1080,7 +1184,7 @@ class InitClusteringManager:
         
         # クラスタリング実行
         if overall_cluster_num <= 1:
-            overall_clusters = {0: list(sentence_id_dict.keys())}
+            overall_clusters = {0: list(image_index.sentence_ids)}
         else:
             embeddings_array = np.array([emb.tolist() if hasattr(emb, 'tolist') else emb for emb in combined_embeddings])
             
@@ -1120,6 +1224,12 @@ class InitClusteringManager:
                         break
             all_overall_captions_by_cluster[overall_idx] = overall_captions
         
+        # プロジェクト全体のキャプションでTF-IDFモデルを一度だけ学習（フォルダ名決定で使い回す）
+        project_tfidf_model = ProjectTfidfModel(
+            [caption for captions in all_overall_captions_by_cluster.values() for caption in captions]
+            + [document.document for document in sentence_name_db_data['documents']]
+        )
+        
         for overall_idx, sentence_ids_in_overall in overall_clusters.items():
             overall_folder_id = Utils.generate_uuid()
             
@@ -1134,7 +1244,7 @@ class InitClusteringManager:
                     ['object','main','its','used'] + MAJOR_COLORS + MAJOR_SHAPES
                 )
             else:
-                overall_folder_name_tfidf = self._get_folder_name(target_captions, ['object','main','its','used'] + MAJOR_COLORS + MAJOR_SHAPES)
+                overall_folder_name_tfidf = self._get_folder_name(target_captions, ['object','main','its','used'] + MAJOR_COLORS + MAJOR_SHAPES, tfidf_model=project_tfidf_model)
             
             print(f"\n【第2段階】nameでクラスタリング (第1段階クラスタ {overall_idx}: {overall_folder_name_tfidf})")
             
@@ -1220,7 +1330,7 @@ class InitClusteringManager:
                     print(f"    📁 リーフフォルダ名生成（同階層比較）: '{name_folder_name}' (ID: {name_folder_id})")
                 else:
                     # 1つしかない場合は通常のTF-IDF
-                    name_folder_name = self._get_folder_name(name_captions, ['object','main','its','the'] + MAJOR_COLORS + MAJOR_SHAPES)
+                    name_folder_name = self._get_folder_name(name_captions, ['object','main','its','the'] + MAJOR_COLORS + MAJOR_SHAPES, tfidf_model=project_tfidf_model)
                     print(f"    📁 リーフフォルダ名生成（TF-IDF）: '{name_folder_name}' (ID: {name_folder_id})")
                 
                 # ========================================
@@ -1229,8 +1339,8 @@ class InitClusteringManager:
                 leaf_data = {}
                 
                 for sentence_id in sentence_ids_in_name:
-                    if sentence_id in sentence_id_dict:
-                        clustering_id = sentence_id_dict[sentence_id]['clustering_id']
+                    if sentence_id in image_index:
+                        clustering_id = image_index.clustering_id_of(sentence_id)
                         
                         # metadataを取得
                         for i, sid in enumerate(sentence_name_db_data['ids']):
@@ -1275,24 +1385,6 @@ class InitClusteringManager:
         result_clustering_uuid_dict = overall_result_dict
                 
         #フォルダ出力オプションがTrueの時クラスタリング結果をフォルダとして出力
-        if output_folder:
-            def copy_tree(node: dict, output_path: Path, images_folder_path: Path):
-                os.makedirs(output_path, exist_ok=True)
-                
-                if node['is_leaf']:
-                    for filename in node['data'].values():
-                        src = images_folder_path / Path(filename)
-                        dst = output_path / Path(filename)
-                        shutil.copy(src, dst)
-                else:
-                    for folder_id, child_node in node['data'].items():
-                        child_output_path = output_path / Path(folder_id)
-                        copy_tree(child_node, child_output_path, images_folder_path)
-                        
-            for _folder_id, value in result_clustering_uuid_dict.items():
-                output_path = self.output_base_path / Path(_folder_id)
-                copy_tree(value, output_path, self.images_folder_path)
-                
         # 全体をまとめたフォルダ要素でラップ
         top_folder_id = Utils.generate_uuid()
         
@@ -1323,10 +1415,37 @@ class InitClusteringManager:
         print(f"✅ all_nodes生成完了: {len(all_nodes)}個のノード")
         
         
+        # デバッグ用の出力（フォルダ・整形JSON）
+        if output_folder or output_json:
+            self.write_debug_outputs(wrapped_result, all_nodes, output_folder=output_folder, output_json=output_json)
+                
+        print(f"\n=== クラスタリング完了 ===")
+        return wrapped_result,all_nodes
+    
+    def write_debug_outputs(self, wrapped_result: dict, all_nodes: list, output_folder: bool = True, output_json: bool = True):
+        """
+        クラスタリング結果のデバッグ用出力を書き出す（クラスタリング本体とは独立して後から実行可能）
+        
+        Args:
+            wrapped_result: トップフォルダでラップされた分類結果
+            all_nodes: create_all_nodesで作成したノード一覧
+            output_folder: 分類結果をフォルダとして出力する（画像はハードリンク等で配置）
+            output_json: result.json / all_nodes.json を整形して出力する
+        """
+        os.makedirs(self._output_base_path, exist_ok=True)
+        
+        #フォルダ出力オプションがTrueの時クラスタリング結果をフォルダとして出力
+        # 画像はハードリンク等で配置し、前回から変更のあったフォルダのみ更新する
+        if output_folder:
+            for top_folder in wrapped_result.values():
+                Utils.materialize_tree(
+                    top_folder['data'],
+                    self.images_folder_path,
+                    self.output_base_path,
+                    mode=OUTPUT_MATERIALIZE_MODE
+                )
+        
         if output_json:
-            # 出力ディレクトリが存在しない場合は作成
-            os.makedirs(self._output_base_path, exist_ok=True)
-            
             output_json_path = self._output_base_path / "result.json"
             with open(output_json_path, "w", encoding="utf-8") as f:
                 json.dump(wrapped_result, f, ensure_ascii=False, indent=2)  
@@ -1334,9 +1453,6 @@ class InitClusteringManager:
             output_json_path= self._output_base_path / "all_nodes.json"
             with open(output_json_path, "w", encoding="utf-8") as f:
                 json.dump(all_nodes, f, ensure_ascii=False, indent=2)
-                
-        print(f"\n=== クラスタリング完了 ===")
-        return wrapped_result,all_nodes
     
     def create_folder_nodes(self,data, parent_id=None, result=None):
         """
@@ -1443,9 +1559,7 @@ if __name__ == "__main__":
     cluster_result = cl_module.clustering(
         sentence_name_db_data=cl_module.sentence_name_db.get_all(), 
         image_db_data=cl_module.image_db.get_all(),
-        clustering_id_dict={}, 
-        sentence_id_dict={}, 
-        image_id_dict={}, 
+        image_index=InitImageIndex(),
         cluster_num=cluster_num,
         output_folder=True, 
         output_json=True
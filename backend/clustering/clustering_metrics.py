@@ -11,9 +11,12 @@
 7. 処理時間
 """
 
+import time
+from array import array
+from threading import Lock
 import numpy as np
-from typing import Dict, List, Any, Tuple
-from collections import Counter, defaultdict
+from typing import Dict, List, Any
+from collections import defaultdict
 
 
 class ClusteringMetrics:
@@ -26,7 +29,8 @@ class ClusteringMetrics:
         self,
         reports_data: List[Dict[str, Any]],
         folder_data: Dict[str, Any],
-        similarity_threshold: float = 0.4
+        similarity_threshold: float = 0.4,
+        embeddings: Dict[str, Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """
         全ての評価指標を計算
@@ -35,6 +39,7 @@ class ClusteringMetrics:
             reports_data: 各画像のレポートデータリスト
             folder_data: フォルダ構造データ
             similarity_threshold: 類似度閾値
+            embeddings: 埋め込みの種類 → {clustering_id: 埋め込みベクトル}（階層構造の品質評価に使用）
             
         Returns:
             評価指標の辞書
@@ -42,174 +47,29 @@ class ClusteringMetrics:
         if not reports_data:
             return {}
         
-        metrics = {}
-        
-        # 基本統計
-        metrics['basic_stats'] = self._calculate_basic_stats(reports_data)
-        
-        # 分類成功率・新規フォルダ作成率
-        metrics['classification_success'] = self._calculate_classification_success(
-            reports_data, similarity_threshold
-        )
-        
-        # 類似度統計
-        metrics['similarity_stats'] = self._calculate_similarity_stats(reports_data)
-        
-        # フォルダバランス
-        metrics['folder_balance'] = self._calculate_folder_balance(reports_data, folder_data)
-        
-        # 分類基準の一貫性
-        metrics['criteria_consistency'] = self._calculate_criteria_consistency(reports_data)
-        
-        # 信頼度スコア
-        metrics['confidence_scores'] = self._calculate_confidence_scores(reports_data)
-        
-        # パフォーマンス評価
-        metrics['performance'] = self._calculate_performance_metrics(reports_data)
-        
-        # エラー分析
-        metrics['error_analysis'] = self._calculate_error_analysis(reports_data)
-        
-        # 階層構造の品質
-        if folder_data:
-            metrics['hierarchy_quality'] = self._calculate_hierarchy_quality(folder_data)
-        
-        return metrics
+        accumulator = MetricsAccumulator(similarity_threshold)
+        for report in reports_data:
+            accumulator.add(report)
+        return accumulator.compute(folder_data, embeddings)
     
-    def _calculate_basic_stats(self, reports_data: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """基本統計を計算"""
-        total_images = len(reports_data)
-        
-        # 新規フォルダ作成数
-        new_folders_count = sum(1 for r in reports_data if r.get('new_folder_created', False))
-        
-        # 既存フォルダへの分類数
-        existing_folders_count = total_images - new_folders_count
-        
-        # 分類基準使用数
-        criteria_used_count = sum(1 for r in reports_data if r.get('classification_criteria_used', False))
-        
-        # エラー発生数
-        error_count = sum(1 for r in reports_data if len(r.get('errors', [])) > 0)
-        
-        return {
-            'total_images': total_images,
-            'new_folders_created': new_folders_count,
-            'new_folder_ratio': new_folders_count / total_images if total_images > 0 else 0,
-            'existing_folder_assignments': existing_folders_count,
-            'existing_folder_ratio': existing_folders_count / total_images if total_images > 0 else 0,
-            'criteria_based_classifications': criteria_used_count,
-            'criteria_usage_ratio': criteria_used_count / total_images if total_images > 0 else 0,
-            'errors_occurred': error_count,
-            'error_ratio': error_count / total_images if total_images > 0 else 0
-        }
-    
-    def _calculate_classification_success(
-        self,
-        reports_data: List[Dict[str, Any]],
-        threshold: float
-    ) -> Dict[str, Any]:
+    @staticmethod
+    def load_node_embeddings(embedding_db, id_map: Dict[str, str], batch_size: int = 1000) -> Dict[str, Any]:
         """
-        分類成功率を計算
+        画像の埋め込みベクトルをChromaDBからまとめて取得する
         
-        画像の指標に対応:
-        - 適切なフォルダに分類された画像数・割合
-        - 新規フォルダ作成数・割合
+        Args:
+            embedding_db: ChromaDBManager
+            id_map: clustering_id -> ChromaDBのID
+            batch_size: 1回のgetで問い合わせるID数
+            
+        Returns:
+            clustering_id -> 埋め込みベクトル
         """
-        total = len(reports_data)
-        
-        # 閾値以上の類似度で既存フォルダに分類された画像
-        high_confidence_existing = sum(
-            1 for r in reports_data
-            if not r.get('new_folder_created', False) 
-            and r.get('final_similarity', 0) >= threshold
-        )
-        
-        # 閾値以下で新規フォルダが作成された画像
-        appropriate_new_folders = sum(
-            1 for r in reports_data
-            if r.get('new_folder_created', False)
-            and r.get('final_similarity', 0) < threshold
-        )
-        
-        # 適切に分類された画像の総数
-        appropriate_classifications = high_confidence_existing + appropriate_new_folders
-        
+        chroma_embeddings = embedding_db.get_embeddings_by_ids(list(id_map.values()), batch_size=batch_size)
         return {
-            'appropriate_classifications': appropriate_classifications,
-            'appropriate_classification_ratio': appropriate_classifications / total if total > 0 else 0,
-            'high_confidence_existing_folder': high_confidence_existing,
-            'high_confidence_existing_ratio': high_confidence_existing / total if total > 0 else 0,
-            'appropriate_new_folders': appropriate_new_folders,
-            'appropriate_new_folder_ratio': appropriate_new_folders / total if total > 0 else 0,
-            'threshold_used': threshold
-        }
-    
-    def _calculate_similarity_stats(self, reports_data: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """類似度の統計情報を計算"""
-        similarities = [r.get('final_similarity', 0) for r in reports_data]
-        
-        if not similarities:
-            return {}
-        
-        similarities = np.array(similarities)
-        
-        # 類似度タイプの分布
-        similarity_types = [r.get('final_similarity_type', 'unknown') for r in reports_data]
-        type_counter = Counter(similarity_types)
-        
-        return {
-            'mean_similarity': float(np.mean(similarities)),
-            'median_similarity': float(np.median(similarities)),
-            'std_similarity': float(np.std(similarities)),
-            'min_similarity': float(np.min(similarities)),
-            'max_similarity': float(np.max(similarities)),
-            'quartiles': {
-                'q1': float(np.percentile(similarities, 25)),
-                'q2': float(np.percentile(similarities, 50)),
-                'q3': float(np.percentile(similarities, 75))
-            },
-            'similarity_type_distribution': dict(type_counter),
-            'sentence_based_ratio': type_counter.get('sentence', 0) / len(similarities) if len(similarities) > 0 else 0,
-            'image_based_ratio': type_counter.get('image', 0) / len(similarities) if len(similarities) > 0 else 0
-        }
-    
-    def _calculate_folder_balance(
-        self,
-        reports_data: List[Dict[str, Any]],
-        folder_data: Dict[str, Any]
-    ) -> Dict[str, Any]:
-        """フォルダ間のバランスを評価"""
-        # 各フォルダに追加された画像数
-        folder_assignments = defaultdict(int)
-        for r in reports_data:
-            folder_id = r.get('final_folder_id')
-            if folder_id:
-                folder_assignments[folder_id] += 1
-        
-        if not folder_assignments:
-            return {}
-        
-        assignment_counts = list(folder_assignments.values())
-        assignment_counts_array = np.array(assignment_counts)
-        
-        # ジニ係数（不平等度）を計算
-        gini = self._calculate_gini_coefficient(assignment_counts_array)
-        
-        # 変動係数（CV）
-        mean_assignments = np.mean(assignment_counts_array)
-        cv = np.std(assignment_counts_array) / mean_assignments if mean_assignments > 0 else 0
-        
-        return {
-            'total_folders_used': len(folder_assignments),
-            'mean_images_per_folder': float(mean_assignments),
-            'std_images_per_folder': float(np.std(assignment_counts_array)),
-            'min_images_per_folder': int(np.min(assignment_counts_array)),
-            'max_images_per_folder': int(np.max(assignment_counts_array)),
-            'gini_coefficient': float(gini),
-            'coefficient_of_variation': float(cv),
-            'balance_score': float(1 - gini),  # 0-1, 1が最もバランスが良い
-            'folder_assignment_distribution': dict(folder_assignments)
+            clustering_id: chroma_embeddings[chroma_id]
+            for clustering_id, chroma_id in id_map.items()
+            if chroma_id in chroma_embeddings
         }
     
     def _calculate_gini_coefficient(self, values: np.ndarray) -> float:
@@ -219,143 +79,221 @@ class ClusteringMetrics:
         
         sorted_values = np.sort(values)
         n = len(values)
-        cumsum = np.cumsum(sorted_values)
         
         # ジニ係数の計算
         gini = (2 * np.sum((np.arange(1, n + 1)) * sorted_values)) / (n * np.sum(sorted_values)) - (n + 1) / n
         
         return float(gini)
     
-    def _calculate_criteria_consistency(self, reports_data: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """分類基準の一貫性を評価"""
-        criteria_used = [r for r in reports_data if r.get('classification_criteria_used', False)]
-        total_criteria_used = len(criteria_used)
+    def _calculate_hierarchy_quality(
+        self,
+        folder_data: Dict[str, Any] | List[Dict[str, Any]],
+        embeddings: Dict[str, Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        階層構造の品質を評価
         
-        if total_criteria_used == 0:
-            return {
-                'criteria_used_count': 0,
-                'consistency_score': 0.0,
-                'note': '分類基準が使用されていません'
-            }
+        all_nodes（ノードID → {type, id, name, parent_id, is_leaf}）を1回走査して親子の配列を作り、
+        深さごとの集計はNumPyでまとめて行う。
         
-        # 分類基準が使用された場合の成功率
-        criteria_success = sum(
-            1 for r in criteria_used
-            if r.get('final_similarity', 0) >= 0.5  # 一定以上の類似度
-        )
+        - 構造: 深さ・階層ごとのフォルダ数（幅）・分岐数・リーフフォルダの画像数分布
+        - 埋め込み（embeddings指定時）: 階層ごとのフォルダ内凝集度と兄弟フォルダ間の分離度
         
-        consistency_score = criteria_success / total_criteria_used if total_criteria_used > 0 else 0
+        正規化した埋め込みの合計ベクトル S（画像数 n）から
+        凝集度 = 重心とのコサイン類似度の平均 = |S| / n、
+        兄弟フォルダの重心単位ベクトルの合計 U（k個）から
+        分離度 = 1 - 兄弟間のコサイン類似度の平均 = 1 - (|U|^2 - k) / (k(k-1)) を求めるため、
+        画像同士・フォルダ同士のペアを作らずに O(画像数 × 次元数) で計算できる。
         
-        return {
-            'criteria_used_count': total_criteria_used,
-            'criteria_success_count': criteria_success,
-            'consistency_score': float(consistency_score),
-            'consistency_percentage': float(consistency_score * 100)
+        Args:
+            folder_data: all_nodes（辞書またはノードのリスト）
+            embeddings: 埋め込みの種類 → {clustering_id: 埋め込みベクトル}
+            
+        Returns:
+            階層構造の品質指標の辞書
+        """
+        if not folder_data:
+            return {'folder_data_available': False}
+        
+        nodes = folder_data.values() if isinstance(folder_data, dict) else folder_data
+        
+        folder_ids = []
+        folder_parents = []
+        folder_is_leaf = []
+        files = []
+        for node in nodes:
+            if not isinstance(node, dict):
+                continue
+            if node.get('type') == 'file':
+                files.append((node.get('id'), node.get('parent_id')))
+            else:
+                folder_ids.append(node.get('id'))
+                folder_parents.append(node.get('parent_id'))
+                folder_is_leaf.append(bool(node.get('is_leaf', False)))
+        
+        n_folders = len(folder_ids)
+        if n_folders == 0:
+            return {'folder_data_available': False}
+        
+        # トップレベルのフォルダは仮想ルート（インデックス n_folders）の子として扱う
+        folder_index = {folder_id: i for i, folder_id in enumerate(folder_ids)}
+        root = n_folders
+        parent_idx = np.array([folder_index.get(parent_id, root) for parent_id in folder_parents], dtype=np.int64)
+        is_leaf = np.array(folder_is_leaf, dtype=bool)
+        
+        # 深さ（トップレベル = 0）
+        depth = np.full(n_folders, -1, dtype=np.int64)
+        for i in range(n_folders):
+            chain = []
+            current = i
+            while current != root and depth[current] < 0 and len(chain) <= n_folders:
+                chain.append(current)
+                current = parent_idx[current]
+            base = -1 if current == root or len(chain) > n_folders else depth[current]
+            for offset, node_index in enumerate(reversed(chain), 1):
+                depth[node_index] = base + offset
+        max_depth = int(depth.max())
+        
+        # 画像 → 所属フォルダ
+        file_ids = [file_id for file_id, parent_id in files if parent_id in folder_index]
+        file_folder = np.array([folder_index[parent_id] for _, parent_id in files if parent_id in folder_index], dtype=np.int64)
+        direct_counts = np.bincount(file_folder, minlength=n_folders) if len(file_folder) > 0 else np.zeros(n_folders, dtype=np.int64)
+        
+        # 構造の指標
+        level_widths = np.bincount(depth, minlength=max_depth + 1)
+        child_counts = np.bincount(parent_idx, minlength=n_folders + 1)
+        inner_child_counts = child_counts[:n_folders][~is_leaf]
+        leaf_sizes = direct_counts[is_leaf]
+        
+        quality = {
+            'folder_data_available': True,
+            'total_folders': n_folders,
+            'leaf_folders': int(is_leaf.sum()),
+            'total_images': int(len(file_folder)),
+            'max_depth': max_depth,
+            'level_widths': {str(level): int(width) for level, width in enumerate(level_widths)},
+            'top_level_folders': int(child_counts[root]),
+            'mean_branching_factor': float(np.mean(inner_child_counts)) if len(inner_child_counts) > 0 else 0.0,
+            'max_branching_factor': int(np.max(inner_child_counts)) if len(inner_child_counts) > 0 else 0,
+            'leaf_depth_distribution': {str(level): int(count) for level, count in enumerate(np.bincount(depth[is_leaf], minlength=max_depth + 1))},
         }
-    
-    def _calculate_confidence_scores(self, reports_data: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """分類の信頼度スコアを計算"""
-        # 信頼度の定義: 類似度が高く、エラーがない分類
-        high_confidence_threshold = 0.7
-        medium_confidence_threshold = 0.5
-        
-        high_confidence = sum(
-            1 for r in reports_data
-            if r.get('final_similarity', 0) >= high_confidence_threshold
-            and len(r.get('errors', [])) == 0
-        )
         
-        medium_confidence = sum(
-            1 for r in reports_data
-            if medium_confidence_threshold <= r.get('final_similarity', 0) < high_confidence_threshold
-            and len(r.get('errors', [])) == 0
-        )
-        
-        low_confidence = len(reports_data) - high_confidence - medium_confidence
-        
-        total = len(reports_data)
-        
-        return {
-            'high_confidence_count': high_confidence,
-            'high_confidence_ratio': high_confidence / total if total > 0 else 0,
-            'medium_confidence_count': medium_confidence,
-            'medium_confidence_ratio': medium_confidence / total if total > 0 else 0,
-            'low_confidence_count': low_confidence,
-            'low_confidence_ratio': low_confidence / total if total > 0 else 0,
-            'thresholds': {
-                'high': high_confidence_threshold,
-                'medium': medium_confidence_threshold
+        if len(leaf_sizes) > 0:
+            quality['leaf_size_stats'] = {
+                'mean': float(np.mean(leaf_sizes)),
+                'median': float(np.median(leaf_sizes)),
+                'std': float(np.std(leaf_sizes)),
+                'min': int(np.min(leaf_sizes)),
+                'max': int(np.max(leaf_sizes)),
+                'p90': float(np.percentile(leaf_sizes, 90)),
+                'singleton_leaves': int((leaf_sizes == 1).sum()),
+                'empty_leaves': int((leaf_sizes == 0).sum()),
+                'gini_coefficient': self._calculate_gini_coefficient(leaf_sizes) if leaf_sizes.sum() > 0 else 0.0
             }
-        }
-    
-    def _calculate_performance_metrics(self, reports_data: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """パフォーマンス指標を計算"""
-        # ベクトル取得成功率
-        sentence_embedding_success = sum(
-            1 for r in reports_data
-            if r.get('sentence_embedding_available', False)
-        )
-        
-        image_embedding_success = sum(
-            1 for r in reports_data
-            if r.get('image_embedding_available', False)
-        )
-        
-        total = len(reports_data)
         
-        return {
-            'sentence_embedding_success_rate': sentence_embedding_success / total if total > 0 else 0,
-            'image_embedding_success_rate': image_embedding_success / total if total > 0 else 0,
-            'both_embeddings_available': sum(
-                1 for r in reports_data
-                if r.get('sentence_embedding_available', False) 
-                and r.get('image_embedding_available', False)
-            ),
-            'both_embeddings_available_rate': sum(
-                1 for r in reports_data
-                if r.get('sentence_embedding_available', False) 
-                and r.get('image_embedding_available', False)
-            ) / total if total > 0 else 0
-        }
+        # 埋め込みによる凝集度・分離度
+        if embeddings:
+            quality['embedding_quality'] = {}
+            for embedding_type, vectors in embeddings.items():
+                if not vectors:
+                    continue
+                quality['embedding_quality'][embedding_type] = self._calculate_embedding_hierarchy_quality(
+                    vectors, file_ids, file_folder, parent_idx, depth, max_depth
+                )
+        
+        return quality
     
-    def _calculate_error_analysis(self, reports_data: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """エラー分析"""
-        error_types = defaultdict(int)
-        
-        for r in reports_data:
-            errors = r.get('errors', [])
-            if errors:
-                for error in errors:
-                    # エラーメッセージからタイプを抽出
-                    if '文章埋め込み' in error:
-                        error_types['sentence_embedding_error'] += 1
-                    elif '画像埋め込み' in error:
-                        error_types['image_embedding_error'] += 1
-                    elif 'フォルダ' in error:
-                        error_types['folder_error'] += 1
-                    else:
-                        error_types['other_error'] += 1
-        
-        total_errors = sum(error_types.values())
-        
-        return {
-            'total_errors': total_errors,
-            'error_type_distribution': dict(error_types),
-            'images_with_errors': sum(1 for r in reports_data if len(r.get('errors', [])) > 0),
-            'error_free_ratio': sum(
-                1 for r in reports_data if len(r.get('errors', [])) == 0
-            ) / len(reports_data) if len(reports_data) > 0 else 0
-        }
+    @staticmethod
+    def _group_sum(values: np.ndarray, groups: np.ndarray, n_groups: int) -> np.ndarray:
+        """行をグループごとに合計する（np.add.at より高速なソート + reduceat）"""
+        sums = np.zeros((n_groups, values.shape[1]), dtype=np.float64)
+        if len(groups) == 0:
+            return sums
+        order = np.argsort(groups, kind='stable')
+        sorted_groups = groups[order]
+        starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+        sums[sorted_groups[starts]] = np.add.reduceat(values[order].astype(np.float64), starts, axis=0)
+        return sums
     
-    def _calculate_hierarchy_quality(self, folder_data: Dict[str, Any]) -> Dict[str, Any]:
-        """階層構造の品質を評価"""
-        # この関数は folder_data の構造に依存するため、
-        # 実際のデータ構造に合わせて実装が必要
+    def _calculate_embedding_hierarchy_quality(
+        self,
+        vectors: Dict[str, Any],
+        file_ids: List[str],
+        file_folder: np.ndarray,
+        parent_idx: np.ndarray,
+        depth: np.ndarray,
+        max_depth: int
+    ) -> Dict[str, Any]:
+        """
+        階層ごとの凝集度・兄弟フォルダ間の分離度を計算（_calculate_hierarchy_quality から呼び出す）
+        
+        Args:
+            vectors: clustering_id -> 埋め込みベクトル
+            file_ids: 画像のclustering_id（file_folder と同じ順序）
+            file_folder: 画像の所属フォルダのインデックス
+            parent_idx: フォルダの親インデックス（トップレベルは仮想ルート = フォルダ数）
+            depth: フォルダの深さ
+            max_depth: 最大の深さ
         
-        # 仮実装: 基本的な統計のみ
+        Returns:
+            埋め込みによる品質指標の辞書
+        """
+        n_folders = len(parent_idx)
+        root = n_folders
+        
+        rows = np.array([i for i, file_id in enumerate(file_ids) if file_id in vectors], dtype=np.int64)
+        if len(rows) == 0:
+            return {'images_with_embeddings': 0}
+        
+        matrix = np.asarray([vectors[file_ids[i]] for i in rows], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms > 0, norms, 1.0)
+        
+        # フォルダごとの正規化ベクトルの合計と画像数（子孫フォルダの画像を含む）
+        sums = self._group_sum(matrix, file_folder[rows], n_folders)
+        counts = np.bincount(file_folder[rows], minlength=n_folders)
+        for level in range(max_depth, 0, -1):
+            at_level = np.flatnonzero(depth == level)
+            sums += self._group_sum(sums[at_level], parent_idx[at_level], n_folders + 1)[:n_folders]
+            counts += np.bincount(parent_idx[at_level], weights=counts[at_level], minlength=n_folders + 1)[:n_folders].astype(np.int64)
+        
+        sum_norms = np.linalg.norm(sums, axis=1)
+        has_images = counts > 0
+        cohesion = np.full(n_folders, np.nan)
+        cohesion[has_images] = sum_norms[has_images] / counts[has_images]
+        
+        # 兄弟フォルダ間の分離度（親ごとに重心の単位ベクトルを合計）
+        unit_centroids = np.zeros_like(sums)
+        unit_centroids[has_images] = sums[has_images] / sum_norms[has_images, None].clip(min=1e-12)
+        sibling_sums = self._group_sum(unit_centroids[has_images], parent_idx[has_images], n_folders + 1)
+        sibling_counts = np.bincount(parent_idx[has_images], minlength=n_folders + 1)
+        
+        groups = np.flatnonzero(sibling_counts >= 2)
+        k = sibling_counts[groups]
+        mean_pair_similarity = (np.sum(sibling_sums[groups] ** 2, axis=1) - k) / (k * (k - 1))
+        separation = 1.0 - mean_pair_similarity
+        # 兄弟グループの階層 = 子フォルダの深さ（仮想ルートの子は0）
+        group_levels = np.where(groups == root, 0, depth[np.minimum(groups, n_folders - 1)] + 1)
+        
+        per_level = {}
+        for level in range(max_depth + 1):
+            level_mask = (depth == level) & has_images
+            level_info = {'folders_with_images': int(level_mask.sum())}
+            if level_mask.any():
+                level_info['mean_cohesion'] = float(np.mean(cohesion[level_mask]))
+                level_info['weighted_cohesion'] = float(np.average(cohesion[level_mask], weights=counts[level_mask]))
+            level_separation = separation[group_levels == level]
+            if len(level_separation) > 0:
+                level_info['mean_sibling_separation'] = float(np.mean(level_separation))
+                level_info['sibling_groups'] = int(len(level_separation))
+            per_level[str(level)] = level_info
+        
+        leaf_mask = has_images & np.isin(np.arange(n_folders), file_folder[rows])
         return {
-            'note': '階層構造の詳細分析は folder_data の構造に依存します',
-            'folder_data_available': folder_data is not None and len(folder_data) > 0
+            'images_with_embeddings': len(rows),
+            'leaf_cohesion_weighted': float(np.average(cohesion[leaf_mask], weights=counts[leaf_mask])) if leaf_mask.any() else 0.0,
+            'mean_sibling_separation': float(np.mean(separation)) if len(separation) > 0 else 0.0,
+            'per_level': per_level
         }
     
     def calculate_incremental_metrics(
@@ -399,3 +337,324 @@ class ClusteringMetrics:
             'current_metrics': current_metrics,
             'previous_metrics': previous_metrics
         }
+
+
+class MetricsAccumulator:
+    """
+    レポートを1件ずつ取り込み、評価指標を逐次計算するためのクラス
+    
+    レポートの辞書そのものは保持せず、類似度・判定ステップ・フォルダ・処理時間などを
+    コンパクトな列（array → NumPyビュー）として保持する。
+    メモリは画像数に比例する数値のみで、実行中でも compute() で指標を取得できる。
+    """
+    
+    # フラグ列のビット
+    _NEW_FOLDER = 1
+    _CRITERIA_USED = 2
+    _HAS_ERROR = 4
+    _SENTENCE_EMBEDDING = 8
+    _IMAGE_EMBEDDING = 16
+    
+    HIGH_CONFIDENCE_THRESHOLD = 0.7
+    MEDIUM_CONFIDENCE_THRESHOLD = 0.5
+    CRITERIA_SUCCESS_THRESHOLD = 0.5
+    
+    def __init__(self, similarity_threshold: float = 0.4):
+        """
+        Args:
+            similarity_threshold: 類似度閾値
+        """
+        self.similarity_threshold = similarity_threshold
+        self.run_info = None
+        
+        # 数値列
+        self._similarity = array('d')
+        self._flags = array('B')
+        self._similarity_type = array('h')
+        self._decision_step = array('h')
+        self._folder = array('q')
+        self._processing_time = array('d')
+        
+        # カテゴリ値 → 列に格納するコード
+        self._similarity_type_codes = {}
+        self._decision_step_codes = {}
+        self._folder_codes = {}
+        
+        # エラーは件数のみ逐次集計
+        self._error_types = defaultdict(int)
+        self._last_added_at = time.monotonic()
+        
+        # 列のバッファを参照している間に追記すると BufferError になるため、追記と列のコピーを排他する
+        self._lock = Lock()
+    
+    def __len__(self) -> int:
+        return len(self._similarity)
+    
+    @staticmethod
+    def _code(codes: Dict[Any, int], value: Any) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = len(codes)
+            codes[value] = code
+        return code
+    
+    @staticmethod
+    def _classify_error(error: str) -> str:
+        # エラーメッセージからタイプを抽出
+        if '文章埋め込み' in error:
+            return 'sentence_embedding_error'
+        elif '画像埋め込み' in error:
+            return 'image_embedding_error'
+        elif 'フォルダ' in error:
+            return 'folder_error'
+        return 'other_error'
+    
+    def add(self, report: Dict[str, Any], processing_time: float = None):
+        """
+        レポートを1件取り込む
+        
+        Args:
+            report: 画像ごとのレポートデータ
+            processing_time: 処理時間（秒）。省略時は前回の取り込みからの経過時間
+        """
+        now = time.monotonic()
+        if processing_time is None:
+            processing_time = now - self._last_added_at
+        self._last_added_at = now
+        
+        if self.run_info is None:
+            self.run_info = {
+                key: report.get(key, 'N/A')
+                for key in ('execution_time', 'project_name', 'user_name', 'clustering_count')
+            }
+        
+        errors = report.get('errors') or []
+        flags = 0
+        if report.get('new_folder_created', False):
+            flags |= self._NEW_FOLDER
+        if report.get('classification_criteria_used', False):
+            flags |= self._CRITERIA_USED
+        if errors:
+            flags |= self._HAS_ERROR
+        if report.get('sentence_embedding_available', False):
+            flags |= self._SENTENCE_EMBEDDING
+        if report.get('image_embedding_available', False):
+            flags |= self._IMAGE_EMBEDDING
+        
+        folder_id = report.get('final_folder_id')
+        
+        with self._lock:
+            self._append(report, flags, folder_id, processing_time, errors)
+    
+    def _append(self, report: Dict[str, Any], flags: int, folder_id: Any, processing_time: float, errors: List[Any]):
+        self._similarity.append(float(report.get('final_similarity') or 0.0))
+        self._flags.append(flags)
+        self._similarity_type.append(self._code(self._similarity_type_codes, report.get('final_similarity_type', 'unknown')))
+        self._decision_step.append(self._code(self._decision_step_codes, report.get('decision_step')))
+        self._folder.append(self._code(self._folder_codes, folder_id) if folder_id else -1)
+        self._processing_time.append(processing_time)
+        
+        for error in errors:
+            self._error_types[self._classify_error(str(error))] += 1
+    
+    @staticmethod
+    def _decode_counts(codes: Dict[Any, int], column: np.ndarray) -> Dict[Any, int]:
+        """コード列の出現数を元の値をキーとした辞書にする"""
+        counts = np.bincount(column, minlength=len(codes)) if len(column) > 0 else np.zeros(len(codes), dtype=np.int64)
+        return {value: int(counts[code]) for value, code in list(codes.items()) if code < len(counts) and counts[code] > 0}
+    
+    def _column(self, column: array, dtype) -> np.ndarray:
+        """列をNumPy配列としてコピーする"""
+        with self._lock:
+            return np.frombuffer(column, dtype=dtype).copy()
+    
+    def summary(self) -> Dict[str, Any]:
+        """
+        サマリーレポート用の簡易統計（類似度は0以外の画像のみで集計）
+        
+        Returns:
+            簡易統計の辞書
+        """
+        similarity = self._column(self._similarity, dtype=np.float64)
+        flags = self._column(self._flags, dtype=np.uint8)
+        nonzero = similarity[similarity != 0]
+        return {
+            'total_images': len(self),
+            'new_folders_created': int(((flags & self._NEW_FOLDER) > 0).sum()),
+            'criteria_based_classifications': int(((flags & self._CRITERIA_USED) > 0).sum()),
+            'nonzero_similarity_count': int(len(nonzero)),
+            'mean_nonzero_similarity': float(np.mean(nonzero)) if len(nonzero) > 0 else 0.0,
+            'max_nonzero_similarity': float(np.max(nonzero)) if len(nonzero) > 0 else 0.0,
+            'min_nonzero_similarity': float(np.min(nonzero)) if len(nonzero) > 0 else 0.0
+        }
+    
+    def compute(self, folder_data: Dict[str, Any] = None, embeddings: Dict[str, Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        取り込み済みのレポートから評価指標を計算する（実行中でも呼び出し可能）
+        
+        Args:
+            folder_data: フォルダ構造データ
+            embeddings: 埋め込みの種類 → {clustering_id: 埋め込みベクトル}（階層構造の品質評価に使用）
+        
+        Returns:
+            評価指標の辞書（ClusteringMetrics.calculate_all_metrics と同じ構造）
+        """
+        total = len(self)
+        if total == 0:
+            return {}
+        
+        similarity = self._column(self._similarity, dtype=np.float64)
+        flags = self._column(self._flags, dtype=np.uint8)
+        folder = self._column(self._folder, dtype=np.int64)
+        processing_time = self._column(self._processing_time, dtype=np.float64)
+        
+        new_folder = (flags & self._NEW_FOLDER) > 0
+        criteria_used = (flags & self._CRITERIA_USED) > 0
+        has_error = (flags & self._HAS_ERROR) > 0
+        sentence_available = (flags & self._SENTENCE_EMBEDDING) > 0
+        image_available = (flags & self._IMAGE_EMBEDDING) > 0
+        
+        ratio = lambda count: count / total if total > 0 else 0
+        metrics = {}
+        
+        # 基本統計
+        new_folders_count = int(new_folder.sum())
+        criteria_used_count = int(criteria_used.sum())
+        error_count = int(has_error.sum())
+        metrics['basic_stats'] = {
+            'total_images': total,
+            'new_folders_created': new_folders_count,
+            'new_folder_ratio': ratio(new_folders_count),
+            'existing_folder_assignments': total - new_folders_count,
+            'existing_folder_ratio': ratio(total - new_folders_count),
+            'criteria_based_classifications': criteria_used_count,
+            'criteria_usage_ratio': ratio(criteria_used_count),
+            'errors_occurred': error_count,
+            'error_ratio': ratio(error_count),
+            'decision_step_distribution': {
+                str(step): count
+                for step, count in self._decode_counts(self._decision_step_codes, self._column(self._decision_step, dtype=np.int16)).items()
+            }
+        }
+        
+        # 分類成功率・新規フォルダ作成率
+        threshold = self.similarity_threshold
+        high_confidence_existing = int((~new_folder & (similarity >= threshold)).sum())
+        appropriate_new_folders = int((new_folder & (similarity < threshold)).sum())
+        appropriate_classifications = high_confidence_existing + appropriate_new_folders
+        metrics['classification_success'] = {
+            'appropriate_classifications': appropriate_classifications,
+            'appropriate_classification_ratio': ratio(appropriate_classifications),
+            'high_confidence_existing_folder': high_confidence_existing,
+            'high_confidence_existing_ratio': ratio(high_confidence_existing),
+            'appropriate_new_folders': appropriate_new_folders,
+            'appropriate_new_folder_ratio': ratio(appropriate_new_folders),
+            'threshold_used': threshold
+        }
+        
+        # 類似度統計
+        type_counter = self._decode_counts(self._similarity_type_codes, self._column(self._similarity_type, dtype=np.int16))
+        q1, q2, q3 = np.percentile(similarity, [25, 50, 75])
+        metrics['similarity_stats'] = {
+            'mean_similarity': float(np.mean(similarity)),
+            'median_similarity': float(np.median(similarity)),
+            'std_similarity': float(np.std(similarity)),
+            'min_similarity': float(np.min(similarity)),
+            'max_similarity': float(np.max(similarity)),
+            'quartiles': {
+                'q1': float(q1),
+                'q2': float(q2),
+                'q3': float(q3)
+            },
+            'similarity_type_distribution': type_counter,
+            'sentence_based_ratio': ratio(type_counter.get('sentence', 0)),
+            'image_based_ratio': ratio(type_counter.get('image', 0))
+        }
+        
+        # フォルダバランス
+        assigned = folder[folder >= 0]
+        if len(assigned) > 0:
+            folder_counts = np.bincount(assigned)
+            used_codes = np.flatnonzero(folder_counts)
+            assignment_counts_array = folder_counts[used_codes]
+            gini = ClusteringMetrics()._calculate_gini_coefficient(assignment_counts_array)
+            mean_assignments = np.mean(assignment_counts_array)
+            cv = np.std(assignment_counts_array) / mean_assignments if mean_assignments > 0 else 0
+            code_to_folder = {code: folder_id for folder_id, code in self._folder_codes.items()}
+            metrics['folder_balance'] = {
+                'total_folders_used': int(len(used_codes)),
+                'mean_images_per_folder': float(mean_assignments),
+                'std_images_per_folder': float(np.std(assignment_counts_array)),
+                'min_images_per_folder': int(np.min(assignment_counts_array)),
+                'max_images_per_folder': int(np.max(assignment_counts_array)),
+                'gini_coefficient': float(gini),
+                'coefficient_of_variation': float(cv),
+                'balance_score': float(1 - gini),  # 0-1, 1が最もバランスが良い
+                'folder_assignment_distribution': {code_to_folder[int(code)]: int(folder_counts[code]) for code in used_codes}
+            }
+        else:
+            metrics['folder_balance'] = {}
+        
+        # 分類基準の一貫性
+        if criteria_used_count == 0:
+            metrics['criteria_consistency'] = {
+                'criteria_used_count': 0,
+                'consistency_score': 0.0,
+                'note': '分類基準が使用されていません'
+            }
+        else:
+            criteria_success = int((criteria_used & (similarity >= self.CRITERIA_SUCCESS_THRESHOLD)).sum())
+            consistency_score = criteria_success / criteria_used_count
+            metrics['criteria_consistency'] = {
+                'criteria_used_count': criteria_used_count,
+                'criteria_success_count': criteria_success,
+                'consistency_score': float(consistency_score),
+                'consistency_percentage': float(consistency_score * 100)
+            }
+        
+        # 信頼度スコア（類似度が高く、エラーがない分類）
+        high_confidence = int((~has_error & (similarity >= self.HIGH_CONFIDENCE_THRESHOLD)).sum())
+        medium_confidence = int((~has_error & (similarity >= self.MEDIUM_CONFIDENCE_THRESHOLD) & (similarity < self.HIGH_CONFIDENCE_THRESHOLD)).sum())
+        low_confidence = total - high_confidence - medium_confidence
+        metrics['confidence_scores'] = {
+            'high_confidence_count': high_confidence,
+            'high_confidence_ratio': ratio(high_confidence),
+            'medium_confidence_count': medium_confidence,
+            'medium_confidence_ratio': ratio(medium_confidence),
+            'low_confidence_count': low_confidence,
+            'low_confidence_ratio': ratio(low_confidence),
+            'thresholds': {
+                'high': self.HIGH_CONFIDENCE_THRESHOLD,
+                'medium': self.MEDIUM_CONFIDENCE_THRESHOLD
+            }
+        }
+        
+        # パフォーマンス評価
+        both_available = int((sentence_available & image_available).sum())
+        metrics['performance'] = {
+            'sentence_embedding_success_rate': ratio(int(sentence_available.sum())),
+            'image_embedding_success_rate': ratio(int(image_available.sum())),
+            'both_embeddings_available': both_available,
+            'both_embeddings_available_rate': ratio(both_available),
+            'total_processing_time_sec': float(processing_time.sum()),
+            'mean_processing_time_sec': float(np.mean(processing_time)),
+            'p95_processing_time_sec': float(np.percentile(processing_time, 95))
+        }
+        
+        # エラー分析
+        metrics['error_analysis'] = {
+            'total_errors': int(sum(self._error_types.values())),
+            'error_type_distribution': dict(self._error_types),
+            'images_with_errors': error_count,
+            'error_free_ratio': ratio(total - error_count)
+        }
+        
+        # 階層構造の品質
+        if folder_data:
+            try:
+                metrics['hierarchy_quality'] = ClusteringMetrics()._calculate_hierarchy_quality(folder_data, embeddings)
+            except Exception as e:
+                print(f"⚠️ 階層構造の品質評価エラー: {e}")
+                metrics['hierarchy_quality'] = {'folder_data_available': True, 'error': str(e)}
+        
+        return metrics
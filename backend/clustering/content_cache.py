@@ -0,0 +1,159 @@
+import hashlib
+import sqlite3
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+
+from config import CONTENT_CACHE_PATH
+
+
+class ContentCache:
+    """
+    画像の内容（バイト列のハッシュ）をキーとしたキャプション・埋め込みのキャッシュ
+
+    ファイル名やプロジェクトが異なっても同じ画像であれば、キャプション生成と
+    4種類の埋め込み計算（name/usage/category/image）を再利用する。
+    保存先はローカルのSQLite（標準ライブラリのみで動作）。
+
+    テーブル:
+    - captions: 画像ハッシュ → (is_success, caption)
+    - sentence_embeddings: 文のハッシュ → 文埋め込み（float32）
+    - image_embeddings: 画像ハッシュ → 画像埋め込み（float32）
+    """
+
+    KINDS = ("caption", "sentence_embedding", "image_embedding")
+
+    def __init__(self, path: str = CONTENT_CACHE_PATH):
+        self._path = Path(path)
+        if self._path.parent and not self._path.parent.exists():
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._conn = sqlite3.connect(str(self._path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS captions (
+                image_hash TEXT PRIMARY KEY,
+                is_success INTEGER NOT NULL,
+                caption TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sentence_embeddings (
+                text_hash TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS image_embeddings (
+                image_hash TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+        self._hits = {kind: 0 for kind in self.KINDS}
+        self._misses = {kind: 0 for kind in self.KINDS}
+
+    @staticmethod
+    def hash_bytes(data: bytes) -> str:
+        """画像バイト列のハッシュ（sha256）"""
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def hash_text(sentence: str) -> str:
+        """文のハッシュ（sha256）"""
+        return hashlib.sha256(sentence.encode('utf-8')).hexdigest()
+
+    def _fetch_one(self, kind: str, query: str, key: str):
+        with self._lock:
+            row = self._conn.execute(query, (key,)).fetchone()
+            if row is None:
+                self._misses[kind] += 1
+            else:
+                self._hits[kind] += 1
+        return row
+
+    def _upsert(self, query: str, params: tuple):
+        with self._lock:
+            self._conn.execute(query, params)
+            self._conn.commit()
+
+    def get_caption(self, image_hash: str) -> tuple[bool, str] | None:
+        """画像ハッシュからキャプションを取得（存在しない場合はNone）"""
+        row = self._fetch_one("caption", "SELECT is_success, caption FROM captions WHERE image_hash = ?", image_hash)
+        if row is None:
+            return None
+        return bool(row[0]), row[1]
+
+    def put_caption(self, image_hash: str, is_success: bool, caption: str):
+        self._upsert(
+            "INSERT OR REPLACE INTO captions (image_hash, is_success, caption) VALUES (?, ?, ?)",
+            (image_hash, int(is_success), caption)
+        )
+
+    def get_sentence_embedding(self, sentence: str) -> np.ndarray | None:
+        """文から埋め込みを取得（存在しない場合はNone）"""
+        row = self._fetch_one(
+            "sentence_embedding",
+            "SELECT embedding FROM sentence_embeddings WHERE text_hash = ?",
+            self.hash_text(sentence)
+        )
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32).copy()
+
+    def put_sentence_embedding(self, sentence: str, embedding):
+        self._upsert(
+            "INSERT OR REPLACE INTO sentence_embeddings (text_hash, embedding) VALUES (?, ?)",
+            (self.hash_text(sentence), np.asarray(embedding, dtype=np.float32).tobytes())
+        )
+
+    def get_image_embedding(self, image_hash: str) -> list[float] | None:
+        """画像ハッシュから画像埋め込みを取得（存在しない場合はNone）"""
+        row = self._fetch_one(
+            "image_embedding",
+            "SELECT embedding FROM image_embeddings WHERE image_hash = ?",
+            image_hash
+        )
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def put_image_embedding(self, image_hash: str, embedding):
+        self._upsert(
+            "INSERT OR REPLACE INTO image_embeddings (image_hash, embedding) VALUES (?, ?)",
+            (image_hash, np.asarray(embedding, dtype=np.float32).tobytes())
+        )
+
+    def get_stats(self) -> dict:
+        """種類ごとのヒット/ミス数とヒット率を返す"""
+        with self._lock:
+            stats = {}
+            for kind in self.KINDS:
+                hits = self._hits[kind]
+                misses = self._misses[kind]
+                total = hits + misses
+                stats[kind] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": round(hits / total, 4) if total > 0 else 0.0
+                }
+            return stats
+
+
+# モジュールレベルで一度だけ開く
+_content_cache = None
+_content_cache_lock = Lock()
+
+
+def get_content_cache() -> ContentCache | None:
+    """ContentCache インスタンスを一度だけ生成して返す（失敗時はNoneを返し、キャッシュなしで動作させる）"""
+    global _content_cache
+    if _content_cache is None:
+        with _content_cache_lock:
+            if _content_cache is None:
+                try:
+                    _content_cache = ContentCache()
+                except Exception as e:
+                    print(f"⚠️ コンテンツキャッシュの初期化に失敗しました: {e}")
+                    return None
+    return _content_cache
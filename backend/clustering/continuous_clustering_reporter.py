@@ -1,27 +1,36 @@
 """
 継続的階層分類のレポート生成クラス
 
-実行ごとにテキストレポートを生成し、指定されたディレクトリ構造に保存する。
-ディレクトリ構造: output/{project_name}/{user_name}/{yyyymmddhhmmss}/{image_name}.txt
+実行ごとに画像ごとのレポートデータ（構造化レコード）をバッファし、
+バッチ単位で非同期に1つのJSONLファイルへ追記する。
+ディレクトリ構造: output/{project_name}/{user_name}/{yyyymmddhhmmss}/records.jsonl
+
+画像ごとのテキストレポートは必要な時にコマンドで生成する:
+    python -m clustering.continuous_clustering_reporter output/{project_name}/{user_name}/{yyyymmddhhmmss}
 """
 
 import os
+import sys
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Any, Optional
-from clustering.clustering_metrics import ClusteringMetrics
+from typing import Dict, List, Any, Tuple
+from clustering.clustering_metrics import ClusteringMetrics, MetricsAccumulator
 
 
 class ContinuousClusteringReporter:
     """継続的階層分類のレポート生成クラス"""
     
-    def __init__(self, project_name: str, user_name: str, output_base_dir: str = "output"):
+    RECORDS_FILENAME = "records.jsonl"
+    
+    def __init__(self, project_name: str, user_name: str, output_base_dir: str = "output", batch_size: int = 200):
         """
         Args:
             project_name: プロジェクト名
             user_name: ユーザー名
             output_base_dir: 出力ベースディレクトリ（デフォルト: "output"）
+            batch_size: レコードをまとめて書き込む件数
         """
         self.project_name = self._sanitize_dirname(project_name)
         self.user_name = self._sanitize_dirname(user_name)
@@ -34,10 +43,20 @@ class ContinuousClusteringReporter:
         # メトリクス計算クラスを初期化
         self.metrics_calculator = ClusteringMetrics()
         
+        # レポートを保持せずに評価指標を逐次集計する（実行中でも current_metrics() で参照可能）
+        self.metrics_accumulator = MetricsAccumulator()
+        
+        # レコードのバッファと書き込み用スレッド（クラスタリング処理をファイル書き込みで待たせない）
+        self.records_path = self.report_dir / self.RECORDS_FILENAME
+        self._buffer = []
+        self._batch_size = batch_size
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="continuous-clustering-report")
+        
         # ディレクトリを作成
         self._create_directories()
         
-    def _sanitize_dirname(self, name: str) -> str:
+    @classmethod
+    def _sanitize_dirname(cls, name: str) -> str:
         """
         ディレクトリ名として使用可能な文字列に変換
         
@@ -65,41 +84,147 @@ class ContinuousClusteringReporter:
     
     def generate_image_report(self, report_data: Dict[str, Any]) -> str:
         """
-        画像ごとのレポートを生成
+        画像ごとのレポートデータをバッファに追加する
+        batch_size件たまるごとに書き込み用スレッドでJSONLへ追記する（呼び出し元は待たない）
         
         Args:
             report_data: レポートデータ（辞書形式）
             
         Returns:
-            生成されたレポートのファイルパス
+            レコードを書き込むJSONLファイルのパス
+        """
+        self.metrics_accumulator.add(report_data)
+        self._buffer.append(dict(report_data))
+        if len(self._buffer) >= self._batch_size:
+            self._submit_buffer()
+        return str(self.records_path)
+    
+    def _submit_buffer(self):
+        """バッファ中のレコードを書き込み用スレッドに渡す"""
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        self._writer.submit(self._write_batch, batch)
+    
+    def _write_batch(self, batch: List[Dict[str, Any]]):
+        """レコードをまとめてJSONLに追記"""
+        try:
+            lines = [json.dumps(record, ensure_ascii=False, default=str) for record in batch]
+            with open(self.records_path, 'a', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+        except Exception as e:
+            print(f"  ❌ レポートレコード書き込みエラー: {e}")
+    
+    def flush(self, wait: bool = True):
         """
-        # デバッグ: レポートデータのキーを出力
-        print(f"  🔍 レポートデータのキー: {list(report_data.keys())}")
+        バッファ中のレコードを書き出す
         
-        image_name = report_data.get('image_name', 'unknown')
-        safe_image_name = self._sanitize_dirname(image_name)
+        Args:
+            wait: Trueの場合、書き込みが完了するまで待機する
+        """
+        self._submit_buffer()
+        if wait:
+            self._writer.submit(lambda: None).result()
+    
+    def current_metrics(self, folder_data: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        ここまでに取り込んだ画像の評価指標を返す（実行途中でも呼び出し可能）
         
-        # 拡張子を除去してtxtに置換
-        base_name = os.path.splitext(safe_image_name)[0]
-        report_filename = f"{base_name}.txt"
-        report_path = self.report_dir / report_filename
+        Args:
+            folder_data: フォルダ構造データ
+            
+        Returns:
+            評価指標の辞書
+        """
+        return self.metrics_accumulator.compute(folder_data)
+    
+    def _iter_records(self):
+        """書き込み済みの records.jsonl を1行ずつ読み込む"""
+        if not self.records_path.exists():
+            return
+        with open(self.records_path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    
+    def finalize(
+        self,
+        all_reports_data: List[Dict[str, Any]] = None,
+        folder_data: Dict[str, Any] = None,
+        similarity_threshold: float = 0.4,
+        embedding_sources: Dict[str, Tuple[Any, Dict[str, str]]] = None
+    ):
+        """
+        残りのレコードを書き出した後、サマリー・評価指標レポートを書き込み用スレッドで生成する
+        （呼び出し元は完了を待たない）
         
-        print(f"  📝 レポート生成開始: {report_filename}")
+        Args:
+            all_reports_data: 全画像のレポートデータのリスト（省略時は逐次集計した指標と records.jsonl を使用）
+            folder_data: フォルダ構造データ
+            similarity_threshold: 類似度閾値
+            embedding_sources: 埋め込みの種類 → (ChromaDBManager, {clustering_id: ChromaDBのID})
+                階層構造の凝集度・分離度の計算に使用する（埋め込みの取得も書き込み用スレッドで行う）
         
-        # レポート内容を生成
-        report_content = self._format_report(report_data)
+        Returns:
+            Future: レポート生成の完了を待つ場合に使用
+        """
+        self._submit_buffer()
+        self.metrics_accumulator.similarity_threshold = similarity_threshold
+        
+        def _generate():
+            try:
+                if all_reports_data or (all_reports_data is None and len(self.metrics_accumulator) > 0):
+                    self.generate_summary_report(all_reports_data)
+                    embeddings = None
+                    if embedding_sources and folder_data:
+                        embeddings = {
+                            embedding_type: ClusteringMetrics.load_node_embeddings(embedding_db, id_map)
+                            for embedding_type, (embedding_db, id_map) in embedding_sources.items()
+                        }
+                    self.generate_metrics_report(
+                        all_reports_data,
+                        folder_data=folder_data,
+                        similarity_threshold=similarity_threshold,
+                        embeddings=embeddings
+                    )
+            except Exception as e:
+                print(f"⚠️ レポート生成エラー: {e}")
+        
+        future = self._writer.submit(_generate)
+        self._writer.shutdown(wait=False)
+        return future
+    
+    @classmethod
+    def render_text_reports(cls, report_dir: str | Path) -> int:
+        """
+        records.jsonl から画像ごとのテキストレポートを生成する（必要な時にのみ実行）
         
-        # ファイルに書き込み
-        try:
-            with open(report_path, 'w', encoding='utf-8') as f:
-                f.write(report_content)
-            print(f"  📄 レポート作成: {report_path}")
-            return str(report_path)
-        except Exception as e:
-            print(f"  ❌ レポート作成エラー: {e}")
-            raise
+        Args:
+            report_dir: 実行ごとのレポートディレクトリ
+            
+        Returns:
+            生成したレポート数
+        """
+        report_dir = Path(report_dir)
+        records_path = report_dir / cls.RECORDS_FILENAME
+        count = 0
+        with open(records_path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                report_data = json.loads(line)
+                image_name = report_data.get('image_name', 'unknown')
+                base_name = os.path.splitext(cls._sanitize_dirname(image_name))[0]
+                report_path = report_dir / f"{base_name}.txt"
+                with open(report_path, 'w', encoding='utf-8') as report_file:
+                    report_file.write(cls._format_report(report_data))
+                count += 1
+        print(f"📄 テキストレポートを生成しました: {report_dir} ({count} 件)")
+        return count
     
-    def _format_report(self, data: Dict[str, Any]) -> str:
+    @classmethod
+    def _format_report(cls, data: Dict[str, Any]) -> str:
         """
         レポートデータをフォーマット
         
@@ -366,12 +491,12 @@ class ContinuousClusteringReporter:
         
         return "\n".join(lines)
     
-    def generate_summary_report(self, all_reports_data: List[Dict[str, Any]]) -> str:
+    def generate_summary_report(self, all_reports_data: List[Dict[str, Any]] = None) -> str:
         """
         実行全体のサマリーレポートを生成
         
         Args:
-            all_reports_data: 全画像のレポートデータのリスト
+            all_reports_data: 全画像のレポートデータのリスト（省略時は逐次集計した指標と records.jsonl を使用）
             
         Returns:
             サマリーレポートのファイルパス
@@ -384,43 +509,45 @@ class ContinuousClusteringReporter:
         lines.append("=" * 80)
         lines.append("")
         
+        if all_reports_data is None:
+            accumulator = self.metrics_accumulator
+            records = self._iter_records()
+        else:
+            accumulator = MetricsAccumulator()
+            for report in all_reports_data:
+                accumulator.add(report)
+            records = all_reports_data
+        
         # 実行情報
-        if all_reports_data:
-            first_report = all_reports_data[0]
+        if accumulator.run_info:
+            run_info = accumulator.run_info
             lines.append("【実行情報】")
-            lines.append(f"  実行日時: {first_report.get('execution_time', 'N/A')}")
-            lines.append(f"  プロジェクト: {first_report.get('project_name', 'N/A')}")
-            lines.append(f"  ユーザー: {first_report.get('user_name', 'N/A')}")
-            lines.append(f"  クラスタリング回数: {first_report.get('clustering_count', 'N/A')}")
+            lines.append(f"  実行日時: {run_info['execution_time']}")
+            lines.append(f"  プロジェクト: {run_info['project_name']}")
+            lines.append(f"  ユーザー: {run_info['user_name']}")
+            lines.append(f"  クラスタリング回数: {run_info['clustering_count']}")
             lines.append("")
         
         # 統計情報
+        summary = accumulator.summary()
         lines.append("【統計情報】")
-        lines.append(f"  処理画像数: {len(all_reports_data)}")
-        
-        new_folders_count = sum(1 for r in all_reports_data if r.get('new_folder_created', False))
-        lines.append(f"  新規作成フォルダ数: {new_folders_count}")
-        
-        criteria_used_count = sum(1 for r in all_reports_data if r.get('classification_criteria_used', False))
-        lines.append(f"  分類基準による再判定: {criteria_used_count}件")
-        
-        # 平均類似度
-        similarities = [r.get('final_similarity', 0.0) for r in all_reports_data if r.get('final_similarity')]
-        if similarities:
-            avg_similarity = sum(similarities) / len(similarities)
-            max_similarity = max(similarities)
-            min_similarity = min(similarities)
-            lines.append(f"  平均類似度: {avg_similarity:.6f}")
-            lines.append(f"  最高類似度: {max_similarity:.6f}")
-            lines.append(f"  最低類似度: {min_similarity:.6f}")
+        lines.append(f"  処理画像数: {summary['total_images']}")
+        lines.append(f"  新規作成フォルダ数: {summary['new_folders_created']}")
+        lines.append(f"  分類基準による再判定: {summary['criteria_based_classifications']}件")
+        
+        # 平均類似度（類似度が0の画像は除く）
+        if summary['nonzero_similarity_count'] > 0:
+            lines.append(f"  平均類似度: {summary['mean_nonzero_similarity']:.6f}")
+            lines.append(f"  最高類似度: {summary['max_nonzero_similarity']:.6f}")
+            lines.append(f"  最低類似度: {summary['min_nonzero_similarity']:.6f}")
         lines.append("")
         
         # 画像ごとの簡易サマリー
         lines.append("【処理画像一覧】")
-        for i, report in enumerate(all_reports_data, 1):
+        for i, report in enumerate(records, 1):
             image_name = report.get('image_name', 'Unknown')
             folder_name = report.get('final_folder_name', 'N/A')
-            similarity = report.get('final_similarity', 0.0)
+            similarity = report.get('final_similarity') or 0.0
             new_folder = "✓" if report.get('new_folder_created', False) else ""
             lines.append(f"  [{i}] {image_name}")
             lines.append(f"      → {folder_name} (類似度: {similarity:.4f}) {new_folder}")
@@ -439,17 +566,19 @@ class ContinuousClusteringReporter:
     
     def generate_metrics_report(
         self,
-        all_reports_data: List[Dict[str, Any]],
+        all_reports_data: List[Dict[str, Any]] = None,
         folder_data: Dict[str, Any] = None,
-        similarity_threshold: float = 0.4
+        similarity_threshold: float = 0.4,
+        embeddings: Dict[str, Dict[str, Any]] = None
     ) -> str:
         """
         評価指標レポートを生成
         
         Args:
-            all_reports_data: 全画像のレポートデータのリスト
+            all_reports_data: 全画像のレポートデータのリスト（省略時は逐次集計した指標を使用）
             folder_data: フォルダ構造データ
             similarity_threshold: 類似度閾値
+            embeddings: 埋め込みの種類 → {clustering_id: 埋め込みベクトル}
             
         Returns:
             評価指標レポートのファイルパス
@@ -457,11 +586,21 @@ class ContinuousClusteringReporter:
         metrics_path = self.report_dir / "METRICS_REPORT.txt"
         
         # 評価指標を計算
-        metrics = self.metrics_calculator.calculate_all_metrics(
-            all_reports_data,
-            folder_data or {},
-            similarity_threshold
-        )
+        if all_reports_data is None:
+            self.metrics_accumulator.similarity_threshold = similarity_threshold
+            metrics = self.metrics_accumulator.compute(folder_data or {}, embeddings)
+            run_info = self.metrics_accumulator.run_info
+        else:
+            metrics = self.metrics_calculator.calculate_all_metrics(
+                all_reports_data,
+                folder_data or {},
+                similarity_threshold,
+                embeddings
+            )
+            run_info = {
+                key: all_reports_data[0].get(key, 'N/A')
+                for key in ('execution_time', 'project_name', 'user_name', 'clustering_count')
+            } if all_reports_data else None
         
         lines = []
         lines.append("=" * 80)
@@ -470,13 +609,12 @@ class ContinuousClusteringReporter:
         lines.append("")
         
         # 実行情報
-        if all_reports_data:
-            first_report = all_reports_data[0]
+        if run_info:
             lines.append("【実行情報】")
-            lines.append(f"  実行日時: {first_report.get('execution_time', 'N/A')}")
-            lines.append(f"  プロジェクト: {first_report.get('project_name', 'N/A')}")
-            lines.append(f"  ユーザー: {first_report.get('user_name', 'N/A')}")
-            lines.append(f"  クラスタリング回数: {first_report.get('clustering_count', 'N/A')}")
+            lines.append(f"  実行日時: {run_info['execution_time']}")
+            lines.append(f"  プロジェクト: {run_info['project_name']}")
+            lines.append(f"  ユーザー: {run_info['user_name']}")
+            lines.append(f"  クラスタリング回数: {run_info['clustering_count']}")
             lines.append(f"  類似度閾値: {similarity_threshold}")
             lines.append("")
         
@@ -591,6 +729,10 @@ class ContinuousClusteringReporter:
             lines.append(f"  画像埋め込み取得成功率: {perf.get('image_embedding_success_rate', 0):.2%}")
             lines.append(f"  両方取得成功数: {perf.get('both_embeddings_available', 0)}")
             lines.append(f"  両方取得成功率: {perf.get('both_embeddings_available_rate', 0):.2%}")
+            if 'mean_processing_time_sec' in perf:
+                lines.append(f"  合計処理時間: {perf['total_processing_time_sec']:.2f}秒")
+                lines.append(f"  平均処理時間: {perf['mean_processing_time_sec']:.3f}秒/枚")
+                lines.append(f"  処理時間（95パーセンタイル）: {perf['p95_processing_time_sec']:.3f}秒")
             lines.append("")
         
         # 8. エラー分析
@@ -610,6 +752,38 @@ class ContinuousClusteringReporter:
                     lines.append(f"    - {error_type}: {count}")
             lines.append("")
         
+        # 9. 階層構造の品質
+        hierarchy = metrics.get('hierarchy_quality', {})
+        if hierarchy.get('total_folders'):
+            lines.append("=" * 80)
+            lines.append("9. 階層構造の品質")
+            lines.append("=" * 80)
+            lines.append(f"  フォルダ総数: {hierarchy['total_folders']}")
+            lines.append(f"  リーフフォルダ数: {hierarchy['leaf_folders']}")
+            lines.append(f"  最大深さ: {hierarchy['max_depth']}")
+            lines.append(f"  平均分岐数: {hierarchy['mean_branching_factor']:.2f} (最大: {hierarchy['max_branching_factor']})")
+            lines.append("  階層ごとのフォルダ数:")
+            for level, width in hierarchy['level_widths'].items():
+                lines.append(f"    - 深さ{level}: {width}")
+            
+            leaf_stats = hierarchy.get('leaf_size_stats')
+            if leaf_stats:
+                lines.append("  リーフフォルダの画像数:")
+                lines.append(f"    平均: {leaf_stats['mean']:.2f} / 中央値: {leaf_stats['median']:.1f} / 最小: {leaf_stats['min']} / 最大: {leaf_stats['max']}")
+                lines.append(f"    1枚のみのフォルダ: {leaf_stats['singleton_leaves']} / 空のフォルダ: {leaf_stats['empty_leaves']}")
+            
+            for embedding_type, quality in hierarchy.get('embedding_quality', {}).items():
+                lines.append(f"  【{embedding_type} 埋め込み】 ({quality.get('images_with_embeddings', 0)}枚)")
+                if 'per_level' not in quality:
+                    continue
+                lines.append(f"    リーフ凝集度（画像数で重み付け）: {quality['leaf_cohesion_weighted']:.4f}")
+                lines.append(f"    兄弟フォルダ間分離度（平均）: {quality['mean_sibling_separation']:.4f}")
+                for level, level_info in quality['per_level'].items():
+                    cohesion_text = f"{level_info['mean_cohesion']:.4f}" if 'mean_cohesion' in level_info else "N/A"
+                    separation_text = f"{level_info['mean_sibling_separation']:.4f}" if 'mean_sibling_separation' in level_info else "N/A"
+                    lines.append(f"    - 深さ{level}: 凝集度 {cohesion_text} / 分離度 {separation_text}")
+            lines.append("")
+        
         lines.append("=" * 80)
         lines.append("評価指標レポート終了")
         lines.append("=" * 80)
@@ -620,6 +794,8 @@ class ContinuousClusteringReporter:
         lines.append("- 平均類似度が高い → 既存フォルダとの適合度が高い")
         lines.append("- 変動係数(CV)が低い → フォルダあたりの画像数が安定している")
         lines.append("- 信頼度スコアが高い → 分類の確実性が高い")
+        lines.append("- 凝集度が高い → フォルダ内の画像同士が似ている")
+        lines.append("- 兄弟フォルダ間分離度が高い → 同じ親の下のフォルダ同士が区別できている")
         
         try:
             with open(metrics_path, 'w', encoding='utf-8') as f:
@@ -637,3 +813,13 @@ class ContinuousClusteringReporter:
             print(f"❌ 評価指標レポート作成エラー: {e}")
             raise
 
+
+def main():
+    if len(sys.argv) < 2:
+        print("使い方: python -m clustering.continuous_clustering_reporter <レポートディレクトリ>")
+        sys.exit(1)
+    ContinuousClusteringReporter.render_text_reports(sys.argv[1])
+
+
+if __name__ == "__main__":
+    main()
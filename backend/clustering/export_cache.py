@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from threading import Lock
+
+from config import EXPORT_CACHE_PATH, EXPORT_CACHE_MAX_BYTES
+
+
+class ExportCache:
+    """
+    分類結果ZIPのディスクキャッシュ
+
+    キーは mongo_result_id と分類結果（result / all_nodes）のハッシュ。
+    - 分類結果が変わっていなければ、作成済みのZIPをそのまま返す
+    - 変わっていれば新しいZIPをストリーミング生成し、生成と同時にキャッシュへ書き込む
+      （同じ mongo_result_id の直前のZIPを残しておき、変更の無い画像のエントリはそこから生のバイト列のままコピーする）
+    - キャッシュ全体のサイズは max_bytes 以下に保ち、最終アクセスが古いものから削除する（LRU）
+    """
+
+    def __init__(self, path: str = EXPORT_CACHE_PATH, max_bytes: int = EXPORT_CACHE_MAX_BYTES):
+        self._dir = Path(path)
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self._max_bytes = max_bytes
+        self._lock = Lock()
+
+    @staticmethod
+    def compute_version(result_dict: dict, all_nodes_dict: dict) -> str:
+        """分類結果の内容ハッシュ（キーの順序に依存しない）"""
+        payload = json.dumps([result_dict, all_nodes_dict], ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:24]
+
+    def _archive_path(self, mongo_result_id: str, version: str) -> Path:
+        return self._dir / f"{mongo_result_id}__{version}.zip"
+
+    def lookup(self, mongo_result_id: str, version: str) -> Path | None:
+        """キャッシュ済みのZIPを返す（存在する場合はアクセス時刻を更新）"""
+        path = self._archive_path(mongo_result_id, version)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def latest_archive(self, mongo_result_id: str) -> Path | None:
+        """同じ mongo_result_id の中で最も新しいZIP（差分生成の再利用元）"""
+        candidates = []
+        for path in self._dir.glob(f"{mongo_result_id}__*.zip"):
+            try:
+                candidates.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+        if not candidates:
+            return None
+        return max(candidates)[1]
+
+    def stream_and_store(self, mongo_result_id: str, version: str, chunks):
+        """
+        ZIPのチャンクをそのまま返しつつキャッシュファイルにも書き込む
+
+        最後まで生成できた場合のみキャッシュに登録し、同じ mongo_result_id の古いZIPを削除する。
+        途中で中断（クライアント切断など）した場合は一時ファイルを削除する。
+        """
+        final_path = self._archive_path(mongo_result_id, version)
+        tmp_path = final_path.with_name(f".{final_path.name}.{os.getpid()}.{id(chunks)}.tmp")
+        completed = False
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            if completed:
+                os.replace(tmp_path, final_path)
+                self._remove_superseded(mongo_result_id, keep=final_path)
+                self.evict()
+            elif tmp_path.exists():
+                os.remove(tmp_path)
+
+    def _remove_superseded(self, mongo_result_id: str, keep: Path):
+        for path in self._dir.glob(f"{mongo_result_id}__*.zip"):
+            if path != keep:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def invalidate(self, mongo_result_id: str):
+        """指定した分類結果のZIPを全て削除する"""
+        self._remove_superseded(mongo_result_id, keep=None)
+
+    def evict(self):
+        """合計サイズが上限を超えている間、最終アクセスが古いZIPから削除する"""
+        with self._lock:
+            entries = []
+            for path in self._dir.glob("*.zip"):
+                try:
+                    stat_result = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat_result.st_mtime, stat_result.st_size, path))
+
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+                if total_bytes <= self._max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total_bytes -= size
+                    print(f"🗑️ エクスポートキャッシュを削除: {path.name}")
+                except FileNotFoundError:
+                    pass
+
+
+# モジュールレベルで一度だけ生成
+_export_cache = None
+_export_cache_lock = Lock()
+
+
+def get_export_cache() -> ExportCache:
+    global _export_cache
+    if _export_cache is None:
+        with _export_cache_lock:
+            if _export_cache is None:
+                _export_cache = ExportCache()
+    return _export_cache
@@ -0,0 +1,48 @@
+"""
+初期クラスタリング対象画像のIDの対応表
+
+clustering_id / chromadb_sentence_id / chromadb_image_id を同じ位置に並べた3つの配列と、
+chromadb_sentence_id → 位置 の索引1つだけを保持する。
+（以前は同じ内容を clustering_id・sentence_id・image_id それぞれをキーにした3つの辞書で持っていた）
+"""
+
+
+class InitImageIndex:
+    """
+    初期クラスタリング対象画像のIDを列ごとの配列で保持する
+
+    - clustering_ids[i], sentence_ids[i], image_ids[i] が同じ画像を表す
+    - クラスタリングでは sentence_id から clustering_id・image_id を引くため、索引は sentence_id のみ持つ
+    """
+
+    __slots__ = ("clustering_ids", "sentence_ids", "image_ids", "_positions")
+
+    def __init__(self):
+        self.clustering_ids = []
+        self.sentence_ids = []
+        self.image_ids = []
+        self._positions = {}
+
+    def append(self, clustering_id: str, sentence_id: str, image_id: str):
+        """画像1件を末尾に追加する（同じsentence_idが既にある場合は最初の1件を残す）"""
+        if sentence_id in self._positions:
+            return
+        self._positions[sentence_id] = len(self.sentence_ids)
+        self.clustering_ids.append(clustering_id)
+        self.sentence_ids.append(sentence_id)
+        self.image_ids.append(image_id)
+
+    def __len__(self) -> int:
+        return len(self.sentence_ids)
+
+    def __contains__(self, sentence_id: str) -> bool:
+        return sentence_id in self._positions
+
+    def clustering_id_of(self, sentence_id: str) -> str | None:
+        position = self._positions.get(sentence_id)
+        return None if position is None else self.clustering_ids[position]
+
+    def image_id_of(self, sentence_id: str) -> str | None:
+        position = self._positions.get(sentence_id)
+        return None if position is None else self.image_ids[position]
+
@@ -0,0 +1,504 @@
+"""
+クラスタリングジョブの永続キューとワーカー
+
+初期クラスタリング・継続的クラスタリングをWebサーバーのプロセス外で実行するための仕組み。
+
+- ジョブはSQLite（JOB_QUEUE_PATH）に保存し、サーバーの再起動（reload含む）後も失われない
+- ワーカーは別プロセスで動作し、キューからジョブを1件ずつ取り出して実行する
+  （サーバー起動時に JOB_WORKERS 個を起動するほか、`python -m clustering.job_queue` で追加できる）
+- 同じプロジェクトで同時に実行するジョブ数は JOB_MAX_RUNNING_PER_PROJECT 以下に制限する
+- 実行中のジョブは進捗（0.0〜1.0とメッセージ）とハートビートを書き込む。
+  ハートビートが JOB_HEARTBEAT_TIMEOUT 秒途絶えたジョブ（ワーカーの強制終了など）は再度キューに戻す。
+  ただし JOB_MAX_ATTEMPTS 回実行しても終わらないジョブ（ワーカーを落とし続けるジョブなど）は失敗にする
+  （処理関数は再実行されても結果が重複しないように作る）
+- キャンセルは、待機中なら即座に、実行中ならジョブが check_cancelled() を呼んだ時点で反映される
+
+ジョブの処理内容は register_job_handler で種類ごとに登録する（routers/action.py で登録）。
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import uuid
+from pathlib import Path
+from threading import Lock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import (
+    JOB_QUEUE_PATH,
+    JOB_WORKERS,
+    JOB_MAX_RUNNING_PER_PROJECT,
+    JOB_HEARTBEAT_TIMEOUT,
+    JOB_MAX_ATTEMPTS,
+)
+
+
+class JOB_STATUS:
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelledError(Exception):
+    """実行中のジョブにキャンセルが要求された"""
+
+
+class JobQueue:
+    """SQLiteに保存するジョブキュー（複数プロセスから同時に利用できる）"""
+
+    def __init__(self, path: str = JOB_QUEUE_PATH):
+        self._path = Path(path)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    job_type TEXT NOT NULL,
+                    project_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    message TEXT,
+                    error TEXT,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    worker_id TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    heartbeat_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_project_status ON jobs (project_id, status)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """スレッドごとに接続を1つ使い回す"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row | None, include_payload: bool = False) -> dict | None:
+        if row is None:
+            return None
+        job = dict(row)
+        payload = job.pop("payload")
+        if include_payload:
+            job["payload"] = json.loads(payload)
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def enqueue(self, job_type: str, project_id: int, user_id: int, payload: dict) -> str:
+        """
+        ジョブを追加する
+
+        Args:
+            job_type: ジョブの種類（register_job_handler で登録した名前）
+            project_id: プロジェクトID
+            user_id: ユーザーID
+            payload: ジョブに渡すデータ（JSONに変換できるもの）
+
+        Returns:
+            str: ジョブID
+        """
+        job_id = uuid.uuid4().hex
+        self._connect().execute(
+            "INSERT INTO jobs (id, job_type, project_id, user_id, payload, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, job_type, project_id, user_id, json.dumps(payload, ensure_ascii=False, default=str), JOB_STATUS.QUEUED, time.time())
+        )
+        return job_id
+
+    def claim(self, worker_id: str, max_running_per_project: int = JOB_MAX_RUNNING_PER_PROJECT) -> dict | None:
+        """
+        実行可能な最も古いジョブを1件取り出して実行中にする（プロジェクトごとの同時実行数を超えるものは飛ばす）
+
+        Returns:
+            dict | None: ジョブ（payload含む）。実行可能なジョブが無い場合はNone
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                """
+                SELECT * FROM jobs
+                WHERE status = ? AND cancel_requested = 0
+                    AND project_id NOT IN (
+                        SELECT project_id FROM jobs WHERE status = ?
+                        GROUP BY project_id HAVING COUNT(*) >= ?
+                    )
+                ORDER BY created_at
+                LIMIT 1
+                """,
+                (JOB_STATUS.QUEUED, JOB_STATUS.RUNNING, max_running_per_project)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker_id = ?, attempts = attempts + 1, started_at = ?, heartbeat_at = ? WHERE id = ?",
+                    (JOB_STATUS.RUNNING, worker_id, now, now, row["id"])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        job = self._to_dict(row, include_payload=True)
+        job.update(status=JOB_STATUS.RUNNING, worker_id=worker_id, attempts=job["attempts"] + 1)
+        return job
+
+    def reap_stale(self, max_attempts: int = JOB_MAX_ATTEMPTS) -> list[dict]:
+        """
+        ハートビートが途絶えた実行中のジョブをキューに戻す（max_attempts 回実行済みのものは失敗にする）
+
+        Returns:
+            list[dict]: 失敗にしたジョブ（payload含む）
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            stale_before = now - JOB_HEARTBEAT_TIMEOUT
+            failed_rows = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                (JOB_STATUS.RUNNING, stale_before, max_attempts)
+            ).fetchall()
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                (JOB_STATUS.FAILED, f"heartbeat timed out after {max_attempts} attempts", now, JOB_STATUS.RUNNING, stale_before, max_attempts)
+            )
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = NULL WHERE status = ? AND heartbeat_at < ?",
+                (JOB_STATUS.QUEUED, JOB_STATUS.RUNNING, stale_before)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [self._to_dict(row, include_payload=True) for row in failed_rows]
+
+    def heartbeat(self, job_id: str, progress: float = None, message: str = None):
+        """ハートビート（と進捗）を書き込む"""
+        if progress is None:
+            self._connect().execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ?", (time.time(), job_id, JOB_STATUS.RUNNING))
+        else:
+            self._connect().execute(
+                "UPDATE jobs SET heartbeat_at = ?, progress = ?, message = COALESCE(?, message) WHERE id = ? AND status = ?",
+                (time.time(), min(max(progress, 0.0), 1.0), message, job_id, JOB_STATUS.RUNNING)
+            )
+
+    def finish(self, job_id: str, status: str, error: str = None):
+        """ジョブを終了状態にする"""
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ?, progress = CASE WHEN ? = ? THEN 1.0 ELSE progress END WHERE id = ?",
+            (status, error, time.time(), status, JOB_STATUS.SUCCEEDED, job_id)
+        )
+
+    def request_cancel(self, job_id: str) -> dict | None:
+        """
+        キャンセルを要求する（待機中のジョブは即座にキャンセル済みにする）
+
+        Returns:
+            dict | None: 要求後のジョブ。存在しない場合はNone
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status IN (?, ?)", (job_id, JOB_STATUS.QUEUED, JOB_STATUS.RUNNING))
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (JOB_STATUS.CANCELLED, time.time(), job_id, JOB_STATUS.QUEUED)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(job_id, include_payload=True)
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        row = self._connect().execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def get(self, job_id: str, include_payload: bool = False) -> dict | None:
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row, include_payload)
+
+    def list_jobs(self, project_id: int = None, user_id: int = None, limit: int = 50) -> list[dict]:
+        """ジョブを新しい順に返す（payloadは含めない）"""
+        conditions = []
+        params = []
+        if project_id is not None:
+            conditions.append("project_id = ?")
+            params.append(project_id)
+        if user_id is not None:
+            conditions.append("user_id = ?")
+            params.append(user_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._connect().execute(f"SELECT * FROM jobs {where} ORDER BY created_at DESC LIMIT ?", (*params, limit)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def find_active(self, job_type: str, project_id: int, user_id: int) -> dict | None:
+        """同じ種類・プロジェクト・ユーザーの待機中または実行中のジョブを返す"""
+        row = self._connect().execute(
+            "SELECT * FROM jobs WHERE job_type = ? AND project_id = ? AND user_id = ? AND status IN (?, ?) ORDER BY created_at LIMIT 1",
+            (job_type, project_id, user_id, JOB_STATUS.QUEUED, JOB_STATUS.RUNNING)
+        ).fetchone()
+        return self._to_dict(row)
+
+
+class JobContext:
+    """ジョブの処理関数に渡す、進捗報告とキャンセル確認用のオブジェクト"""
+
+    # 進捗・キャンセル確認のDBアクセス間隔（秒）
+    REPORT_INTERVAL = 1.0
+
+    def __init__(self, queue: JobQueue, job: dict):
+        self._queue = queue
+        self.job_id = job["id"]
+        self.project_id = job["project_id"]
+        self.user_id = job["user_id"]
+        self.payload = job["payload"]
+        # 何回目の実行か（2以上はハートビート切れ後の再実行）
+        self.attempts = job.get("attempts", 1)
+        self._last_report_at = 0.0
+        self._last_cancel_check_at = 0.0
+
+    def report_progress(self, progress: float, message: str = None, force: bool = False):
+        """
+        進捗を報告する（REPORT_INTERVAL より短い間隔の呼び出しは間引く）
+
+        Args:
+            progress: 進捗（0.0〜1.0）
+            message: 現在の処理内容
+            force: 間引かずに書き込む
+        """
+        now = time.monotonic()
+        if force or now - self._last_report_at >= self.REPORT_INTERVAL:
+            self._last_report_at = now
+            self._queue.heartbeat(self.job_id, progress, message)
+
+    def check_cancelled(self):
+        """キャンセルが要求されていれば JobCancelledError を送出する"""
+        now = time.monotonic()
+        if now - self._last_cancel_check_at < self.REPORT_INTERVAL:
+            return
+        self._last_cancel_check_at = now
+        if self._queue.is_cancel_requested(self.job_id):
+            raise JobCancelledError(self.job_id)
+
+    def is_cancel_requested(self) -> bool:
+        return self._queue.is_cancel_requested(self.job_id)
+
+
+# ===== ジョブの種類ごとの処理 =====
+
+# job_type -> (処理関数(JobContext), 待機中にキャンセルされた場合の後処理(job))
+_job_handlers = {}
+# job_type -> 試行回数の上限に達して失敗にした場合の後処理(job)
+_job_failure_handlers = {}
+
+
+def register_job_handler(job_type: str, handler, on_cancelled=None, on_abandoned=None):
+    """
+    ジョブの処理を登録する
+
+    処理関数はハートビート切れ後に再実行されることがあるため、再実行しても結果が重複しないように作る。
+
+    Args:
+        job_type: ジョブの種類
+        handler: 処理関数。JobContext を受け取る
+        on_cancelled: 待機中にキャンセルされたジョブの後処理（状態の巻き戻しなど）。ジョブ（payload含む）を受け取る
+        on_abandoned: ハートビート切れが JOB_MAX_ATTEMPTS 回続いて失敗にしたジョブの後処理。ジョブ（payload含む）を受け取る
+    """
+    _job_handlers[job_type] = (handler, on_cancelled)
+    if on_abandoned is not None:
+        _job_failure_handlers[job_type] = on_abandoned
+
+
+def _load_job_handlers():
+    """ジョブの処理関数を登録しているモジュールを読み込む"""
+    import routers.action  # noqa: F401
+
+
+def cancel_job(job_id: str) -> dict | None:
+    """
+    ジョブのキャンセルを要求する（待機中だった場合は登録された後処理も実行する）
+
+    Returns:
+        dict | None: キャンセル要求後のジョブ（payloadは含めない）
+    """
+    queue = get_job_queue()
+    before = queue.get(job_id)
+    job = queue.request_cancel(job_id)
+    if job is None:
+        return None
+    if before and before["status"] == JOB_STATUS.QUEUED and job["status"] == JOB_STATUS.CANCELLED:
+        _, on_cancelled = _job_handlers.get(job["job_type"], (None, None))
+        if on_cancelled is not None:
+            try:
+                on_cancelled(job)
+            except Exception as e:
+                print(f"⚠️ キャンセル後処理エラー (job_id: {job_id}): {e}")
+    job.pop("payload", None)
+    return job
+
+
+# ===== ワーカー =====
+
+def reap_stale_jobs(queue: JobQueue):
+    """ハートビートが途絶えたジョブを再実行待ちに戻し、試行回数の上限に達したものは後処理を実行する"""
+    for job in queue.reap_stale():
+        print(f"❌ ジョブを失敗にしました（ハートビート切れが{job['attempts']}回続いたため） (job_id: {job['id']})")
+        on_abandoned = _job_failure_handlers.get(job["job_type"])
+        if on_abandoned is not None:
+            try:
+                on_abandoned(job)
+            except Exception as e:
+                print(f"⚠️ 失敗時の後処理エラー (job_id: {job['id']}): {e}")
+
+
+def _heartbeat_loop(queue: JobQueue, job_id: str, stop: threading.Event):
+    """処理関数が進捗を報告しない間もハートビートを送り続ける"""
+    interval = max(1.0, JOB_HEARTBEAT_TIMEOUT / 4)
+    while not stop.wait(interval):
+        try:
+            queue.heartbeat(job_id)
+        except Exception as e:
+            print(f"⚠️ ハートビート書き込みエラー (job_id: {job_id}): {e}")
+
+
+def execute_job(queue: JobQueue, job: dict):
+    """取り出したジョブを実行し、結果をキューに書き込む"""
+    job_id = job["id"]
+    handler, _ = _job_handlers.get(job["job_type"], (None, None))
+    if handler is None:
+        queue.finish(job_id, JOB_STATUS.FAILED, f"unknown job type: {job['job_type']}")
+        return
+
+    print(f"🏃 ジョブ開始: {job['job_type']} (job_id: {job_id}, project_id: {job['project_id']}, user_id: {job['user_id']})")
+    stop = threading.Event()
+    heartbeat_thread = threading.Thread(target=_heartbeat_loop, args=(queue, job_id, stop), daemon=True)
+    heartbeat_thread.start()
+    context = JobContext(queue, job)
+    try:
+        handler(context)
+    except JobCancelledError:
+        queue.finish(job_id, JOB_STATUS.CANCELLED)
+        print(f"🛑 ジョブをキャンセルしました (job_id: {job_id})")
+    except Exception as e:
+        traceback.print_exc()
+        queue.finish(job_id, JOB_STATUS.FAILED, str(e))
+        print(f"❌ ジョブ失敗 (job_id: {job_id}): {e}")
+    else:
+        # 処理関数がキャンセルを内部で処理して正常終了した場合もキャンセル済みとする
+        status = JOB_STATUS.CANCELLED if context.is_cancel_requested() else JOB_STATUS.SUCCEEDED
+        queue.finish(job_id, status)
+        print(f"✅ ジョブ終了: {status} (job_id: {job_id})")
+    finally:
+        stop.set()
+
+
+def run_worker(poll_interval: float = 1.0):
+    """キューからジョブを取り出して実行し続ける"""
+    _load_job_handlers()
+    queue = JobQueue()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"👷 ジョブワーカー起動: {worker_id}")
+    while True:
+        try:
+            reap_stale_jobs(queue)
+            job = queue.claim(worker_id)
+        except sqlite3.OperationalError as e:
+            print(f"⚠️ ジョブ取得エラー: {e}")
+            job = None
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        execute_job(queue, job)
+
+
+def _worker_process_main():
+    """ワーカープロセスのエントリーポイント"""
+    # Ctrl+C はプロセスグループ全体に届くため、親プロセスからの終了（SIGTERM）のみで止める
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    run_worker()
+
+
+# サーバーが起動したワーカープロセス
+_worker_processes = []
+
+
+def start_worker_processes(count: int = JOB_WORKERS) -> list:
+    """ワーカープロセスを起動する（torchなどを複製しないようspawnで起動）"""
+    context = multiprocessing.get_context("spawn")
+    for _ in range(count):
+        process = context.Process(target=_worker_process_main, daemon=True, name="clustering-job-worker")
+        process.start()
+        _worker_processes.append(process)
+    return _worker_processes
+
+
+def stop_worker_processes(timeout: float = 5.0):
+    """起動したワーカープロセスを終了する（実行中のジョブはハートビート切れ後に再実行される）"""
+    for process in _worker_processes:
+        if process.is_alive():
+            process.terminate()
+    for process in _worker_processes:
+        process.join(timeout)
+    _worker_processes.clear()
+
+
+# モジュールレベルで一度だけ生成
+_job_queue = None
+_job_queue_lock = Lock()
+
+
+def get_job_queue() -> JobQueue:
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue()
+    return _job_queue
+
+
+def main():
+    parser = argparse.ArgumentParser(description="クラスタリングジョブのワーカーを起動する")
+    parser.add_argument("--workers", type=int, default=1, help="起動するワーカープロセス数")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="ジョブが無いときの確認間隔（秒）")
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        run_worker(args.poll_interval)
+        return
+
+    start_worker_processes(args.workers)
+    try:
+        for process in _worker_processes:
+            process.join()
+    except KeyboardInterrupt:
+        stop_worker_processes()
+
+
+if __name__ == "__main__":
+    main()
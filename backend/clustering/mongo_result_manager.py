@@ -200,6 +200,50 @@ class ResultManager:
         # all_nodes からも削除
         self.remove_node_from_all_nodes(node_id)
 
+    def remove_file_nodes(self, clustering_ids: List[str]) -> int:
+        """
+        複数のファイルノード（画像）を result と all_nodes から1回の更新で削除する
+        
+        all_nodesを1度だけ取得して各画像の親フォルダのパスを求め、すべての削除を1つの$unsetにまとめる。
+        
+        Args:
+            clustering_ids (List[str]): 削除する画像のclustering_id（ツリーに存在しないものは無視する）
+            
+        Returns:
+            int: 削除したファイルノードの数
+        """
+        all_nodes = self.get_all_nodes()
+        if not all_nodes:
+            return 0
+        
+        unset_fields = {}
+        removed_count = 0
+        for clustering_id in clustering_ids:
+            node = all_nodes.get(clustering_id)
+            if not node or node.get('type') != 'file':
+                continue
+            
+            # 親フォルダからルートまで遡ってresult内のパスを作る
+            parents = []
+            current_id = node.get('parent_id')
+            while current_id and current_id in all_nodes and current_id not in parents:
+                parents.insert(0, current_id)
+                current_id = all_nodes[current_id].get('parent_id')
+            if not parents:
+                continue
+            
+            unset_fields[f"result.{'.data.'.join(parents)}.data.{clustering_id}"] = ""
+            unset_fields[f"all_nodes.{clustering_id}"] = ""
+            removed_count += 1
+        
+        if unset_fields:
+            collection = self._mongo_module.get_collection(self._clustering_results)
+            collection.update_one(
+                {"mongo_result_id": self._mongo_result_id},
+                {"$unset": unset_fields}
+            )
+        return removed_count
+
     def move_folder_node(self, target_folder_ids: List[str], destination_folder_id: str) -> None:
         """
         フォルダノードを移動する
@@ -0,0 +1,102 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+from config import THUMBNAIL_PATH, THUMBNAIL_WIDTHS
+
+
+class ThumbnailManager:
+    """
+    画像表示用サムネイルのディスクキャッシュ
+
+    サムネイルは <THUMBNAIL_PATH>/<幅>/<folder_id>/<name> に保存し、
+    元画像より古い場合のみ再生成する（アップロード時に事前生成、未生成なら初回リクエスト時に生成）。
+    """
+
+    BASE_DIR = Path(__file__).parent.parent  # backend/
+    WIDTHS = THUMBNAIL_WIDTHS
+    DEFAULT_WIDTH = 600
+
+    # アップロード処理をブロックしないための生成用スレッドプール
+    _executor = ThreadPoolExecutor(max_workers=2)
+
+    @classmethod
+    def thumbnail_path(cls, folder_id: str, name: str, width: int) -> Path:
+        return cls.BASE_DIR / THUMBNAIL_PATH / str(width) / folder_id / name
+
+    @classmethod
+    def _render(cls, source_path: Path, dest_path: Path, width: int):
+        """元画像を白背景でRGB化し、指定幅に縮小してPNGで保存する（一時ファイル経由で置き換え）"""
+        img = Image.open(source_path)
+
+        # 透過部分を白背景に変換
+        if img.mode in ('RGBA', 'LA', 'P'):
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            if img.mode == 'P':
+                img = img.convert('RGBA')
+            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        # リサイズ（幅を最大width pxに制限、アスペクト比維持）
+        if img.width > width:
+            ratio = width / img.width
+            new_height = int(img.height * ratio)
+            img = img.resize((width, new_height), Image.Resampling.LANCZOS)
+
+        os.makedirs(dest_path.parent, exist_ok=True)
+        # 同じサムネイルを複数スレッドが同時に生成しても一時ファイルが衝突しないよう、呼び出しごとに一意な名前にする
+        tmp_path = dest_path.with_name(f".{dest_path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            img.save(tmp_path, format='PNG', optimize=True)
+            os.replace(tmp_path, dest_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    @classmethod
+    def get_thumbnail(cls, source_path: Path, folder_id: str, name: str, width: int = DEFAULT_WIDTH) -> Path:
+        """
+        サムネイルのパスを返す（存在しない、または元画像より古い場合は生成する）
+
+        Args:
+            source_path: 元画像のパス
+            folder_id: 画像フォルダ名
+            name: 画像ファイル名
+            width: サムネイル幅（WIDTHSのいずれか）
+
+        Returns:
+            Path: サムネイルファイルのパス
+        """
+        dest_path = cls.thumbnail_path(folder_id, name, width)
+        try:
+            if dest_path.stat().st_mtime >= source_path.stat().st_mtime:
+                return dest_path
+        except FileNotFoundError:
+            pass
+        cls._render(source_path, dest_path, width)
+        return dest_path
+
+    @classmethod
+    def generate_all(cls, source_path: Path, folder_id: str, name: str):
+        """全サイズのサムネイルを生成する（失敗しても表示時に再生成されるため例外は握りつぶす）"""
+        for width in cls.WIDTHS:
+            try:
+                cls.get_thumbnail(source_path, folder_id, name, width)
+            except Exception as e:
+                print(f"⚠️ サムネイル生成失敗 ({folder_id}/{name}, {width}px): {e}")
+
+    @classmethod
+    def schedule_generation(cls, source_path: Path, folder_id: str, name: str):
+        """アップロード直後にバックグラウンドで全サイズのサムネイルを生成する"""
+        cls._executor.submit(cls.generate_all, Path(source_path), folder_id, name)
+
+    @classmethod
+    def delete_all(cls, folder_id: str, name: str):
+        """全サイズのサムネイルを削除する（画像の削除時）"""
+        for width in cls.WIDTHS:
+            cls.thumbnail_path(folder_id, name, width).unlink(missing_ok=True)
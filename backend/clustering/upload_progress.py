@@ -0,0 +1,292 @@
+"""
+バッチアップロードの進捗管理
+
+POST /images/batch で受け付けたバッチごとに、ファイル単位の状態（待機中/処理中/成功/失敗）と
+処理段階ごとの所要時間を保持し、GET /images/upload-status/{batch_id}（ロングポーリング・SSE）から参照する。
+
+- 状態の更新はイベントループ上のアップロード処理からのみ行うため、ロックは使用しない
+- 更新ごとにバッチのversionを進め、ファイルにも最後に更新されたversionを記録する。
+  クライアントは前回受け取ったversionを渡すことで、変化したファイルだけを受け取れる
+- 完了したバッチは UPLOAD_STATUS_TTL 秒後に破棄し、保持するバッチ数は UPLOAD_STATUS_MAX_BATCHES 個までに制限する
+  （処理中のバッチは破棄しないため、全て処理中の場合は一時的に上限を超える）
+"""
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+
+from config import UPLOAD_STATUS_TTL, UPLOAD_STATUS_MAX_BATCHES
+
+
+class UPLOAD_FILE_STATUS:
+    QUEUED = "queued"
+    PROCESSING = "processing"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class UPLOAD_BATCH_STATUS:
+    PROCESSING = "processing"
+    COMPLETED = "completed"
+
+
+class StageTimer:
+    """
+    アップロード処理の段階ごとの所要時間（秒）を記録する
+
+    mark() を呼ぶと直前の段階を締めて次の段階を開始する。
+    listener が指定されている場合は段階が切り替わるたびに (段階名, これまでの所要時間) を通知する。
+    """
+
+    def __init__(self, listener=None):
+        self._listener = listener
+        self._stage = None
+        self._stage_start = None
+        self.timings = {}
+
+    @property
+    def stage(self) -> str | None:
+        return self._stage
+
+    def _close(self, now: float):
+        if self._stage is not None:
+            self.timings[self._stage] = round(self.timings.get(self._stage, 0.0) + now - self._stage_start, 4)
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self._close(now)
+        self._stage = stage
+        self._stage_start = now
+        if self._listener:
+            self._listener(stage, self.timings)
+
+    def finish(self) -> dict:
+        """実行中の段階を締めて所要時間を返す"""
+        self._close(time.perf_counter())
+        self._stage = None
+        return self.timings
+
+
+class UploadProgressTracker:
+    """
+    バッチアップロードの進捗を保持する（メモリ上、プロセス内のみ）
+    """
+
+    def __init__(self, ttl: int = UPLOAD_STATUS_TTL, max_batches: int = UPLOAD_STATUS_MAX_BATCHES):
+        self._ttl = ttl
+        self._max_batches = max(1, max_batches)
+        self._batches = OrderedDict()
+        self._evicted_count = 0
+
+    def create_batch(self, project_id: int, user_id: int, filenames: list[str], settings: dict = None) -> str:
+        """
+        バッチを登録してIDを返す
+
+        Args:
+            project_id: プロジェクトID
+            user_id: アップロードしたユーザーID
+            filenames: アップロードするファイル名（送信順）
+            settings: バッチの設定（max_concurrentなど、そのまま返す）
+
+        Returns:
+            str: バッチID
+        """
+        self.evict_expired()
+        batch_id = uuid.uuid4().hex
+        self._batches[batch_id] = {
+            "batch_id": batch_id,
+            "project_id": project_id,
+            "user_id": user_id,
+            "status": UPLOAD_BATCH_STATUS.PROCESSING,
+            "settings": settings or {},
+            "created_at": time.time(),
+            "finished_at": None,
+            "version": 0,
+            "completed_files": 0,
+            "success_count": 0,
+            "failure_count": 0,
+            "files": [
+                {
+                    "index": index,
+                    "filename": filename,
+                    "status": UPLOAD_FILE_STATUS.QUEUED,
+                    "stage": None,
+                    "stage_timings": {},
+                    "processing_time": None,
+                    "message": None,
+                    "error_type": None,
+                    "status_code": None,
+                    "data": None,
+                    "version": 0
+                }
+                for index, filename in enumerate(filenames)
+            ],
+            "result": None,
+            "_event": None
+        }
+        self._enforce_limit()
+        return batch_id
+
+    def _touch(self, batch: dict, file_entry: dict = None):
+        """versionを進めて待機中のクライアントを起こす"""
+        batch["version"] += 1
+        if file_entry is not None:
+            file_entry["version"] = batch["version"]
+        event = batch["_event"]
+        if event is not None:
+            batch["_event"] = None
+            event.set()
+
+    def _file(self, batch_id: str, index: int) -> tuple[dict | None, dict | None]:
+        batch = self._batches.get(batch_id)
+        if batch is None or not 0 <= index < len(batch["files"]):
+            return None, None
+        return batch, batch["files"][index]
+
+    def file_stage(self, batch_id: str, index: int, stage: str, timings: dict):
+        """ファイルの処理段階が進んだことを記録する（StageTimerのlistenerとして使用）"""
+        batch, file_entry = self._file(batch_id, index)
+        if file_entry is None:
+            return
+        file_entry["status"] = UPLOAD_FILE_STATUS.PROCESSING
+        file_entry["stage"] = stage
+        file_entry["stage_timings"] = dict(timings)
+        self._touch(batch, file_entry)
+
+    def file_finished(self, batch_id: str, index: int, result: dict, timings: dict):
+        """
+        ファイルの処理結果を記録する
+
+        Args:
+            batch_id: バッチID
+            index: ファイルの位置
+            result: UploadResult.to_dict() 形式の結果
+            timings: 段階ごとの所要時間（秒）
+        """
+        batch, file_entry = self._file(batch_id, index)
+        if file_entry is None:
+            return
+        success = bool(result.get("success"))
+        file_entry.update({
+            "status": UPLOAD_FILE_STATUS.SUCCEEDED if success else UPLOAD_FILE_STATUS.FAILED,
+            "stage": None,
+            "stage_timings": dict(timings),
+            "processing_time": round(sum(timings.values()), 4),
+            "message": result.get("message"),
+            "error_type": result.get("error_type"),
+            "status_code": result.get("status_code"),
+            "data": result.get("data")
+        })
+        batch["completed_files"] += 1
+        batch["success_count" if success else "failure_count"] += 1
+        self._touch(batch, file_entry)
+
+    def finish_batch(self, batch_id: str, result: dict):
+        """バッチ全体の処理完了を記録する（resultは同期実行時のレスポンスと同じ集計）"""
+        batch = self._batches.get(batch_id)
+        if batch is None:
+            return
+        batch["status"] = UPLOAD_BATCH_STATUS.COMPLETED
+        batch["finished_at"] = time.time()
+        batch["result"] = result
+        self._touch(batch)
+
+    def snapshot(self, batch_id: str, since: int = 0) -> dict | None:
+        """
+        バッチの状態を返す
+
+        Args:
+            batch_id: バッチID
+            since: クライアントが前回受け取ったversion（これより後に更新されたファイルのみ返す）
+
+        Returns:
+            dict | None: バッチの状態。存在しない（期限切れを含む）場合はNone
+        """
+        self.evict_expired()
+        batch = self._batches.get(batch_id)
+        if batch is None:
+            return None
+        now = time.time()
+        finished_at = batch["finished_at"]
+        return {
+            "batch_id": batch_id,
+            "project_id": batch["project_id"],
+            "user_id": batch["user_id"],
+            "status": batch["status"],
+            "settings": batch["settings"],
+            "version": batch["version"],
+            "total_files": len(batch["files"]),
+            "completed_files": batch["completed_files"],
+            "success_count": batch["success_count"],
+            "failure_count": batch["failure_count"],
+            "created_at": datetime.fromtimestamp(batch["created_at"]).isoformat(),
+            "finished_at": datetime.fromtimestamp(finished_at).isoformat() if finished_at else None,
+            "elapsed_time": round((finished_at or now) - batch["created_at"], 2),
+            "files": [file_entry for file_entry in batch["files"] if file_entry["version"] > since],
+            "result": batch["result"]
+        }
+
+    async def wait_for_update(self, batch_id: str, since: int, timeout: float) -> dict | None:
+        """
+        バッチのversionがsinceより進むか、完了するか、timeout秒経過するまで待ってから状態を返す
+        """
+        batch = self._batches.get(batch_id)
+        if batch is not None and batch["version"] <= since and batch["status"] != UPLOAD_BATCH_STATUS.COMPLETED:
+            if batch["_event"] is None:
+                batch["_event"] = asyncio.Event()
+            try:
+                await asyncio.wait_for(batch["_event"].wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.snapshot(batch_id, since)
+
+    def evict_expired(self):
+        """完了から UPLOAD_STATUS_TTL 秒を過ぎたバッチを破棄する"""
+        deadline = time.time() - self._ttl
+        expired = [
+            batch_id for batch_id, batch in self._batches.items()
+            if batch["finished_at"] is not None and batch["finished_at"] < deadline
+        ]
+        for batch_id in expired:
+            del self._batches[batch_id]
+        self._evicted_count += len(expired)
+
+    def _enforce_limit(self):
+        """
+        保持数の上限を超えた場合、古い完了済みバッチから破棄する
+        処理中のバッチは進捗の参照中に消えないよう破棄しない（完了済みが無ければ上限を超えたままにする）
+        """
+        excess = len(self._batches) - self._max_batches
+        if excess <= 0:
+            return
+        victims = [batch_id for batch_id, batch in self._batches.items() if batch["finished_at"] is not None][:excess]
+        for batch_id in victims:
+            del self._batches[batch_id]
+        self._evicted_count += len(victims)
+
+    def stats(self) -> dict:
+        processing = sum(1 for batch in self._batches.values() if batch["status"] == UPLOAD_BATCH_STATUS.PROCESSING)
+        return {
+            "batches": len(self._batches),
+            "processing_batches": processing,
+            "evicted_batches": self._evicted_count,
+            "ttl_seconds": self._ttl,
+            "max_batches": self._max_batches
+        }
+
+
+# モジュールレベルで一度だけ生成
+_upload_tracker = None
+_upload_tracker_lock = Lock()
+
+
+def get_upload_tracker() -> UploadProgressTracker:
+    global _upload_tracker
+    if _upload_tracker is None:
+        with _upload_tracker_lock:
+            if _upload_tracker is None:
+                _upload_tracker = UploadProgressTracker()
+    return _upload_tracker
@@ -0,0 +1,107 @@
+"""
+アップロード処理のワーカープール
+
+asyncのエンドポイントからイベントループをブロックする処理を切り離すために使用する。
+- CPU処理（PNG変換・文章/画像埋め込み）: プロセスプール（モデルはワーカープロセスごとに初回のみ読み込む）
+- ブロッキングI/O（MySQL・ChromaDB・ファイル書き込み・キャッシュ）: 上限付きスレッドプール
+
+ハンドラ側は run_cpu / run_io を await するだけにする。
+"""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from io import BytesIO
+from pathlib import Path
+from threading import Lock
+
+from config import UPLOAD_CPU_WORKERS, UPLOAD_IO_WORKERS
+
+
+# ===== プロセスプールで実行する関数（pickle可能なモジュールレベル関数） =====
+
+def convert_to_png(contents: bytes) -> bytes:
+    """画像を無圧縮のPNGに変換する（元の品質を維持）"""
+    from PIL import Image
+
+    temp_image = Image.open(BytesIO(contents))
+    temp_png_io = BytesIO()
+    temp_image.save(temp_png_io, format='PNG', compress_level=0)
+    return temp_png_io.getvalue()
+
+
+def encode_sentences(sentences: list[str]) -> list:
+    """文章の埋め込みベクトルを生成する"""
+    from clustering.embeddings_manager.sentence_embeddings_manager import SentenceEmbeddingsManager
+
+    return [SentenceEmbeddingsManager.sentence_to_embedding(sentence) for sentence in sentences]
+
+
+def encode_image(image_path: str) -> list[float] | None:
+    """画像の埋め込みベクトルを生成する"""
+    from clustering.embeddings_manager.image_embeddings_manager import ImageEmbeddingsManager
+
+    return ImageEmbeddingsManager.image_to_embedding(Path(image_path))
+
+
+# ===== プール =====
+
+_cpu_pool = None
+_io_pool = None
+_pool_lock = Lock()
+
+
+def get_cpu_pool() -> ProcessPoolExecutor:
+    """CPU処理用のプロセスプール（torchをforkで複製しないようspawnで起動）"""
+    global _cpu_pool
+    if _cpu_pool is None:
+        with _pool_lock:
+            if _cpu_pool is None:
+                _cpu_pool = ProcessPoolExecutor(
+                    max_workers=UPLOAD_CPU_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+    return _cpu_pool
+
+
+def get_io_pool() -> ThreadPoolExecutor:
+    """ブロッキングI/O用のスレッドプール"""
+    global _io_pool
+    if _io_pool is None:
+        with _pool_lock:
+            if _io_pool is None:
+                _io_pool = ThreadPoolExecutor(max_workers=UPLOAD_IO_WORKERS, thread_name_prefix="upload-io")
+    return _io_pool
+
+
+async def run_cpu(func, *args, **kwargs):
+    """CPU処理をプロセスプールで実行して結果を待つ"""
+    global _cpu_pool
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_cpu_pool(), partial(func, *args, **kwargs))
+    except BrokenProcessPool:
+        # ワーカープロセスが異常終了した場合は次回の呼び出しでプールを作り直す
+        with _pool_lock:
+            _cpu_pool = None
+        raise
+
+
+async def run_io(func, *args, **kwargs):
+    """ブロッキングI/Oをスレッドプールで実行して結果を待つ"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_pool(), partial(func, *args, **kwargs))
+
+
+def shutdown_pools():
+    """サーバー終了時にプールを停止する"""
+    global _cpu_pool, _io_pool
+    with _pool_lock:
+        if _cpu_pool is not None:
+            _cpu_pool.shutdown(wait=False, cancel_futures=True)
+            _cpu_pool = None
+        if _io_pool is not None:
+            _io_pool.shutdown(wait=False, cancel_futures=True)
+            _io_pool = None
@@ -1,14 +1,19 @@
 from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 import os
 from pathlib import Path
 import shutil
 import uuid
 import base64
 import json
+import datetime
 from io import BytesIO
 from PIL import Image
+import struct
 import zipfile
 import tempfile
+from .caption_store import get_caption_store
+from config import OUTPUT_MATERIALIZE_MODE
 
 # 複数のキャプションJSONファイルを配列として指定可能
 EXPAMPLE_JSON_PATHS = [
@@ -20,7 +25,12 @@ EXPAMPLE_JSON_PATHS = [
     Path('captions_20260117_112640.json')
 ]
 
-# キャプションデータをモジュールレベルでキャッシュ（起動時に一度だけ読み込み）
+# コンパイル済みキャプションストアのプレフィックス（<prefix>.idx / <prefix>.blob）
+# 作成: python -m clustering.caption_store captions_store <EXPAMPLE_JSON_PATHSのファイル...>
+# ストアが存在する場合はJSONを読み込まずにメモリマップで参照する
+CAPTION_STORE_PREFIX = Path('captions_store')
+
+# キャプションデータをモジュールレベルでキャッシュ（ストアが無い場合のみ、初回に一度だけ読み込み）
 _caption_cache = None
 _caption_cache_lock = None
 
@@ -51,19 +61,192 @@ def _load_caption_cache():
                 print(f"✅ 合計 {len(_caption_cache)} 件のキャプションデータをキャッシュしました")
     return _caption_cache
 
+# 画像など既に圧縮済みの形式はZIP内で再圧縮しない
+ZIP_STORED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp'}
+
+# ZIPのローカルファイルヘッダ（固定長部分）の形式とサイズ
+ZIP_LOCAL_HEADER_STRUCT = struct.Struct("<4s2B4HL2L2H")
+ZIP_LOCAL_HEADER_SIGNATURE = b"PK\003\004"
+
+# JSONを逐次書き出す際に1回で送信するおおよその文字数
+STREAM_BUFFER_SIZE = 64 * 1024
+
+
+class _ZipStreamBuffer:
+    """
+    ZipFileの書き込み先として使う、シーク不可の追記専用バッファ
+    tell()のみ提供するため、ZipFileはデータディスクリプタ方式で書き込む
+    """
+    
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+        self._position = 0
+    
+    def write(self, data) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+            self._size += len(data)
+            self._position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self._position
+    
+    def flush(self):
+        pass
+    
+    @property
+    def size(self) -> int:
+        return self._size
+    
+    def pop(self) -> bytes:
+        """溜まったデータを取り出してバッファを空にする"""
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self._size = 0
+        return data
+
+
 class Utils:
+    # stream_json で逐次書き出すマッピングの位置を示す値
+    JSON_STREAM_PLACEHOLDER = "__json_stream_placeholder__"
+    
     
     @classmethod
-    def copy_images_parallel(cls,metadata_list, src_folder, dest_folder):
+    def copy_images_parallel(cls,metadata_list, src_folder, dest_folder, mode: str = OUTPUT_MATERIALIZE_MODE):
         THREADS = 8
         def copy_one(metadata):
             src = src_folder / Path(metadata.path)
             if src.exists():
                 dest = dest_folder / src.name
-                shutil.copy(src, dest)
+                cls.link_or_copy(src, dest, mode=mode)
 
         with ThreadPoolExecutor(max_workers=THREADS) as executor:
             executor.map(copy_one, metadata_list)
+    
+    @classmethod
+    def link_or_copy(cls, src: Path, dst: Path, mode: str = "hardlink") -> str:
+        """
+        ハードリンク → シンボリックリンク → コピー の順に試してファイルを配置する
+        
+        Args:
+            src: 元ファイル
+            dst: 配置先（既存の場合は置き換える）
+            mode: 'hardlink' / 'symlink' / 'copy'（指定した方式から順にフォールバック）
+            
+        Returns:
+            str: 実際に使用した方式
+        """
+        if os.path.lexists(dst):
+            os.remove(dst)
+        if mode == "hardlink":
+            try:
+                os.link(src, dst)
+                return "hardlink"
+            except OSError:
+                pass
+        if mode in ("hardlink", "symlink"):
+            try:
+                os.symlink(os.path.abspath(src), dst)
+                return "symlink"
+            except OSError:
+                pass
+        shutil.copy2(src, dst)
+        return "copy"
+    
+    @classmethod
+    def materialize_tree(cls, tree: dict, images_folder_path: Path, output_path: Path,
+                         mode: str = "hardlink", max_workers: int = 8) -> dict:
+        """
+        分類結果の階層構造をフォルダとして出力する（リンク優先・差分のみ・並列）
+        
+        - 画像はハードリンク（不可ならシンボリックリンク、さらに不可ならコピー）で配置する
+        - 前回出力時のマニフェストと比較し、内容が変わったリーフフォルダのみ更新する
+        - 結果に存在しなくなったフォルダは削除する
+        
+        Args:
+            tree: {folder_id: {"data": ..., "is_leaf": bool, ...}} 形式の階層構造
+            images_folder_path: 元画像のフォルダ
+            output_path: 出力先のルートフォルダ
+            mode: 'hardlink' / 'symlink' / 'copy'
+            max_workers: 並列数
+            
+        Returns:
+            dict: 方式ごとの配置数・スキップ/削除したフォルダ数
+        """
+        output_path = Path(output_path)
+        os.makedirs(output_path, exist_ok=True)
+        manifest_path = output_path / ".materialize_manifest.json"
+        try:
+            with open(manifest_path, encoding='utf-8') as f:
+                previous_manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            previous_manifest = {}
+        
+        # 出力すべきリーフフォルダと、各非リーフフォルダが持つべき子フォルダを収集
+        leaves = {}
+        expected_children = {".": set(tree.keys())}
+        stack = [(tree, Path("."))]
+        while stack:
+            node_dict, relative_path = stack.pop()
+            for folder_id, node in node_dict.items():
+                folder_relative = relative_path / folder_id
+                if node.get('is_leaf', False):
+                    leaves[folder_relative.as_posix()] = sorted(set(node.get('data', {}).values()))
+                else:
+                    children = node.get('data', {})
+                    expected_children[folder_relative.as_posix()] = set(children.keys())
+                    stack.append((children, folder_relative))
+        
+        stats = {"hardlink": 0, "symlink": 0, "copy": 0, "skipped_folders": 0, "removed_folders": 0}
+        stats_lock = Lock()
+        
+        # 結果に存在しないフォルダを削除（JSONやマニフェスト等のファイルは残す）
+        for relative, children in expected_children.items():
+            folder = output_path / relative
+            if not folder.is_dir():
+                continue
+            for child in folder.iterdir():
+                if child.is_dir() and not child.is_symlink() and child.name not in children:
+                    shutil.rmtree(child)
+                    stats["removed_folders"] += 1
+        
+        def sync_leaf(relative: str, filenames: list[str]):
+            folder = output_path / relative
+            if previous_manifest.get(relative) == filenames and folder.is_dir():
+                with stats_lock:
+                    stats["skipped_folders"] += 1
+                return
+            os.makedirs(folder, exist_ok=True)
+            wanted = set(filenames)
+            for existing in os.listdir(folder):
+                if existing not in wanted:
+                    existing_path = folder / existing
+                    if existing_path.is_dir() and not existing_path.is_symlink():
+                        shutil.rmtree(existing_path)
+                    else:
+                        os.remove(existing_path)
+            for filename in filenames:
+                src = images_folder_path / filename
+                if not src.exists():
+                    print(f"⚠️ 画像が見つかりません: {src}")
+                    continue
+                used = cls.link_or_copy(src, folder / filename, mode=mode)
+                with stats_lock:
+                    stats[used] += 1
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(sync_leaf, relative, filenames) for relative, filenames in leaves.items()]
+            for future in futures:
+                future.result()
+        
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(leaves, f, ensure_ascii=False)
+        
+        print(f"📁 フォルダ出力: ハードリンク {stats['hardlink']} / シンボリックリンク {stats['symlink']} / コピー {stats['copy']} "
+              f"/ 変更なし {stats['skipped_folders']} フォルダ / 削除 {stats['removed_folders']} フォルダ")
+        return stats
             
     @classmethod
     def generate_uuid(cls):
@@ -81,6 +264,15 @@ class Utils:
             tuple: (is_success: bool, caption: str)
         """
         try:
+            # コンパイル済みストアがあれば二分探索で取得（JSONは読み込まない）
+            store = get_caption_store(CAPTION_STORE_PREFIX)
+            if store is not None:
+                item = store.get(path)
+                if item is None:
+                    print(f"⚠️ キャプション取得失敗: ファイル '{path}' がキャプションデータに存在しません")
+                    return False, "No caption found."
+                return item["is_success"], item["caption"]
+            
             # キャッシュからデータを取得
             data = _load_caption_cache()
             
@@ -235,4 +427,251 @@ class Utils:
             
             cls.create_zip_from_folder(package_dir, zip_path)
             
-            return zip_path
\ No newline at end of file
+            return zip_path
+    
+    @classmethod
+    def _safe_folder_name(cls, folder_name: str) -> str:
+        """ファイル名として使えない文字を置換"""
+        return "".join(c if c.isalnum() or c in (' ', '-', '_', '.') else '_' for c in folder_name)
+    
+    @classmethod
+    def iter_classification_entries(cls, result_dict: dict, source_images_path: Path, arc_prefix: str = "images"):
+        """
+        分類結果の階層構造を走査し、ZIP内パスと元画像パスの組を順に返す
+        （create_classification_folder_structureと同じフォルダ構成）
+        
+        Args:
+            result_dict: MongoDBのresult（階層構造）
+            source_images_path: 元画像のパス
+            arc_prefix: ZIP内のルートフォルダ名
+            
+        Yields:
+            tuple[str, str, Path]: (ZIP内パス, clustering_id, 元画像パス)
+        """
+        stack = [(result_dict, arc_prefix)]
+        while stack:
+            node_dict, current_path = stack.pop()
+            for folder_id, folder_info in node_dict.items():
+                folder_path = f"{current_path}/{cls._safe_folder_name(folder_info.get('name', folder_id))}"
+                
+                if folder_info.get('is_leaf', False):
+                    for clustering_id, image_name in folder_info.get('data', {}).items():
+                        source_image = source_images_path / image_name
+                        if source_image.exists():
+                            yield f"{folder_path}/{image_name}", clustering_id, source_image
+                        else:
+                            print(f"⚠️ 画像が見つかりません: {source_image}")
+                else:
+                    sub_folders = folder_info.get('data', {})
+                    if isinstance(sub_folders, dict):
+                        stack.append((sub_folders, folder_path))
+    
+    @classmethod
+    def json_default(cls, value):
+        """json.dumps で直接変換できない値（datetimeなど）を変換する"""
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        return str(value)
+    
+    @classmethod
+    def stream_json_list(cls, envelope: dict, rows):
+        """
+        envelope 内の JSON_STREAM_PLACEHOLDER の位置に、rows（dictのイテレータ）を配列として
+        逐次書き出すJSONを生成する（全件をメモリ上で1つのリストにまとめない）
+        
+        Args:
+            envelope: レスポンス全体（JSON_STREAM_PLACEHOLDER を値として1か所だけ含む）
+            rows: 配列の要素を順に返すイテレータ
+            
+        Yields:
+            bytes: JSONデータのチャンク
+        """
+        head, tail = json.dumps(envelope, ensure_ascii=False).split(json.dumps(cls.JSON_STREAM_PLACEHOLDER), 1)
+        bodies = (json.dumps(row, ensure_ascii=False, default=cls.json_default) for row in rows)
+        yield (head + "[").encode("utf-8")
+        yield from cls._buffered(bodies, separator=",")
+        yield ("]" + tail).encode("utf-8")
+    
+    @classmethod
+    def stream_ndjson(cls, rows):
+        """rows（dictのイテレータ）を1行1件のJSON（NDJSON）として逐次書き出す"""
+        bodies = (json.dumps(row, ensure_ascii=False, default=cls.json_default) + "\n" for row in rows)
+        yield from cls._buffered(bodies)
+    
+    @classmethod
+    def _buffered(cls, bodies, separator: str = "", buffer_size: int = STREAM_BUFFER_SIZE):
+        """文字列を separator で連結し、buffer_size 文字程度ごとにまとめてbytesで返す（1件ごとに送信しない）"""
+        buffer = []
+        buffered = 0
+        first = True
+        for body in bodies:
+            if not first:
+                body = separator + body
+            first = False
+            buffer.append(body)
+            buffered += len(body)
+            if buffered >= buffer_size:
+                yield "".join(buffer).encode("utf-8")
+                buffer = []
+                buffered = 0
+        if buffer:
+            yield "".join(buffer).encode("utf-8")
+    
+    @classmethod
+    def stream_json(cls, envelope: dict, chunks):
+        """
+        envelope 内の JSON_STREAM_PLACEHOLDER の位置に、chunks（dictのイテレータ）を連結したオブジェクトを
+        逐次書き出すJSONを生成する（全件をメモリ上で1つのdictにまとめない）
+        
+        Args:
+            envelope: レスポンス全体（JSON_STREAM_PLACEHOLDER を値として1か所だけ含む）
+            chunks: 書き出すキーと値のdictを順に返すイテレータ
+            
+        Yields:
+            bytes: JSONデータのチャンク
+        """
+        head, tail = json.dumps(envelope, ensure_ascii=False).split(json.dumps(cls.JSON_STREAM_PLACEHOLDER), 1)
+        yield (head + "{").encode("utf-8")
+        first = True
+        for chunk in chunks:
+            if not chunk:
+                continue
+            body = json.dumps(chunk, ensure_ascii=False)[1:-1]
+            yield (body if first else "," + body).encode("utf-8")
+            first = False
+        yield ("}" + tail).encode("utf-8")
+    
+    @staticmethod
+    def _zip_entry_key(clustering_id: str, source_image: Path) -> str:
+        """直前のZIPのエントリを再利用できるか判定するキー（エントリのコメントに保存する）"""
+        stat_result = source_image.stat()
+        return f"{clustering_id}:{stat_result.st_size}:{stat_result.st_mtime_ns}"
+    
+    @classmethod
+    def _index_reusable_entries(cls, archive: zipfile.ZipFile) -> dict:
+        """直前のZIPの無圧縮（ZIP_STORED）エントリをキー（エントリのコメント）で索引する"""
+        entries = {}
+        for info in archive.infolist():
+            if info.compress_type == zipfile.ZIP_STORED and info.comment and not info.is_dir():
+                entries[info.comment.decode('utf-8')] = info
+        return entries
+    
+    @classmethod
+    def _copy_raw_entry(cls, zipf: zipfile.ZipFile, buffer: "_ZipStreamBuffer", zinfo: zipfile.ZipInfo,
+                        previous_file, previous_info: zipfile.ZipInfo, chunk_size: int):
+        """
+        直前のZIPの無圧縮エントリを展開・CRC計算せずにそのままコピーする
+        
+        CRC・サイズは直前のZIPのセントラルディレクトリの値を使い、ローカルヘッダに書き込む
+        （データディスクリプタは付けない）。ZipFile への登録は ZipFile.mkdir と同じ手順で行う。
+        
+        Yields:
+            bytes: ZIPデータのチャンク
+        """
+        previous_file.seek(previous_info.header_offset)
+        header = ZIP_LOCAL_HEADER_STRUCT.unpack(previous_file.read(ZIP_LOCAL_HEADER_STRUCT.size))
+        if header[0] != ZIP_LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"ローカルヘッダが不正です: {previous_info.filename}")
+        filename_length, extra_length = header[-2], header[-1]
+        previous_file.seek(previous_info.header_offset + ZIP_LOCAL_HEADER_STRUCT.size + filename_length + extra_length)
+        
+        zinfo.compress_type = zipfile.ZIP_STORED
+        zinfo.CRC = previous_info.CRC
+        zinfo.file_size = previous_info.file_size
+        zinfo.compress_size = previous_info.compress_size
+        with zipf._lock:
+            zinfo.header_offset = buffer.tell()
+            zipf._writecheck(zinfo)
+            zipf._didModify = True
+            buffer.write(zinfo.FileHeader())
+            remaining = previous_info.compress_size
+            while remaining > 0:
+                data = previous_file.read(min(chunk_size, remaining))
+                if not data:
+                    raise zipfile.BadZipFile(f"エントリのデータが途中で終わっています: {previous_info.filename}")
+                buffer.write(data)
+                remaining -= len(data)
+                if buffer.size >= chunk_size:
+                    yield buffer.pop()
+            zipf.filelist.append(zinfo)
+            zipf.NameToInfo[zinfo.filename] = zinfo
+            zipf.start_dir = buffer.tell()
+    
+    @classmethod
+    def stream_classification_zip(cls, result_dict: dict, all_nodes_dict: dict,
+                                  source_images_path: Path, chunk_size: int = 1024 * 1024,
+                                  previous_archive: Path = None):
+        """
+        分類結果のダウンロードパッケージをZIPとして逐次生成する（一時ディレクトリ・一時ZIPを作らない）
+        
+        画像は元ファイルから直接ZIPエントリとして書き込み、PNG等は無圧縮（ZIP_STORED）で格納する。
+        各画像エントリのコメントには clustering_id・元画像のサイズ・更新日時を記録し、
+        previous_archive に同じキーの無圧縮エントリがあれば元画像を読まずにそのバイト列をコピーする。
+        ZIPの構成はcreate_classification_download_packageと同じ。
+        
+        Args:
+            result_dict: MongoDBのresult
+            all_nodes_dict: MongoDBのall_nodes
+            source_images_path: 元画像のパス
+            chunk_size: 1回に返すデータの目安サイズ（バイト）
+            previous_archive: 同じ分類結果の直前のZIP（変更の無い画像エントリの再利用元）
+            
+        Yields:
+            bytes: ZIPデータのチャンク
+        """
+        previous_file = None
+        previous_entries = {}
+        if previous_archive is not None:
+            try:
+                previous_file = open(previous_archive, 'rb')
+                with zipfile.ZipFile(previous_file, 'r') as previous_zip:
+                    previous_entries = cls._index_reusable_entries(previous_zip)
+            except (OSError, zipfile.BadZipFile) as e:
+                print(f"⚠️ 再利用元ZIPを開けませんでした ({previous_archive}): {e}")
+                if previous_file is not None:
+                    previous_file.close()
+                previous_file = None
+                previous_entries = {}
+        
+        buffer = _ZipStreamBuffer()
+        reused_count = 0
+        try:
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zipf:
+                zipf.writestr("result.json", json.dumps(result_dict, ensure_ascii=False, indent=2))
+                zipf.writestr("all_nodes.json", json.dumps(all_nodes_dict, ensure_ascii=False, indent=2))
+                yield buffer.pop()
+                
+                written = set()
+                for arcname, clustering_id, source_image in cls.iter_classification_entries(result_dict, source_images_path):
+                    # 同じパスは1度だけ格納（フォルダ構造作成時の上書きと同じ結果）
+                    if arcname in written:
+                        continue
+                    written.add(arcname)
+                    
+                    zinfo = zipfile.ZipInfo.from_file(source_image, arcname)
+                    zinfo.compress_type = zipfile.ZIP_STORED if source_image.suffix.lower() in ZIP_STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                    entry_key = cls._zip_entry_key(clustering_id, source_image)
+                    zinfo.comment = entry_key.encode('utf-8')
+                    
+                    previous_info = previous_entries.get(entry_key)
+                    if previous_info is not None and zinfo.compress_type == zipfile.ZIP_STORED:
+                        yield from cls._copy_raw_entry(zipf, buffer, zinfo, previous_file, previous_info, chunk_size)
+                        reused_count += 1
+                    else:
+                        with open(source_image, 'rb') as src, zipf.open(zinfo, 'w') as dest:
+                            while True:
+                                data = src.read(chunk_size)
+                                if not data:
+                                    break
+                                dest.write(data)
+                                if buffer.size >= chunk_size:
+                                    yield buffer.pop()
+                    if buffer.size >= chunk_size:
+                        yield buffer.pop()
+        finally:
+            if previous_file is not None:
+                previous_file.close()
+                print(f"♻️ 再利用したZIPエントリ: {reused_count} 件")
+        
+        # セントラルディレクトリ
+        yield buffer.pop()
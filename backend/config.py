@@ -35,11 +35,58 @@ ADMINISTRATOR_CODE = os.environ['ADMINISTRATOR_CODE']
 # OpenAI API キー
 OPENAI_API_KEY = os.environ['OPENAI_API_KEY']
 
+# キャプション生成パイプライン設定（同時実行数・1分あたりのリクエスト上限・最大リトライ回数）
+CAPTION_CONCURRENCY = int(os.environ.get('CAPTION_CONCURRENCY', '8'))
+CAPTION_REQUESTS_PER_MINUTE = int(os.environ.get('CAPTION_REQUESTS_PER_MINUTE', '60'))
+CAPTION_MAX_RETRIES = int(os.environ.get('CAPTION_MAX_RETRIES', '5'))
+
+# アップロード処理のワーカー数（CPU処理用のプロセス数・ブロッキングI/O用のスレッド数）
+UPLOAD_CPU_WORKERS = int(os.environ.get('UPLOAD_CPU_WORKERS', '2'))
+UPLOAD_IO_WORKERS = int(os.environ.get('UPLOAD_IO_WORKERS', '16'))
+
+# クラスタリングジョブのキュー（保存先・サーバー起動時に立ち上げるワーカー数・プロジェクトごとの同時実行数・ハートビートのタイムアウト秒数・最大試行回数）
+JOB_QUEUE_PATH = os.environ.get('JOB_QUEUE_PATH', './job_queue/jobs.sqlite3')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '1'))
+JOB_MAX_RUNNING_PER_PROJECT = int(os.environ.get('JOB_MAX_RUNNING_PER_PROJECT', '1'))
+JOB_HEARTBEAT_TIMEOUT = int(os.environ.get('JOB_HEARTBEAT_TIMEOUT', '120'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+
+# バッチアップロードの進捗管理（完了したバッチを保持する秒数・同時に保持するバッチ数の上限）
+UPLOAD_STATUS_TTL = int(os.environ.get('UPLOAD_STATUS_TTL', '600'))
+UPLOAD_STATUS_MAX_BATCHES = int(os.environ.get('UPLOAD_STATUS_MAX_BATCHES', '100'))
+
 # パス設定
 DEFAULT_IMAGE_PATH = os.environ.get('DEFAULT_IMAGE_PATH', 'images')
 DEFAULT_OUTPUT_PATH = os.environ.get('DEFAULT_OUTPUT_PATH', 'output')
 NEXT_PUBLIC_DEFAULT_IMAGE_PATH = os.environ.get('NEXT_PUBLIC_DEFAULT_IMAGE_PATH', '/images')
 
+# クラスタリング結果をフォルダ出力する際の画像の配置方式（hardlink / symlink / copy、失敗時は順にフォールバック）
+OUTPUT_MATERIALIZE_MODE = os.environ.get('OUTPUT_MATERIALIZE_MODE', 'hardlink')
+
+# 初期クラスタリング後にデバッグ用出力（フォルダ・整形JSON）を後処理として書き出すか（本番ではfalse）
+INIT_CLUSTERING_DEBUG_OUTPUT = os.environ.get('INIT_CLUSTERING_DEBUG_OUTPUT', 'false').lower() in ('1', 'true', 'yes')
+
+# 初期クラスタリング: 対象画像の行を何件読み込むごとに埋め込みベクトルの取得を開始するか
+INIT_CLUSTERING_FETCH_CHUNK = int(os.environ.get('INIT_CLUSTERING_FETCH_CHUNK', '1000'))
+
+# 継続的クラスタリング: 何枚処理するごとにクラスタリング済みの記録をコミットするか
+CONTINUOUS_CLUSTERING_FLUSH_BATCH = int(os.environ.get('CONTINUOUS_CLUSTERING_FLUSH_BATCH', '100'))
+
+# 画像内容ハッシュをキーとしたキャプション・埋め込みキャッシュ（SQLite）の保存先
+CONTENT_CACHE_PATH = os.environ.get('CONTENT_CACHE_PATH', './content_cache/content_cache.sqlite3')
+
+# 画像表示用サムネイルの保存先と生成する幅（px、カンマ区切り）
+THUMBNAIL_PATH = os.environ.get('THUMBNAIL_PATH', 'thumbnails')
+THUMBNAIL_WIDTHS = tuple(int(w) for w in os.environ.get('THUMBNAIL_WIDTHS', '200,600').split(','))
+
+# 分類結果ZIPのキャッシュ保存先と上限サイズ（バイト）
+EXPORT_CACHE_PATH = os.environ.get('EXPORT_CACHE_PATH', 'export_cache')
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_BYTES', str(5 * 1024 ** 3)))
+
+# プロジェクト・ユーザー・メンバーシップ情報のプロセス内キャッシュの有効期間（秒）と保持件数
+METADATA_CACHE_TTL = int(os.environ.get('METADATA_CACHE_TTL', '300'))
+METADATA_CACHE_MAX_ENTRIES = int(os.environ.get('METADATA_CACHE_MAX_ENTRIES', '10000'))
+
 # クラスタリングステータス定義
 class INIT_CLUSTERING_STATUS(IntEnum):
     NOT_EXECUTED = 0
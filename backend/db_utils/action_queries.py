@@ -1,14 +1,19 @@
 from typing import Tuple, Any
-from db_utils.commons import execute_query
+from db_utils.commons import execute_query, execute_queries_in_transaction, execute_streaming_query
+
+# 継続的クラスタリングの状態更新で、UPDATE 1文あたりに含める image_id の数
+USER_IMAGE_STATE_UPDATE_CHUNK = 1000
+# LIMIT なしで OFFSET を指定するための上限値（MySQL の LIMIT の最大値）
+MYSQL_MAX_LIMIT = 18446744073709551615
 
 
 def get_membership_init_and_mongo(session, user_id: int, project_id: int) -> Tuple[Any, Any]:
-    query_text = f"""
+    query_text = """
         SELECT init_clustering_state, mongo_result_id
         FROM project_memberships
-        WHERE user_id = {user_id} AND project_id = {project_id};
+        WHERE user_id = :user_id AND project_id = :project_id;
     """
-    return execute_query(session=session, query_text=query_text)
+    return execute_query(session=session, query_text=query_text, params={"user_id": user_id, "project_id": project_id})
 
 
 def get_membership_mongo_and_init(session, user_id: int, project_id: int) -> Tuple[Any, Any]:
@@ -16,28 +21,44 @@ def get_membership_mongo_and_init(session, user_id: int, project_id: int) -> Tup
     return get_membership_init_and_mongo(session, user_id, project_id)
 
 
+def get_membership_clustering_states(session, user_id: int, project_id: int) -> Tuple[Any, Any]:
+    """クラスタリング状態（init_clustering_state, continuous_clustering_state）のみを返します（キャッシュしない列）。"""
+    query_text = """
+        SELECT init_clustering_state, continuous_clustering_state
+        FROM project_memberships
+        WHERE user_id = :user_id AND project_id = :project_id;
+    """
+    return execute_query(session=session, query_text=query_text, params={"user_id": user_id, "project_id": project_id})
+
+
 def get_membership_and_project_info(session, project_id: int, user_id: int) -> Tuple[Any, Any]:
     # include continuous_clustering_state because callers (e.g. execute_continuous_clustering)
     # expect this column to be present in the result mapping
-    query_text = f"""
+    query_text = """
         SELECT project_memberships.init_clustering_state,
                project_memberships.continuous_clustering_state,
                project_memberships.mongo_result_id,
                projects.original_images_folder_path
         FROM project_memberships
         JOIN projects ON project_memberships.project_id = projects.id
-        WHERE project_memberships.project_id = {project_id} AND project_memberships.user_id = {user_id};
+        WHERE project_memberships.project_id = :project_id AND project_memberships.user_id = :user_id;
     """
-    return execute_query(session=session, query_text=query_text)
+    return execute_query(session=session, query_text=query_text, params={"project_id": project_id, "user_id": user_id})
 
 
-def select_images_for_init(session, project_id: int) -> Tuple[Any, Any]:
-    query_text = f"""
+def select_images_for_init(session, project_id: int, stream: bool = False) -> Tuple[Any, Any]:
+    """
+    クラスタリング対象（キャプション作成済み）画像のIDを取得する
+
+    stream=True の場合はサーバーサイドカーソルで行のイテレータを返す（execute_streaming_query、読み終えるとsessionを閉じる）。
+    """
+    query_text = """
         SELECT clustering_id, chromadb_sentence_id, chromadb_image_id
         FROM images
-        WHERE project_id = {project_id} AND is_created_caption = TRUE;
+        WHERE project_id = :project_id AND is_created_caption = TRUE;
     """
-    return execute_query(session=session, query_text=query_text)
+    execute = execute_streaming_query if stream else execute_query
+    return execute(session, query_text, params={"project_id": project_id})
 
 
 def update_init_state(session, user_id: int, project_id: int, state) -> Tuple[Any, Any]:
@@ -68,7 +89,7 @@ def mark_user_images_clustered_with_executed_count(session, user_id: int, projec
 
 
 def get_unclustered_images(session, project_id: int, user_id: int) -> Tuple[Any, Any]:
-    query_text = f"""
+    query_text = """
         SELECT 
             i.id as image_id,
             i.name as image_name,
@@ -79,38 +100,38 @@ def get_unclustered_images(session, project_id: int, user_id: int) -> Tuple[Any,
             i.created_at
         FROM images i
         LEFT JOIN user_image_clustering_states uics 
-            ON i.id = uics.image_id AND uics.user_id = {user_id}
-        WHERE i.project_id = {project_id} 
+            ON i.id = uics.image_id AND uics.user_id = :user_id
+        WHERE i.project_id = :project_id 
             AND i.is_created_caption = TRUE
             AND (uics.is_clustered = 0 OR uics.is_clustered IS NULL);
     """
-    return execute_query(session=session, query_text=query_text)
+    return execute_query(session=session, query_text=query_text, params={"user_id": user_id, "project_id": project_id})
 
 
 def get_user_info(session, user_id: int) -> Tuple[Any, Any]:
-    query_text = f"SELECT id, name, email FROM users WHERE id = {user_id};"
-    return execute_query(session=session, query_text=query_text)
+    query_text = "SELECT id, name, email FROM users WHERE id = :user_id;"
+    return execute_query(session=session, query_text=query_text, params={"user_id": user_id})
 
 
 def get_executed_clustering_count(session, user_id: int, project_id: int) -> Tuple[Any, Any]:
-    query_text = f"SELECT executed_clustering_count FROM project_memberships WHERE user_id = {user_id} AND project_id = {project_id};"
-    return execute_query(session=session, query_text=query_text)
+    query_text = "SELECT executed_clustering_count FROM project_memberships WHERE user_id = :user_id AND project_id = :project_id;"
+    return execute_query(session=session, query_text=query_text, params={"user_id": user_id, "project_id": project_id})
 
 
 def get_chromadb_image_id_by_clustering_id(session, clustering_id: str, project_id: int) -> Tuple[Any, Any]:
-    query_text = f"""
+    query_text = """
         SELECT chromadb_image_id FROM images
-        WHERE clustering_id = '{clustering_id}' AND project_id = {project_id};
+        WHERE clustering_id = :clustering_id AND project_id = :project_id;
     """
-    return execute_query(session=session, query_text=query_text)
+    return execute_query(session=session, query_text=query_text, params={"clustering_id": clustering_id, "project_id": project_id})
 
 
 def get_chromadb_sentence_id_by_clustering_id(session, clustering_id: str, project_id: int) -> Tuple[Any, Any]:
-    query_text = f"""
+    query_text = """
         SELECT chromadb_sentence_id FROM images
-        WHERE clustering_id = '{clustering_id}' AND project_id = {project_id};
+        WHERE clustering_id = :clustering_id AND project_id = :project_id;
     """
-    return execute_query(session=session, query_text=query_text)
+    return execute_query(session=session, query_text=query_text, params={"clustering_id": clustering_id, "project_id": project_id})
 
 
 def update_user_image_state_for_image(session, user_id: int, image_id: int, new_count: int) -> Tuple[Any, Any]:
@@ -133,17 +154,56 @@ def update_project_executed_clustering_count(session, user_id: int, project_id:
     return execute_query(session=session, query_text=query_text)
 
 
+def commit_continuous_clustering_states(session, user_id: int, project_id: int, image_ids: list, new_count: int, update_executed_count: bool = True, update_membership: bool = True, chunk_size: int = USER_IMAGE_STATE_UPDATE_CHUNK) -> Tuple[Any, Any]:
+    """継続的クラスタリング1回分の状態更新を1つのトランザクションで反映します。
+
+    - image_ids の user_image_clustering_states を chunk_size 件ごとの UPDATE ... IN でクラスタリング済みにする
+    - project_memberships の executed_clustering_count を new_count に更新する（update_executed_count=False の場合は更新しない）
+    - 未クラスタリング画像が残っていれば continuous_clustering_state を 2（実行可能）、なければ 0（実行不可能）にする
+    - update_membership=False の場合は project_memberships を更新しない（実行途中の中間コミット用）
+    Returns (更新件数, None)。失敗時は (None, None)。
+    """
+    query_texts = [
+        f"""
+        UPDATE user_image_clustering_states
+        SET is_clustered = 1,
+            executed_clustering_count = {new_count},
+            clustered_at = CURRENT_TIMESTAMP(6)
+        WHERE user_id = {user_id} AND image_id IN ({", ".join(str(image_id) for image_id in image_ids[offset:offset + chunk_size])});
+        """
+        for offset in range(0, len(image_ids), chunk_size)
+    ]
+    if not update_membership:
+        return execute_queries_in_transaction(session=session, query_texts=query_texts)
+    executed_count_clause = f"executed_clustering_count = {new_count}," if update_executed_count else ""
+    query_texts.append(f"""
+        UPDATE project_memberships
+        SET {executed_count_clause}
+            continuous_clustering_state = CASE WHEN EXISTS (
+                SELECT 1
+                FROM images i
+                LEFT JOIN user_image_clustering_states uics
+                    ON i.id = uics.image_id AND uics.user_id = {user_id}
+                WHERE i.project_id = {project_id}
+                    AND i.is_created_caption = TRUE
+                    AND (uics.is_clustered = 0 OR uics.is_clustered IS NULL)
+            ) THEN 2 ELSE 0 END
+        WHERE user_id = {user_id} AND project_id = {project_id};
+    """)
+    return execute_queries_in_transaction(session=session, query_texts=query_texts)
+
+
 def get_unclustered_count_for_project(session, user_id: int, project_id: int) -> Tuple[Any, Any]:
-    query_text = f"""
+    query_text = """
         SELECT COUNT(*) as unclustered_count
         FROM images i
         LEFT JOIN user_image_clustering_states uics 
-            ON i.id = uics.image_id AND uics.user_id = {user_id}
-        WHERE i.project_id = {project_id} 
+            ON i.id = uics.image_id AND uics.user_id = :user_id
+        WHERE i.project_id = :project_id 
             AND i.is_created_caption = TRUE
             AND (uics.is_clustered = 0 OR uics.is_clustered IS NULL);
     """
-    return execute_query(session=session, query_text=query_text)
+    return execute_query(session=session, query_text=query_text, params={"user_id": user_id, "project_id": project_id})
 
 
 def update_continuous_state(session, user_id: int, project_id: int, new_state: int) -> Tuple[Any, Any]:
@@ -156,7 +216,7 @@ def update_continuous_state(session, user_id: int, project_id: int, new_state: i
 
 
 def get_project_info_and_mongo(session, project_id: int, user_id: int) -> Tuple[Any, Any]:
-    query_text = f"""
+    query_text = """
         SELECT 
             p.name as project_name,
             p.original_images_folder_path,
@@ -164,48 +224,48 @@ def get_project_info_and_mongo(session, project_id: int, user_id: int) -> Tuple[
             pm.init_clustering_state
         FROM projects p
         JOIN project_memberships pm ON p.id = pm.project_id
-        WHERE p.id = {project_id} AND pm.user_id = {user_id};
+        WHERE p.id = :project_id AND pm.user_id = :user_id;
     """
-    return execute_query(session=session, query_text=query_text)
+    return execute_query(session=session, query_text=query_text, params={"project_id": project_id, "user_id": user_id})
 
 
 def get_project_name(session, project_id: int) -> Tuple[Any, Any]:
     """Return project name for given project id."""
-    query_text = f"""
-        SELECT name FROM projects WHERE id = {project_id}
+    query_text = """
+        SELECT name FROM projects WHERE id = :project_id
     """
-    return execute_query(session=session, query_text=query_text)
+    return execute_query(session=session, query_text=query_text, params={"project_id": project_id})
 
 
 def get_image_name_by_id(session, image_id: int) -> Tuple[Any, Any]:
     """Return image name (path) from images table by id."""
-    query_text = f"""
-        SELECT name FROM images WHERE id = {image_id};
+    query_text = """
+        SELECT name FROM images WHERE id = :image_id;
     """
-    return execute_query(session=session, query_text=query_text)
+    return execute_query(session=session, query_text=query_text, params={"image_id": image_id})
 
 
 def membership_exists(session, project_id: int, user_id: int) -> Tuple[Any, Any]:
-    query_text = f"SELECT COUNT(*) as cnt FROM project_memberships WHERE project_id = {project_id} AND user_id = {user_id}"
-    return execute_query(session=session, query_text=query_text)
+    query_text = "SELECT COUNT(*) as cnt FROM project_memberships WHERE project_id = :project_id AND user_id = :user_id"
+    return execute_query(session=session, query_text=query_text, params={"project_id": project_id, "user_id": user_id})
 
 
 def get_user_clustering_states_by_clustering_id(session, user_id: int, project_id: int) -> Tuple[Any, Any]:
     """
     ユーザーの画像ごとのクラスタリング状態を取得（clustering_idベース）
     """
-    query_text = f"""
+    query_text = """
         SELECT
             i.clustering_id,
             uics.executed_clustering_count
         FROM user_image_clustering_states uics
         JOIN images i ON uics.image_id = i.id
-        WHERE uics.user_id = {user_id}
-          AND uics.project_id = {project_id}
-          AND i.project_id = {project_id}
+        WHERE uics.user_id = :user_id
+          AND uics.project_id = :project_id
+          AND i.project_id = :project_id
           AND i.is_created_caption = TRUE
     """
-    return execute_query(session=session, query_text=query_text)
+    return execute_query(session=session, query_text=query_text, params={"user_id": user_id, "project_id": project_id})
 
 
 def copy_clustering_states_by_clustering_id(session, source_user_id: int, target_user_id: int, project_id: int) -> Tuple[Any, Any]:
@@ -235,16 +295,51 @@ def copy_clustering_states_by_clustering_id(session, source_user_id: int, target
     return execute_query(session=session, query_text=query_text)
 
 
-def get_image_counts_for_clustering_counts(session, user_id: int, project_id: int) -> Tuple[Any, Any]:
+def get_image_counts_for_clustering_counts(session, user_id: int, project_id: int, exec_count: int = None, limit: int = None, offset: int = 0) -> Tuple[Any, Any]:
+    """画像ごとのクラスタリング回数を返します。
+
+    クラスタリング回数の無い（未クラスタリングの）画像は含めません（ページングの件数を get_clustering_count_totals と揃えるため）。
+    exec_count を指定するとその回数の画像のみ、limit・offset を指定すると clustering_id 順で offset から limit 件のみを返します。
+    offset のみの場合は offset 以降をすべて返します（MySQL は LIMIT なしの OFFSET を書けないため上限値を指定する）。
+    """
+    paginate = limit is not None or bool(offset)
+    count_clause = "AND uics.executed_clustering_count = :exec_count" if exec_count is not None else ""
+    limit_clause = "ORDER BY i.clustering_id LIMIT :limit OFFSET :offset" if paginate else ""
     query_text = f"""
         SELECT
             uics.executed_clustering_count AS exec_count,
             i.clustering_id AS clustering_id
         FROM user_image_clustering_states uics
         JOIN images i ON uics.image_id = i.id
-        WHERE uics.user_id = {user_id}
-          AND uics.project_id = {project_id}
-          AND i.project_id = {project_id}
+        WHERE uics.user_id = :user_id
+          AND uics.project_id = :project_id
+          AND i.project_id = :project_id
           AND i.is_created_caption = TRUE
+          AND uics.executed_clustering_count IS NOT NULL
+          {count_clause}
+        {limit_clause}
     """
-    return execute_query(session=session, query_text=query_text)
+    params = {"user_id": user_id, "project_id": project_id}
+    if exec_count is not None:
+        params["exec_count"] = exec_count
+    if paginate:
+        params.update({"limit": limit if limit is not None else MYSQL_MAX_LIMIT, "offset": offset})
+    return execute_query(session=session, query_text=query_text, params=params)
+
+
+def get_clustering_count_totals(session, user_id: int, project_id: int) -> Tuple[Any, Any]:
+    """クラスタリング回数ごとの画像数を返します（GROUP BY で集計）。"""
+    query_text = """
+        SELECT
+            uics.executed_clustering_count AS exec_count,
+            COUNT(*) AS image_count
+        FROM user_image_clustering_states uics
+        JOIN images i ON uics.image_id = i.id
+        WHERE uics.user_id = :user_id
+          AND uics.project_id = :project_id
+          AND i.project_id = :project_id
+          AND i.is_created_caption = TRUE
+        GROUP BY uics.executed_clustering_count
+        ORDER BY uics.executed_clustering_count
+    """
+    return execute_query(session=session, query_text=query_text, params={"user_id": user_id, "project_id": project_id})
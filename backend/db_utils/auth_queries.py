@@ -1,5 +1,8 @@
 from typing import Tuple, Any
-from db_utils.commons import execute_query
+from db_utils.commons import execute_query, execute_queries_in_transaction
+
+# 複数行INSERTの1文あたりの行数
+USER_IMAGE_STATE_INSERT_CHUNK = 1000
 
 
 def query_user_login(session, name: str, email: str, password: str) -> Tuple[Any, Any]:
@@ -38,14 +41,39 @@ def insert_user_image_state(session, user_id: int, image_id: int, project_id: in
     return execute_query(session=session, query_text=query_text)
 
 
-def bulk_insert_user_image_states(session, user_ids: list, image_id: int, project_id: int, is_clustered: int = 0) -> Tuple[Any, Any]:
-    """user_image_clustering_states に複数レコードを一括挿入します。"""
-    if not user_ids:
-        return None, None
-    
-    values = ", ".join([f"({user_id}, {image_id}, {project_id}, {is_clustered})" for user_id in user_ids])
+def insert_user_image_states_for_project(session, user_id: int, project_id: int, is_clustered: int = 0) -> Tuple[Any, Any]:
+    """プロジェクト内の全画像について、ユーザーの user_image_clustering_states を1文（INSERT ... SELECT）で作成します。
+
+    既にレコードが存在する画像はスキップします。result.rowcount が作成件数です。
+    """
     query_text = f"""
         INSERT INTO user_image_clustering_states(user_id, image_id, project_id, is_clustered)
-        VALUES {values};
+        SELECT {user_id}, i.id, i.project_id, {is_clustered}
+        FROM images i
+        WHERE i.project_id = {project_id}
+          AND NOT EXISTS (
+              SELECT 1 FROM user_image_clustering_states s
+              WHERE s.user_id = {user_id} AND s.image_id = i.id
+          );
     """
     return execute_query(session=session, query_text=query_text)
+
+
+def bulk_insert_user_image_states(session, user_ids: list, image_ids: list, project_id: int, is_clustered: int = 0, chunk_size: int = USER_IMAGE_STATE_INSERT_CHUNK) -> Tuple[Any, Any]:
+    """user_image_clustering_states に user_ids × image_ids のレコードを一括挿入します。
+
+    chunk_size 行ごとの複数行INSERTに分割し、1つのトランザクションで実行します。
+    Returns (作成件数, None)。失敗時は (None, None)。
+    """
+    if not user_ids or not image_ids:
+        return None, None
+    
+    values = [f"({user_id}, {image_id}, {project_id}, {is_clustered})" for image_id in image_ids for user_id in user_ids]
+    query_texts = [
+        f"""
+        INSERT INTO user_image_clustering_states(user_id, image_id, project_id, is_clustered)
+        VALUES {", ".join(values[offset:offset + chunk_size])};
+        """
+        for offset in range(0, len(values), chunk_size)
+    ]
+    return execute_queries_in_transaction(session=session, query_texts=query_texts)
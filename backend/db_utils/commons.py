@@ -1,31 +1,67 @@
 import datetime
+from functools import lru_cache
 from sqlalchemy import create_engine,text
 from sqlalchemy.orm import sessionmaker
 
 import sys
+from threading import Lock
 sys.path.append('../')
 from config import MYSQL_ROOT_PASSWORD,MYSQL_DATABASE,MYSQL_HOST,DATABASE_PORT_IN_CONTAINER
 
 CONNECT_STRING = f"mysql://root:{MYSQL_ROOT_PASSWORD}@{MYSQL_HOST}:{DATABASE_PORT_IN_CONTAINER}/{MYSQL_DATABASE}?charset=utf8mb4"
 
+# プロセス内で共有するエンジン（コネクションプール）。セッションごとに作ると接続が再利用されない
+_engine = None
+_session_factory = None
+_engine_lock = Lock()
+
+def get_engine():
+    global _engine, _session_factory
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(CONNECT_STRING,pool_size=10,max_overflow=20, pool_timeout=30,pool_recycle=1800)
+                _session_factory = sessionmaker(bind=_engine)
+    return _engine
+
 #データベースに接続するためのセッションを作成する
 def create_connect_session():
     try: 
-        engine = create_engine(CONNECT_STRING,pool_size=10,max_overflow=20, pool_timeout=30,pool_recycle=1800)
-        Session = sessionmaker(bind=engine)
-        session = Session()
+        get_engine()
+        session = _session_factory()
         return session
     except Exception as e:
         return None
 
+# 読み取り（コミット不要）として扱う文の先頭キーワード
+_READ_KEYWORDS = {"SELECT", "SHOW", "WITH", "EXPLAIN", "DESCRIBE"}
+
+# SQL文字列ごとに作成済みのステートメントを保持する件数
+STATEMENT_CACHE_SIZE = 512
+
+# サーバーサイドカーソルで一度に取得する行数
+STREAM_FETCH_SIZE = 1000
+
+#SQL文字列からステートメントを作成し、読み取りか・INSERTかを判定する（同じ文字列は再利用する）
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def prepare_statement(query_text):
+    words = query_text.lstrip().lstrip("(").split(None, 1)
+    keyword = words[0].upper() if words else ""
+    return text(query_text), keyword in _READ_KEYWORDS, keyword == "INSERT"
+
 #SQL文字列からクエリを実行する
-def execute_query(session, query_text):
+#読み取りは結果をすべて取得してから返し、コミットしない。INSERTのみ作成されたIDを返す（それ以外はNone）
+#値はquery_textに埋め込まずparamsで渡すと、同じステートメントが再利用される
+def execute_query(session, query_text, params=None):
     try:
-        query = text(query_text)
-        result = session.execute(query)
-        session.commit()
+        query, is_read, is_insert = prepare_statement(query_text)
+        if is_read:
+            result = session.execute(query, params or {}, execution_options={"prebuffer_rows": True})
+            return result, None
 
-        created_id = session.execute(text("SELECT LAST_INSERT_ID()")).scalar()
+        result = session.execute(query, params or {})
+        created_id = result.lastrowid if is_insert else None
+        session.commit()
         return result, created_id
     except Exception as e:
         print(e)
@@ -33,4 +69,91 @@ def execute_query(session, query_text):
         return None, None
     finally:
         session.close()
-        
\ No newline at end of file
+
+#読み取りクエリをサーバーサイドカーソルで実行し、行を辞書で1件ずつ返すイテレータを返す（全件をメモリに載せない）
+#クエリの実行に失敗した場合は (None, None)。セッションはイテレータを最後まで読むか閉じた時点で閉じる
+def execute_streaming_query(session, query_text, params=None, fetch_size=STREAM_FETCH_SIZE):
+    try:
+        query, _, _ = prepare_statement(query_text)
+        result = session.execute(query, params or {}, execution_options={"stream_results": True, "yield_per": fetch_size})
+    except Exception as e:
+        print(e)
+        session.rollback()
+        session.close()
+        return None, None
+
+    def iter_rows():
+        try:
+            for row in result.mappings():
+                yield dict(row)
+        finally:
+            result.close()
+            session.close()
+
+    return iter_rows(), None
+
+#キーセットページネーション用の条件・並び順・件数制限とパラメータを作成する
+#key_columns は並び順のキーとなる列（組み合わせで一意になるもの）、cursor は前のページの最後の行のキーの値
+#cursor・limit が両方Noneの場合は (None, None, {}) を返す（呼び出し側の既定の並び順で全件取得する）
+def build_keyset_clauses(key_columns, cursor=None, limit=None):
+    if cursor is None and limit is None:
+        return None, None, {}
+
+    params = {}
+    condition = "TRUE"
+    if cursor is not None:
+        # (c0 > v0) OR (c0 = v0 AND c1 > v1) OR ...
+        alternatives = []
+        for i, column in enumerate(key_columns):
+            terms = [f"{key_columns[j]} = :cursor_{j}" for j in range(i)] + [f"{column} > :cursor_{i}"]
+            alternatives.append("(" + " AND ".join(terms) + ")")
+        condition = "(" + " OR ".join(alternatives) + ")"
+        params.update({f"cursor_{i}": value for i, value in enumerate(cursor)})
+
+    order_clause = "ORDER BY " + ", ".join(key_columns)
+    if limit is not None:
+        order_clause += " LIMIT :limit"
+        params["limit"] = limit
+    return condition, order_clause, params
+
+#カーソル文字列（キーの値を":"で連結したもの）を値のタプルに変換する（不正な場合はValueError）
+def decode_cursor(cursor, size):
+    values = tuple(int(value) for value in cursor.split(":"))
+    if len(values) != size:
+        raise ValueError(f"cursor must have {size} values")
+    return values
+
+#行のキーの値からカーソル文字列を作成する
+def encode_cursor(row, key_names):
+    return ":".join(str(row[name]) for name in key_names)
+
+#パラメータ付きのSELECT文を実行し、行を辞書のリストで返す（読み取りのみのためコミットは行わない）
+def execute_read_query(session, query, params=None):
+    try:
+        if isinstance(query, str):
+            query, _, _ = prepare_statement(query)
+        result = session.execute(query, params or {})
+        rows = [dict(row) for row in result.mappings().all()]
+        return rows, None
+    except Exception as e:
+        print(e)
+        session.rollback()
+        return None, None
+    finally:
+        session.close()
+
+#複数のSQL文字列を1つのトランザクションで実行する（途中で失敗した場合はすべてロールバック）
+def execute_queries_in_transaction(session, query_texts):
+    try:
+        affected_rows = 0
+        for query_text in query_texts:
+            result = session.execute(text(query_text))
+            affected_rows += max(result.rowcount, 0)
+        session.commit()
+        return affected_rows, None
+    except Exception as e:
+        print(e)
+        session.rollback()
+        return None, None
+    finally:
+        session.close()
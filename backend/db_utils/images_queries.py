@@ -1,10 +1,30 @@
-from typing import Tuple, Any
-from db_utils.commons import execute_query
+from typing import Tuple, Any, Iterator
+from sqlalchemy import bindparam, text
+from db_utils.commons import execute_query, execute_read_query, execute_streaming_query, build_keyset_clauses
+
+# キャプション一括取得のINリスト1回あたりの件数
+CAPTION_QUERY_CHUNK = 1000
+
+# 画像一覧のキーセットページネーションで使う並び順のキー
+IMAGE_LIST_KEYS = ("id",)
+
+_select_images_for_delete_query = text(
+    "SELECT i.id, i.project_id, i.name, p.original_images_folder_path, i.clustering_id, i.chromadb_sentence_id, i.chromadb_image_id "
+    "FROM images i JOIN projects p ON p.id = i.project_id WHERE i.id IN :image_ids"
+).bindparams(bindparam("image_ids", expanding=True))
+
+_select_member_mongo_result_ids_query = text(
+    "SELECT user_id, project_id, mongo_result_id FROM project_memberships WHERE project_id IN :project_ids"
+).bindparams(bindparam("project_ids", expanding=True))
+
+_select_captions_query = text(
+    "SELECT clustering_id, caption FROM images WHERE clustering_id IN :clustering_ids"
+).bindparams(bindparam("clustering_ids", expanding=True))
 
 
 def get_project_original_images_folder_path(session, project_id: int) -> Tuple[Any, Any]:
-    query_text = f"SELECT original_images_folder_path FROM projects WHERE id = {project_id};"
-    return execute_query(session, query_text)
+    query_text = "SELECT original_images_folder_path FROM projects WHERE id = :project_id;"
+    return execute_query(session, query_text, params={"project_id": project_id})
 
 
 def check_image_exists(session, name: str, project_id: int) -> Tuple[Any, Any]:
@@ -24,19 +44,40 @@ def insert_image(session, name: str, is_created_for_sql: str, caption_sql_value:
 
 
 def select_image_id_by_clustering_id(session, clustering_id: str) -> Tuple[Any, Any]:
-    query_text = f"SELECT id FROM images WHERE clustering_id = '{clustering_id}';"
-    return execute_query(session, query_text)
+    query_text = "SELECT id FROM images WHERE clustering_id = :clustering_id;"
+    return execute_query(session, query_text, params={"clustering_id": clustering_id})
 
 
 def select_caption_by_clustering_id(session, clustering_id: str) -> Tuple[Any, Any]:
     """Return caption for the image with the given clustering_id."""
-    query_text = f"SELECT caption FROM images WHERE clustering_id = '{clustering_id}';"
-    return execute_query(session, query_text)
+    query_text = "SELECT caption FROM images WHERE clustering_id = :clustering_id;"
+    return execute_query(session, query_text, params={"clustering_id": clustering_id})
+
+
+def iter_captions_by_clustering_ids(session, clustering_ids: list, chunk_size: int = CAPTION_QUERY_CHUNK) -> Iterator[dict]:
+    """Yield {clustering_id: caption} per chunk, in the order of clustering_ids.
+
+    Each chunk is fetched with one parameterised IN query. Ids that are missing
+    (or whose chunk failed) map to None.
+    """
+    for offset in range(0, len(clustering_ids), chunk_size):
+        chunk = clustering_ids[offset:offset + chunk_size]
+        rows, _ = execute_read_query(session, _select_captions_query, {"clustering_ids": chunk})
+        found = {row["clustering_id"]: row["caption"] for row in rows or []}
+        yield {cid: found.get(cid) for cid in chunk}
+
+
+def select_captions_by_clustering_ids(session, clustering_ids: list, chunk_size: int = CAPTION_QUERY_CHUNK) -> dict:
+    """Return {clustering_id: caption} for all clustering_ids using chunked IN queries."""
+    captions = {}
+    for chunk in iter_captions_by_clustering_ids(session, clustering_ids, chunk_size):
+        captions.update(chunk)
+    return captions
 
 
 def select_project_members(session, project_id: int) -> Tuple[Any, Any]:
-    query_text = f"SELECT user_id FROM project_memberships WHERE project_id = {project_id};"
-    return execute_query(session, query_text)
+    query_text = "SELECT user_id FROM project_memberships WHERE project_id = :project_id;"
+    return execute_query(session, query_text, params={"project_id": project_id})
 
 
 def update_project_members_continuous_state(session, project_id: int) -> Tuple[Any, Any]:
@@ -50,9 +91,23 @@ def update_project_members_continuous_state(session, project_id: int) -> Tuple[A
     return execute_query(session, query_text)
 
 
-def get_images_by_project(session, project_id: int) -> Tuple[Any, Any]:
-    query_text = f"SELECT id, name, folder_name, is_created_caption, caption ,project_id, uploaded_user_id, created_at FROM images WHERE project_id = {project_id};"
-    return execute_query(session, query_text)
+def get_images_by_project(session, project_id: int, cursor: tuple = None, limit: int = None, stream: bool = False) -> Tuple[Any, Any]:
+    """
+    プロジェクトの画像一覧を取得する
+
+    cursor・limit を指定した場合は id 順のキーセットページネーション、
+    stream=True の場合はサーバーサイドカーソルで行のイテレータを返す（execute_streaming_query）。
+    """
+    condition, order_clause, params = build_keyset_clauses(IMAGE_LIST_KEYS, cursor, limit)
+    paging_clause = f"AND {condition} {order_clause}" if condition else ""
+    query_text = f"""
+        SELECT id, name, folder_name, is_created_caption, caption ,project_id, uploaded_user_id, created_at
+        FROM images
+        WHERE project_id = :project_id {paging_clause};
+    """
+    params["project_id"] = project_id
+    execute = execute_streaming_query if stream else execute_query
+    return execute(session, query_text, params=params)
 
 
 def get_folder_names_by_clustering_ids(session, clustering_ids: list) -> dict:
@@ -81,3 +136,19 @@ def get_folder_names_by_clustering_ids(session, clustering_ids: list) -> dict:
 def delete_image(session, image_id: str) -> Tuple[Any, Any]:
     query_text = f"DELETE FROM images WHERE id = '{image_id}';"
     return execute_query(session, query_text)
+
+
+def select_images_for_delete(session, image_ids: list) -> Tuple[Any, Any]:
+    """Return (rows, None) with the ids and file locations needed to clean up Chroma, Mongo and thumbnails for image_ids."""
+    return execute_read_query(session, _select_images_for_delete_query, {"image_ids": list(image_ids)})
+
+
+def select_member_mongo_result_ids(session, project_ids: list) -> Tuple[Any, Any]:
+    """Return (rows, None) with every member's mongo_result_id for project_ids."""
+    return execute_read_query(session, _select_member_mongo_result_ids_query, {"project_ids": list(project_ids)})
+
+
+def delete_images(session, image_ids: list) -> Tuple[Any, Any]:
+    """Delete all image_ids with one statement (user_image_clustering_states cascade)."""
+    query_text = f"DELETE FROM images WHERE id IN ({', '.join(str(int(image_id)) for image_id in image_ids)});"
+    return execute_query(session, query_text)
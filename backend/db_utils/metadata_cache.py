@@ -0,0 +1,204 @@
+"""
+プロジェクト・ユーザー・メンバーシップ情報のread-throughキャッシュ
+
+プロジェクト名や画像フォルダのパス、ユーザー名、メンバーシップの mongo_result_id はほとんど変更されないため、
+プロセス内に METADATA_CACHE_TTL 秒保持して、エンドポイントごとのDB問い合わせを省略する。
+
+- 保持件数は METADATA_CACHE_MAX_ENTRIES 件までとし、超えた場合は最も長く使われていないものから破棄する（LRU）
+- 見つからなかった結果（None）はキャッシュしない。クエリが失敗した場合は MetadataLookupError を送出する
+  （呼び出し側で「存在しない」と「取得できなかった」を区別できるようにする）
+- 変更する側（projects / project_memberships / auth / users）で invalidate_* を呼び出して破棄する。
+  プロセス間では共有しないため、他のワーカーでの変更はTTLが切れるまで反映されない
+- 頻繁に変化するクラスタリング状態（init_clustering_state など）はキャッシュしない
+"""
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from config import METADATA_CACHE_TTL, METADATA_CACHE_MAX_ENTRIES
+from db_utils import action_queries, projects_queries
+
+
+class MetadataLookupError(RuntimeError):
+    """メタデータの取得クエリが失敗した"""
+
+
+class MetadataCache:
+    """
+    名前空間ごとのキーと値をTTL付きのLRUで保持する
+    """
+
+    NAMESPACES = ("project", "user", "membership")
+
+    def __init__(self, ttl: int = METADATA_CACHE_TTL, max_entries: int = METADATA_CACHE_MAX_ENTRIES):
+        self._ttl = ttl
+        self._max_entries = max(1, max_entries)
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._hits = {namespace: 0 for namespace in self.NAMESPACES}
+        self._misses = {namespace: 0 for namespace in self.NAMESPACES}
+        self._invalidations = {namespace: 0 for namespace in self.NAMESPACES}
+        self._evicted_count = 0
+
+    def get_or_load(self, namespace: str, key, loader):
+        """
+        キャッシュから値を返す。無い（期限切れを含む）場合は loader() の結果を保持して返す
+
+        Args:
+            namespace: 名前空間（NAMESPACES のいずれか）
+            key: 名前空間内のキー
+            loader: 値を取得する関数（見つからない場合はNoneを返す。送出した例外はそのまま呼び出し側に伝わる）
+
+        Returns:
+            キャッシュまたは loader() の値
+        """
+        cache_key = (namespace, key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(cache_key)
+                self._hits[namespace] += 1
+                return entry[1]
+            self._misses[namespace] += 1
+
+        # DB問い合わせ中はロックを保持しない（同じキーを同時に読み込んだ場合は後勝ち）
+        value = loader()
+        if value is None:
+            return None
+
+        with self._lock:
+            self._entries[cache_key] = (now + self._ttl, value)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self._evicted_count += 1
+        return value
+
+    def invalidate(self, namespace: str, match):
+        """名前空間内で match(key) が真となるエントリを破棄する"""
+        with self._lock:
+            targets = [cache_key for cache_key in self._entries if cache_key[0] == namespace and match(cache_key[1])]
+            for cache_key in targets:
+                del self._entries[cache_key]
+            self._invalidations[namespace] += len(targets)
+
+    def get_stats(self) -> dict:
+        """名前空間ごとのヒット/ミス数とヒット率を返す"""
+        with self._lock:
+            stats = {}
+            for namespace in self.NAMESPACES:
+                hits = self._hits[namespace]
+                misses = self._misses[namespace]
+                total = hits + misses
+                stats[namespace] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": round(hits / total, 4) if total > 0 else 0.0,
+                    "invalidations": self._invalidations[namespace]
+                }
+            stats["entries"] = len(self._entries)
+            stats["evicted_entries"] = self._evicted_count
+            stats["ttl_seconds"] = self._ttl
+            stats["max_entries"] = self._max_entries
+            return stats
+
+
+# モジュールレベルで一度だけ生成
+_metadata_cache = None
+_metadata_cache_lock = Lock()
+
+
+def get_metadata_cache() -> MetadataCache:
+    global _metadata_cache
+    if _metadata_cache is None:
+        with _metadata_cache_lock:
+            if _metadata_cache is None:
+                _metadata_cache = MetadataCache()
+    return _metadata_cache
+
+
+def _first_row(result, description: str) -> dict | None:
+    """クエリ結果の先頭行をdictで返す（行が無い場合はNone、クエリが失敗した場合は MetadataLookupError）"""
+    if result is None:
+        print(f"⚠️ {description} の取得に失敗しました")
+        raise MetadataLookupError(f"failed to query {description}")
+    row = result.mappings().first()
+    return dict(row) if row is not None else None
+
+
+def get_project_metadata(session, project_id: int) -> dict | None:
+    """
+    プロジェクト情報（id, name, description, original_images_folder_path, owner_id）を返す
+
+    Returns:
+        dict | None: プロジェクトが存在しない場合はNone
+
+    Raises:
+        MetadataLookupError: クエリが失敗した場合
+    """
+    def load():
+        result, _ = projects_queries.get_project(session, project_id)
+        row = _first_row(result, "projects")
+        if row is None:
+            return None
+        return {key: row[key] for key in ("id", "name", "description", "original_images_folder_path", "owner_id")}
+
+    return get_metadata_cache().get_or_load("project", project_id, load)
+
+
+def get_user_metadata(session, user_id: int) -> dict | None:
+    """
+    ユーザー情報（id, name, email）を返す
+
+    Returns:
+        dict | None: ユーザーが存在しない場合はNone
+
+    Raises:
+        MetadataLookupError: クエリが失敗した場合
+    """
+    def load():
+        result, _ = action_queries.get_user_info(session, user_id)
+        return _first_row(result, "users")
+
+    return get_metadata_cache().get_or_load("user", user_id, load)
+
+
+def get_membership_metadata(session, project_id: int, user_id: int) -> dict | None:
+    """
+    メンバーシップ情報（mongo_result_id）を返す
+
+    Returns:
+        dict | None: ユーザーがプロジェクトに参加していない場合はNone
+
+    Raises:
+        MetadataLookupError: クエリが失敗した場合
+    """
+    def load():
+        result, _ = action_queries.get_membership_init_and_mongo(session, user_id, project_id)
+        row = _first_row(result, "project_memberships")
+        if row is None:
+            return None
+        return {"mongo_result_id": row["mongo_result_id"]}
+
+    return get_metadata_cache().get_or_load("membership", (project_id, user_id), load)
+
+
+def invalidate_project(project_id: int):
+    """プロジェクトとそのメンバーシップのキャッシュを破棄する（プロジェクトの変更・削除時）"""
+    cache = get_metadata_cache()
+    cache.invalidate("project", lambda key: key == project_id)
+    cache.invalidate("membership", lambda key: key[0] == project_id)
+
+
+def invalidate_user(user_id: int):
+    """ユーザーとそのメンバーシップのキャッシュを破棄する（ユーザーの変更・削除時）"""
+    cache = get_metadata_cache()
+    cache.invalidate("user", lambda key: key == user_id)
+    cache.invalidate("membership", lambda key: key[1] == user_id)
+
+
+def invalidate_membership(project_id: int, user_id: int):
+    """メンバーシップのキャッシュを破棄する（参加・メンバーシップの作成時）"""
+    get_metadata_cache().invalidate("membership", lambda key: key == (project_id, user_id))
@@ -1,4 +1,4 @@
-from typing import Union
+from typing import List, Union
 from fastapi import File, UploadFile
 from pydantic import BaseModel
 
@@ -40,6 +40,9 @@ class JoinUser(BaseModel):
     project_id:int
     project_password:str
 
+class DeleteImages(BaseModel):
+    image_ids: List[int]
+
 class UserImageClusteringState(BaseModel):
     user_id: int
     image_id: int
@@ -1,20 +1,34 @@
 from typing import Tuple, Any, Optional
-from db_utils.commons import execute_query
+from db_utils.commons import execute_query, execute_streaming_query, build_keyset_clauses
 
+# メンバーシップ一覧のキーセットページネーションで使う並び順のキー（主キー）
+MEMBERSHIP_LIST_KEYS = ("user_id", "project_id")
 
-def get_memberships_by_project(session, project_id: int) -> Tuple[Any, Any]:
-    query_text = f"SELECT user_id, project_id, init_clustering_state, continuous_clustering_state, mongo_result_id, DATE_FORMAT(created_at, '%Y-%m-%dT%H:%i:%sZ') as created_at, DATE_FORMAT(updated_at, '%Y-%m-%dT%H:%i:%sZ') as updated_at FROM project_memberships WHERE project_id='{project_id}';"
-    return execute_query(session=session, query_text=query_text)
 
+def get_memberships_by_project(session, project_id: int, cursor: tuple = None, limit: int = None, stream: bool = False) -> Tuple[Any, Any]:
+    condition, order_clause, params = build_keyset_clauses(MEMBERSHIP_LIST_KEYS, cursor, limit)
+    paging_clause = f"AND {condition} {order_clause}" if condition else ""
+    query_text = f"SELECT user_id, project_id, init_clustering_state, continuous_clustering_state, mongo_result_id, DATE_FORMAT(created_at, '%Y-%m-%dT%H:%i:%sZ') as created_at, DATE_FORMAT(updated_at, '%Y-%m-%dT%H:%i:%sZ') as updated_at FROM project_memberships WHERE project_id=:project_id {paging_clause};"
+    params["project_id"] = project_id
+    execute = execute_streaming_query if stream else execute_query
+    return execute(session=session, query_text=query_text, params=params)
 
-def get_memberships_by_user(session, user_id: int) -> Tuple[Any, Any]:
-    query_text = f"SELECT user_id, project_id, init_clustering_state, continuous_clustering_state, mongo_result_id, DATE_FORMAT(created_at, '%Y-%m-%dT%H:%i:%sZ') as created_at, DATE_FORMAT(updated_at, '%Y-%m-%dT%H:%i:%sZ') as updated_at FROM project_memberships WHERE user_id='{user_id}';"
-    return execute_query(session=session, query_text=query_text)
 
+def get_memberships_by_user(session, user_id: int, cursor: tuple = None, limit: int = None, stream: bool = False) -> Tuple[Any, Any]:
+    condition, order_clause, params = build_keyset_clauses(MEMBERSHIP_LIST_KEYS, cursor, limit)
+    paging_clause = f"AND {condition} {order_clause}" if condition else ""
+    query_text = f"SELECT user_id, project_id, init_clustering_state, continuous_clustering_state, mongo_result_id, DATE_FORMAT(created_at, '%Y-%m-%dT%H:%i:%sZ') as created_at, DATE_FORMAT(updated_at, '%Y-%m-%dT%H:%i:%sZ') as updated_at FROM project_memberships WHERE user_id=:user_id {paging_clause};"
+    params["user_id"] = user_id
+    execute = execute_streaming_query if stream else execute_query
+    return execute(session=session, query_text=query_text, params=params)
 
-def get_all_memberships(session) -> Tuple[Any, Any]:
-    query_text = f"SELECT user_id, project_id, mongo_result_id, init_clustering_state, continuous_clustering_state, DATE_FORMAT(created_at, '%Y-%m-%dT%H:%i:%sZ') as created_at, DATE_FORMAT(updated_at, '%Y-%m-%dT%H:%i:%sZ') as updated_at FROM project_memberships;"
-    return execute_query(session=session, query_text=query_text)
+
+def get_all_memberships(session, cursor: tuple = None, limit: int = None, stream: bool = False) -> Tuple[Any, Any]:
+    condition, order_clause, params = build_keyset_clauses(MEMBERSHIP_LIST_KEYS, cursor, limit)
+    paging_clause = f"WHERE {condition} {order_clause}" if condition else ""
+    query_text = f"SELECT user_id, project_id, mongo_result_id, init_clustering_state, continuous_clustering_state, DATE_FORMAT(created_at, '%Y-%m-%dT%H:%i:%sZ') as created_at, DATE_FORMAT(updated_at, '%Y-%m-%dT%H:%i:%sZ') as updated_at FROM project_memberships {paging_clause};"
+    execute = execute_streaming_query if stream else execute_query
+    return execute(session=session, query_text=query_text, params=params)
 
 
 def insert_project_membership(session, user_id: int, project_id: int, mongo_result_id: str) -> Tuple[Any, Any]:
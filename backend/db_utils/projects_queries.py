@@ -1,16 +1,24 @@
 from typing import Tuple, Any, Optional
-from db_utils.commons import execute_query
+from db_utils.commons import execute_query, execute_streaming_query, build_keyset_clauses
 
+# プロジェクト一覧のキーセットページネーションで使う並び順のキー
+PROJECT_LIST_KEYS = ("projects.id",)
 
-def get_projects(session) -> Tuple[Any, Any]:
-    query_text = """
+
+def get_projects(session, cursor: tuple = None, limit: int = None, stream: bool = False) -> Tuple[Any, Any]:
+    condition, order_clause, params = build_keyset_clauses(PROJECT_LIST_KEYS, cursor, limit)
+    paging_clause = f"WHERE {condition} {order_clause}" if condition else ""
+    query_text = f"""
         SELECT id, name, description,original_images_folder_path, owner_id
-        FROM projects;
+        FROM projects {paging_clause};
     """
-    return execute_query(session=session, query_text=query_text)
+    execute = execute_streaming_query if stream else execute_query
+    return execute(session=session, query_text=query_text, params=params)
 
 
-def get_projects_for_user(session, user_id: int) -> Tuple[Any, Any]:
+def get_projects_for_user(session, user_id: int, cursor: tuple = None, limit: int = None, stream: bool = False) -> Tuple[Any, Any]:
+    condition, order_clause, params = build_keyset_clauses(PROJECT_LIST_KEYS, cursor, limit)
+    paging_clause = f"WHERE {condition} {order_clause}" if condition else ""
     query_text = f"""
         SELECT projects.id, projects.name, projects.description, 
                projects.original_images_folder_path, projects.owner_id,
@@ -22,21 +30,24 @@ def get_projects_for_user(session, user_id: int) -> Tuple[Any, Any]:
                CASE WHEN project_memberships.user_id IS NOT NULL THEN true ELSE false END as joined
         FROM projects
         LEFT JOIN project_memberships
-        ON projects.id = project_memberships.project_id AND project_memberships.user_id = {user_id};
+        ON projects.id = project_memberships.project_id AND project_memberships.user_id = :user_id
+        {paging_clause};
     """
-    return execute_query(session=session, query_text=query_text)
+    params["user_id"] = user_id
+    execute = execute_streaming_query if stream else execute_query
+    return execute(session=session, query_text=query_text, params=params)
 
 
 def get_project(session, project_id: int) -> Tuple[Any, Any]:
-    query_text = f"""
+    query_text = """
         SELECT id, name, description,original_images_folder_path, owner_id, created_at, updated_at
-        FROM projects WHERE id = {project_id};
+        FROM projects WHERE id = :project_id;
     """
-    return execute_query(session=session, query_text=query_text)
+    return execute_query(session=session, query_text=query_text, params={"project_id": project_id})
 
 
 def get_project_for_user(session, project_id: int, user_id: int) -> Tuple[Any, Any]:
-    query_text = f"""
+    query_text = """
         SELECT projects.id, projects.name, projects.description, 
            projects.original_images_folder_path, projects.owner_id,
            projects.created_at,
@@ -48,9 +59,9 @@ def get_project_for_user(session, project_id: int, user_id: int) -> Tuple[Any, A
         FROM projects
         LEFT JOIN project_memberships
         ON projects.id = project_memberships.project_id
-        WHERE projects.id = {project_id} AND project_memberships.user_id = {user_id};
+        WHERE projects.id = :project_id AND project_memberships.user_id = :user_id;
     """
-    return execute_query(session=session, query_text=query_text)
+    return execute_query(session=session, query_text=query_text, params={"project_id": project_id, "user_id": user_id})
 
 
 def insert_project(session, name: str, password: str, description: str, original_images_folder_path: str, owner_id: int) -> Tuple[Any, Any]:
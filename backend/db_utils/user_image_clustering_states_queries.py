@@ -1,8 +1,21 @@
 from typing import Tuple, Any
-from db_utils.commons import execute_query
+from db_utils.commons import execute_query, execute_streaming_query, build_keyset_clauses
 
+# クラスタリング状態一覧のキーセットページネーションで使う並び順のキー（主キー）
+USER_IMAGE_STATE_LIST_KEYS = ("uics.user_id", "uics.image_id")
 
-def get_user_image_clustering_states(session, where_clause: str) -> Tuple[Any, Any]:
+
+def get_user_image_clustering_states(session, where_clause: str, cursor: tuple = None, limit: int = None, stream: bool = False) -> Tuple[Any, Any]:
+    """
+    クラスタリング状態の一覧を取得する
+
+    cursor・limit を指定しない場合は created_at の新しい順、指定した場合は (user_id, image_id) 順のキーセットページネーション。
+    """
+    condition, order_clause, params = build_keyset_clauses(USER_IMAGE_STATE_LIST_KEYS, cursor, limit)
+    if condition:
+        where_clause = f"({where_clause}) AND {condition}"
+    else:
+        order_clause = "ORDER BY uics.created_at DESC"
     query_text = f"""
         SELECT 
             uics.user_id,
@@ -17,9 +30,10 @@ def get_user_image_clustering_states(session, where_clause: str) -> Tuple[Any, A
         FROM user_image_clustering_states uics
         JOIN images i ON uics.image_id = i.id
         WHERE {where_clause}
-        ORDER BY uics.created_at DESC;
+        {order_clause};
     """
-    return execute_query(session=session, query_text=query_text)
+    execute = execute_streaming_query if stream else execute_query
+    return execute(session=session, query_text=query_text, params=params)
 
 
 def get_unclustered_count(session, user_id: int, project_id: int) -> Tuple[Any, Any]:
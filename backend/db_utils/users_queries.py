@@ -1,10 +1,16 @@
 from typing import Tuple, Any
-from db_utils.commons import execute_query
+from db_utils.commons import execute_query, execute_streaming_query, build_keyset_clauses
 
+# ユーザー一覧のキーセットページネーションで使う並び順のキー
+USER_LIST_KEYS = ("id",)
 
-def select_all_users(session) -> Tuple[Any, Any]:
-    query_text = "SELECT id, name, email, authority FROM users;"
-    return execute_query(session=session, query_text=query_text)
+
+def select_all_users(session, cursor: tuple = None, limit: int = None, stream: bool = False) -> Tuple[Any, Any]:
+    condition, order_clause, params = build_keyset_clauses(USER_LIST_KEYS, cursor, limit)
+    paging_clause = f"WHERE {condition} {order_clause}" if condition else ""
+    query_text = f"SELECT id, name, email, authority FROM users {paging_clause};"
+    execute = execute_streaming_query if stream else execute_query
+    return execute(session=session, query_text=query_text, params=params)
 
 
 def insert_user(session, name: str, password: str, email: str, authority: int) -> Tuple[Any, Any]:
@@ -1,4 +1,5 @@
 import json
+import time
 from clustering.utils import Utils
 from fastapi import APIRouter, HTTPException, status,Response
 import sys
@@ -11,9 +12,9 @@ from db_utils.auth_queries import (
     query_user_login,
     verify_project_password,
     insert_project_membership,
-    select_images_by_project,
-    insert_user_image_state,
+    insert_user_image_states_for_project,
 )
+from db_utils.metadata_cache import invalidate_membership
 from db_utils.validators import validate_data
 from db_utils.models import CustomResponseModel, LoginUser,JoinUser
 
@@ -97,27 +98,23 @@ def join(project_id:str,join_user:JoinUser):
     result,_ = insert_project_membership(session=connect_session, user_id=join_user.user_id, project_id=project_pass_info['id'], mongo_result_id=mongo_result_id)
     
     if not(result is None):
-        # プロジェクト参加成功時、既存の画像に対してuser_image_clustering_statesレコードを作成
+        invalidate_membership(project_pass_info['id'], join_user.user_id)
+        # プロジェクト参加成功時、既存の画像に対してuser_image_clustering_statesレコードを作成（INSERT ... SELECTの1文で作成）
+        created_count = None
+        elapsed_time = None
         try:
-            # プロジェクト内の既存画像を取得
-            images_result, _ = select_images_by_project(session=connect_session, project_id=join_user.project_id)
-            
-            if images_result:
-                images = images_result.mappings().all()
-                created_count = 0
-                
-                for image in images:
-                    image_id = image["id"]
-                    # user_image_clustering_statesレコードを作成
-                    state_result, _ = insert_user_image_state(session=connect_session, user_id=join_user.user_id, image_id=image_id, project_id=join_user.project_id, is_clustered=0)
-                    if state_result:
-                        created_count += 1
-                
-                print(f"✅ ユーザ{join_user.user_id}に対して{created_count}個の画像クラスタリング状態レコードを作成しました")
+            start_time = time.time()
+            state_result, _ = insert_user_image_states_for_project(session=connect_session, user_id=join_user.user_id, project_id=join_user.project_id, is_clustered=0)
+            elapsed_time = round(time.time() - start_time, 3)
+            if state_result is not None:
+                created_count = state_result.rowcount
+                print(f"✅ ユーザ{join_user.user_id}に対して{created_count}個の画像クラスタリング状態レコードを作成しました ({elapsed_time}秒)")
+            else:
+                print(f"⚠️ user_image_clustering_statesの作成に失敗しました ({elapsed_time}秒)")
         except Exception as e:
             print(f"⚠️ user_image_clustering_states作成エラー: {e}")
             # エラーが発生してもプロジェクト参加自体は成功しているので処理は続行
         
-        return JSONResponse(status_code=status.HTTP_200_OK,content={"message": "succeeded to join", "data":None})
+        return JSONResponse(status_code=status.HTTP_200_OK,content={"message": "succeeded to join", "data":{"created_image_states": created_count, "elapsed_time": elapsed_time}})
     else:
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,content={"message": "failed to join", "data":None})
\ No newline at end of file
@@ -6,12 +6,11 @@ import sys
 import json
 import asyncio
 import time
-from typing import List
-from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from PIL import Image
-from fastapi import APIRouter, Response, UploadFile, File, Form, status, BackgroundTasks
-from fastapi.responses import FileResponse, JSONResponse
+from typing import List
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import APIRouter, Request, Response, UploadFile, File, Form, Query, status, BackgroundTasks
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 
 current_dir = os.path.dirname(__file__)  # = subfolder/
 parent_dir = os.path.abspath(os.path.join(current_dir, ".."))  # = your_project/
@@ -20,33 +19,35 @@ clustering_path = os.path.join(parent_dir, "clustering")
 from clustering.caption_manager import CaptionManager
 from db_utils.commons import create_connect_session, execute_query
 from db_utils.images_queries import (
-    get_project_original_images_folder_path,
     check_image_exists,
     insert_image,
     select_image_id_by_clustering_id,
     select_project_members,
     update_project_members_continuous_state,
     get_images_by_project,
-    delete_image,
-    select_caption_by_clustering_id,
+    select_images_for_delete,
+    select_member_mongo_result_ids,
+    delete_images,
+    iter_captions_by_clustering_ids,
 )
 from db_utils.auth_queries import insert_user_image_state, bulk_insert_user_image_states
+from db_utils.metadata_cache import get_project_metadata
+from routers.listing import listing_response, LISTING_MAX_LIMIT
 from db_utils.validators import validate_data
-from db_utils.models import CustomResponseModel, NewImage
+from db_utils.models import CustomResponseModel, NewImage, DeleteImages
 from pathlib import Path
 from config import DEFAULT_IMAGE_PATH ,OPENAI_API_KEY
 from clustering.caption_manager import CaptionManager
 from clustering.chroma_db_manager import ChromaDBManager
 from clustering.mongo_result_manager import ResultManager
-from clustering.embeddings_manager.image_embeddings_manager import ImageEmbeddingsManager
-from clustering.embeddings_manager.sentence_embeddings_manager import SentenceEmbeddingsManager
 from clustering.utils import Utils
+from clustering.content_cache import get_content_cache
+from clustering.thumbnail_manager import ThumbnailManager
+from clustering.upload_workers import run_cpu, run_io, get_io_pool, convert_to_png, encode_sentences, encode_image
+from clustering.upload_progress import StageTimer, get_upload_tracker
 
 images_endpoint = APIRouter()
 
-# アップロード状況を管理するディクショナリ
-upload_status_cache = {}
-
 # ChromaDB マネージャの遅延初期化シングルトン
 _sentence_name_db_manager = None
 _sentence_usage_db_manager = None
@@ -105,19 +106,95 @@ def validate_image_file(file: UploadFile) -> tuple[bool, str]:
     
     return True, "OK"
 
+def _lookup_caption(content_cache, contents: bytes, png_path: str) -> tuple[str | None, bool, str]:
+    """
+    画像内容のハッシュでキャッシュを確認し、キャプションを取得する
+    （同じ画像なら名前・プロジェクトが違ってもキャプションを再利用）
+
+    Returns:
+        tuple: (画像ハッシュ, キャプション生成成否, キャプション)
+    """
+    image_hash = content_cache.hash_bytes(contents) if content_cache else None
+    cached_caption = content_cache.get_caption(image_hash) if content_cache else None
+    if cached_caption is not None:
+        is_created, created_caption = cached_caption
+    else:
+        is_created, created_caption = Utils.get_exmaple_caption(png_path)
+        if is_created and content_cache:
+            content_cache.put_caption(image_hash, is_created, created_caption)
+    return image_hash, is_created, created_caption
+
+
+def _rollback_upload(save_path: Path, sentence_id: str, image_id: str, managers: tuple):
+    """保存したファイルとベクトルDBに挿入済みのデータを削除する（削除失敗は無視）"""
+    if save_path.exists():
+        os.remove(save_path)
+
+    sentence_name_db_manager, sentence_usage_db_manager, sentence_category_db_manager, image_db_manager = managers
+    try:
+        if sentence_name_db_manager:
+            sentence_name_db_manager.collection.delete(ids=[sentence_id])
+        if sentence_usage_db_manager:
+            sentence_usage_db_manager.collection.delete(ids=[sentence_id])
+        if sentence_category_db_manager:
+            sentence_category_db_manager.collection.delete(ids=[sentence_id])
+        if image_db_manager:
+            image_db_manager.collection.delete(ids=[image_id])
+    except Exception:
+        pass  # 削除失敗は無視（既に存在しない可能性）
+
+
+def _create_member_states(connect_session, project_id: int, mysql_image_ids: list):
+    """
+    プロジェクトメンバー全員 × 画像のuser_image_clustering_statesレコードを一括挿入し、継続的クラスタリングを実行可能にする
+    （バッチアップロードではバッチ内の画像をまとめて1回で呼び出す）
+    """
+    if not mysql_image_ids:
+        return
+
+    members_result, _ = select_project_members(connect_session, project_id)
+    if not members_result:
+        return
+
+    members = members_result.mappings().all()
+    user_ids = [member["user_id"] for member in members]
+
+    if user_ids:
+        created, _ = bulk_insert_user_image_states(connect_session, user_ids=user_ids, image_ids=mysql_image_ids, project_id=project_id, is_clustered=0)
+        if created is None:
+            # フォールバック: 一括挿入のトランザクションが失敗した場合は個別挿入（失敗した行はスキップされる）
+            print(f"⚠️ user_image_clustering_statesの一括挿入に失敗したため個別に挿入します ({len(user_ids)}人 × {len(mysql_image_ids)}枚)")
+            for mysql_image_id in mysql_image_ids:
+                for user_id in user_ids:
+                    insert_user_image_state(connect_session, user_id=user_id, image_id=mysql_image_id, project_id=project_id, is_clustered=0)
+
+    # 初期クラスタリングが完了している全メンバーのcontinuous_clustering_stateを2（実行可能）に更新
+    try:
+        update_project_members_continuous_state(connect_session, project_id)
+    except Exception as state_update_error:
+        pass
+
+
 async def process_single_upload(
     project_id: int, 
     uploaded_user_id: int, 
     file: UploadFile,
     delay: float = 0.0,
-    folder_name: str = None
+    folder_name: str = None,
+    timer: StageTimer = None,
+    create_member_states: bool = True
 ) -> UploadResult:
     """
     単一画像のアップロード処理（非同期）
+    CPU処理（PNG変換・埋め込み生成）はプロセスプール、ブロッキングI/O（DB・ファイル）はスレッドプールで実行し、
+    イベントループ上では待機のみを行う
+    段階ごとの所要時間は timer に記録される（成功時はレスポンスの stage_timings にも含める）
+    create_member_states=False の場合、メンバーのuser_image_clustering_statesは呼び出し側でまとめて作成する
     """
     if delay > 0:
         await asyncio.sleep(delay)
     
+    timer = timer or StageTimer()
     start_time = time.time()
     filename = file.filename
     
@@ -128,7 +205,7 @@ async def process_single_upload(
                 return UploadResult(filename, False, "フォルダ名が長すぎます（255文字以内）", error_type="ValidationError", status_code=400)
         
         # ファイル妥当性チェック
-        validation_start = time.time()
+        timer.mark("validation")
         is_valid, validation_message = validate_image_file(file)
         if not is_valid:
             print(f"\n=== 400 Bad Request: Validation Error ===")
@@ -141,8 +218,8 @@ async def process_single_upload(
             print("========================================\n")
             return UploadResult(filename, False, validation_message, error_type="ValidationError", status_code=400)
 
-        db_start = time.time()
-        connect_session = create_connect_session()
+        timer.mark("db_connect")
+        connect_session = await run_io(create_connect_session)
         if connect_session is None:
             print(f"\n=== 500 Internal Server Error: Database Connection Failed ===")
             print(f"Filename: {filename}")
@@ -153,15 +230,15 @@ async def process_single_upload(
             return UploadResult(filename, False, "データベース接続失敗", error_type="DatabaseConnectionError", status_code=500)
 
         # プロジェクトのoriginal_images_folder_pathを取得
-        project_check_start = time.time()
-        result, _ = get_project_original_images_folder_path(connect_session, project_id)
+        timer.mark("project_check")
+        project_info = await run_io(get_project_metadata, connect_session, project_id)
         
-        if not result or result.rowcount == 0:
+        if project_info is None:
             return UploadResult(filename, False, "プロジェクトが見つかりません", error_type="ProjectNotFoundError", status_code=404)
 
-        original_images_folder_path = result.mappings().first()["original_images_folder_path"]
+        original_images_folder_path = project_info["original_images_folder_path"]
         save_dir = Path(DEFAULT_IMAGE_PATH) / original_images_folder_path
-        os.makedirs(save_dir, exist_ok=True)
+        await run_io(os.makedirs, save_dir, exist_ok=True)
 
         filename_without_ext, _ = os.path.splitext(filename)
         png_path = f"{filename_without_ext}.png"
@@ -169,9 +246,9 @@ async def process_single_upload(
         save_path = save_dir / png_path
 
         # 【重要】ファイル保存前に同名画像が既に存在するか確認（DB + ファイルシステム）
-        conflict_start = time.time()
-        result, _ = check_image_exists(connect_session, escaped_png_path, project_id)
-        file_exists_in_fs = save_path.exists()
+        timer.mark("conflict_check")
+        result, _ = await run_io(check_image_exists, connect_session, escaped_png_path, project_id)
+        file_exists_in_fs = await run_io(save_path.exists)
         
         if (result and result.rowcount > 0) or file_exists_in_fs:
             error_detail = []
@@ -191,36 +268,34 @@ async def process_single_upload(
             )
 
         # Conflictチェック通過後にファイルを読み込み
-        file_read_start = time.time()
+        timer.mark("file_read")
         contents = await file.read()
         
         # PNG変換（圧縮なし、元の品質を維持）
-        temp_save_start = time.time()
+        timer.mark("png_save")
         if filename.lower().endswith('.png'):
             # 既にPNGの場合はそのまま保存
             png_bytes = contents
         else:
             # PNG以外の形式の場合は無圧縮でPNGに変換
-            temp_image = Image.open(BytesIO(contents))
-            temp_png_io = BytesIO()
-            temp_image.save(temp_png_io, format='PNG', compress_level=0)
-            png_bytes = temp_png_io.getvalue()
+            png_bytes = await run_cpu(convert_to_png, contents)
         
-        with open(save_path, "wb") as f:
-            f.write(png_bytes)
+        await run_io(save_path.write_bytes, png_bytes)
 
-        # 仮のキャプション生成
-        caption_start = time.time()
-        is_created, created_caption = Utils.get_exmaple_caption(png_path)
+        # 仮のキャプション生成（画像内容のハッシュでキャッシュを確認）
+        timer.mark("caption")
+        content_cache = await run_io(get_content_cache)
+        image_hash, is_created, created_caption = await run_io(_lookup_caption, content_cache, contents, png_path)
         if not (is_created):
             # ファイルを削除してロールバック
-            if save_path.exists():
-                os.remove(save_path)
+            if await run_io(save_path.exists):
+                await run_io(os.remove, save_path)
             return UploadResult(filename, False, "キャプション生成失敗", error_type="CaptionCreateError", status_code=500)
 
         # ベクトルDBへ登録（3つのデータベースに分けて保存）
-        chroma_init_start = time.time()
-        sentence_name_db_manager, sentence_usage_db_manager, sentence_category_db_manager, image_db_manager = get_chroma_managers()
+        timer.mark("chroma_init")
+        chroma_managers = await run_io(get_chroma_managers)
+        sentence_name_db_manager, sentence_usage_db_manager, sentence_category_db_manager, image_db_manager = chroma_managers
 
         if not sentence_name_db_manager or not sentence_usage_db_manager or not sentence_category_db_manager or not image_db_manager:
             # ChromaDB の初期化に失敗している場合はアップロードを中断
@@ -233,8 +308,8 @@ async def process_single_upload(
             print(f"sentence_category_db_manager: {bool(sentence_category_db_manager)}")
             print(f"image_db_manager: {bool(image_db_manager)}")
             print("==================================================================\n")
-            if save_path.exists():
-                os.remove(save_path)
+            if await run_io(save_path.exists):
+                await run_io(os.remove, save_path)
             return UploadResult(filename, False, "ベクトルDB 初期化失敗", error_type="ChromaDBInitError", status_code=500)
         
         # chroma_sentence_idを生成
@@ -243,90 +318,100 @@ async def process_single_upload(
         
         try:
             # 生成されたキャプションを3つの部分に分割
-            split_start = time.time()
+            timer.mark("caption_split")
             name_part, usage_part, category_part = ChromaDBManager.split_sentence_document(created_caption)
             
-            # 各部分のembeddingを並列生成（高速化）
-            embedding_start = time.time()
-            with ThreadPoolExecutor(max_workers=3) as executor:
-                name_future = executor.submit(SentenceEmbeddingsManager.sentence_to_embedding, name_part)
-                usage_future = executor.submit(SentenceEmbeddingsManager.sentence_to_embedding, usage_part)
-                category_future = executor.submit(SentenceEmbeddingsManager.sentence_to_embedding, category_part)
-                
-                name_embedding = name_future.result()
-                usage_embedding = usage_future.result()
-                category_embedding = category_future.result()
+            # 各部分のembeddingをプロセスプールでまとめて生成
+            # キャッシュに存在する文の埋め込みは再計算しない
+            timer.mark("sentence_embedding")
+            part_embeddings = {}
+            missing_parts = []
+            for part in (name_part, usage_part, category_part):
+                cached_embedding = await run_io(content_cache.get_sentence_embedding, part) if content_cache else None
+                if cached_embedding is not None:
+                    part_embeddings[part] = cached_embedding
+                elif part not in missing_parts:
+                    missing_parts.append(part)
+
+            if missing_parts:
+                for part, embedding in zip(missing_parts, await run_cpu(encode_sentences, missing_parts)):
+                    part_embeddings[part] = embedding
+                    if content_cache:
+                        await run_io(content_cache.put_sentence_embedding, part, embedding)
+
+            name_embedding = part_embeddings[name_part]
+            usage_embedding = part_embeddings[usage_part]
+            category_embedding = part_embeddings[category_part]
             
-            # 画像embeddingを生成（並列化の準備）
-            image_emb_start = time.time()
-            image_embedding = ImageEmbeddingsManager.image_to_embedding(save_path)
+            # 画像embeddingを生成（キャッシュに存在する場合は再利用）
+            timer.mark("image_embedding")
+            image_embedding = await run_io(content_cache.get_image_embedding, image_hash) if content_cache else None
+            if image_embedding is None:
+                image_embedding = await run_cpu(encode_image, str(save_path))
+                if image_embedding is not None and content_cache:
+                    await run_io(content_cache.put_image_embedding, image_hash, image_embedding)
             
-            # ChromaDBへの挿入を並列実行（高速化）
-            chroma_insert_start = time.time()
-            with ThreadPoolExecutor(max_workers=4) as executor:
-                name_meta = ChromaDBManager.ChromaMetaData(
-                    path=png_path,
-                    document=name_part,
-                    is_success=is_created,
-                    sentence_id=sentence_id
-                ).to_dict()
-                
-                usage_meta = ChromaDBManager.ChromaMetaData(
-                    path=png_path,
-                    document=usage_part,
-                    is_success=is_created,
-                    sentence_id=sentence_id
-                ).to_dict()
-                
-                category_meta = ChromaDBManager.ChromaMetaData(
-                    path=png_path,
-                    document=category_part,
-                    is_success=is_created,
-                    sentence_id=sentence_id
-                ).to_dict()
-                
-                image_meta = ChromaDBManager.ChromaMetaData(
-                    path=png_path,
-                    document=created_caption,
-                    is_success=is_created,
-                    sentence_id=image_id
-                ).to_dict()
-                
-                # 並列挿入
-                futures = [
-                    executor.submit(
-                        sentence_name_db_manager.collection.add,
-                        ids=[sentence_id],
-                        documents=[name_part],
-                        metadatas=[name_meta],
-                        embeddings=[name_embedding]
-                    ),
-                    executor.submit(
-                        sentence_usage_db_manager.collection.add,
-                        ids=[sentence_id],
-                        documents=[usage_part],
-                        metadatas=[usage_meta],
-                        embeddings=[usage_embedding]
-                    ),
-                    executor.submit(
-                        sentence_category_db_manager.collection.add,
-                        ids=[sentence_id],
-                        documents=[category_part],
-                        metadatas=[category_meta],
-                        embeddings=[category_embedding]
-                    ),
-                    executor.submit(
-                        image_db_manager.collection.add,
-                        ids=[image_id],
-                        documents=[created_caption],
-                        metadatas=[image_meta],
-                        embeddings=[image_embedding]
-                    )
-                ]
-                
-                # 全ての挿入が完了するまで待機
-                for future in futures:
-                    future.result()
+            # ChromaDBへの挿入をスレッドプールで並列実行
+            timer.mark("chroma_insert")
+            name_meta = ChromaDBManager.ChromaMetaData(
+                path=png_path,
+                document=name_part,
+                is_success=is_created,
+                sentence_id=sentence_id
+            ).to_dict()
+            
+            usage_meta = ChromaDBManager.ChromaMetaData(
+                path=png_path,
+                document=usage_part,
+                is_success=is_created,
+                sentence_id=sentence_id
+            ).to_dict()
+            
+            category_meta = ChromaDBManager.ChromaMetaData(
+                path=png_path,
+                document=category_part,
+                is_success=is_created,
+                sentence_id=sentence_id
+            ).to_dict()
+            
+            image_meta = ChromaDBManager.ChromaMetaData(
+                path=png_path,
+                document=created_caption,
+                is_success=is_created,
+                sentence_id=image_id
+            ).to_dict()
+            
+            # 並列挿入（全ての挿入が完了するまで待機）
+            await asyncio.gather(
+                run_io(
+                    sentence_name_db_manager.collection.add,
+                    ids=[sentence_id],
+                    documents=[name_part],
+                    metadatas=[name_meta],
+                    embeddings=[name_embedding]
+                ),
+                run_io(
+                    sentence_usage_db_manager.collection.add,
+                    ids=[sentence_id],
+                    documents=[usage_part],
+                    metadatas=[usage_meta],
+                    embeddings=[usage_embedding]
+                ),
+                run_io(
+                    sentence_category_db_manager.collection.add,
+                    ids=[sentence_id],
+                    documents=[category_part],
+                    metadatas=[category_meta],
+                    embeddings=[category_embedding]
+                ),
+                run_io(
+                    image_db_manager.collection.add,
+                    ids=[image_id],
+                    documents=[created_caption],
+                    metadatas=[image_meta],
+                    embeddings=[image_embedding]
+                )
+            )
         except Exception as chroma_error:
             print(f"\n=== 500 Internal Server Error: ChromaDB Insert Failed ===")
             print(f"Filename: {filename}")
@@ -337,22 +422,8 @@ async def process_single_upload(
             print(f"Error Type: {type(chroma_error).__name__}")
             print(f"Error Message: {str(chroma_error)}")
             print("==========================================================\n")
-            # ChromaDB挿入失敗時はファイルを削除してロールバック
-            if save_path.exists():
-                os.remove(save_path)
-            
-            # ChromaDBからの削除を試みる（既に挿入されたものがあれば）
-            try:
-                if sentence_name_db_manager:
-                    sentence_name_db_manager.collection.delete(ids=[sentence_id])
-                if sentence_usage_db_manager:
-                    sentence_usage_db_manager.collection.delete(ids=[sentence_id])
-                if sentence_category_db_manager:
-                    sentence_category_db_manager.collection.delete(ids=[sentence_id])
-                if image_db_manager:
-                    image_db_manager.collection.delete(ids=[image_id])
-            except Exception:
-                pass  # 削除失敗は無視（既に存在しない可能性）
+            # ChromaDB挿入失敗時はファイルと挿入済みのベクトルを削除してロールバック
+            await run_io(_rollback_upload, save_path, sentence_id, image_id, chroma_managers)
             
             return UploadResult(
                 filename, 
@@ -368,8 +439,8 @@ async def process_single_upload(
         clustering_id = Utils.generate_uuid()
         # 新しいスキーマに対応：統一sentence_idを保存
         caption_sql_value = 'NULL' if not is_created else f"'{escaped_caption}'"
-        mysql_insert_start = time.time()
-        result, _ = insert_image(connect_session, escaped_png_path, is_created_for_sql, caption_sql_value, project_id, clustering_id, sentence_id, image_id, uploaded_user_id, folder_name)
+        timer.mark("mysql_insert")
+        result, _ = await run_io(insert_image, connect_session, escaped_png_path, is_created_for_sql, caption_sql_value, project_id, clustering_id, sentence_id, image_id, uploaded_user_id, folder_name)
 
         if not result:
             # MySQL挿入失敗時、ファイルとChromaDBをロールバック
@@ -382,26 +453,13 @@ async def process_single_upload(
             print(f"Image ID: {image_id}")
             print(f"Error: MySQLに画像情報を挿入できませんでした")
             print("=======================================================\n")
-            if save_path.exists():
-                os.remove(save_path)
-            
-            try:
-                if sentence_name_db_manager:
-                    sentence_name_db_manager.collection.delete(ids=[sentence_id])
-                if sentence_usage_db_manager:
-                    sentence_usage_db_manager.collection.delete(ids=[sentence_id])
-                if sentence_category_db_manager:
-                    sentence_category_db_manager.collection.delete(ids=[sentence_id])
-                if image_db_manager:
-                    image_db_manager.collection.delete(ids=[image_id])
-            except Exception as cleanup_error:
-                pass
+            await run_io(_rollback_upload, save_path, sentence_id, image_id, chroma_managers)
             
             return UploadResult(filename, False, "データベース挿入失敗", error_type="DatabaseInsertError", status_code=500)
 
         # 挿入された画像のMySQLのID（自動採番）を取得
-        id_retrieval_start = time.time()
-        mysql_image_id_result, _ = select_image_id_by_clustering_id(connect_session, clustering_id)
+        timer.mark("id_retrieval")
+        mysql_image_id_result, _ = await run_io(select_image_id_by_clustering_id, connect_session, clustering_id)
         
         if not mysql_image_id_result:
             # 画像ID取得失敗（既に挿入されているのでロールバックは慎重に）
@@ -423,31 +481,12 @@ async def process_single_upload(
         mysql_image_id = mysql_image_id_result.mappings().first()["id"]
         
         # プロジェクトメンバー全員のuser_image_clustering_statesレコードを作成（一括挿入で高速化）
-        members_start = time.time()
-        members_result, _ = select_project_members(connect_session, project_id)
+        if create_member_states:
+            timer.mark("member_states")
+            await run_io(_create_member_states, connect_session, project_id, [mysql_image_id])
         
-        if members_result:
-            members = members_result.mappings().all()
-            user_ids = [member["user_id"] for member in members]
-            
-            if user_ids:
-                try:
-                    bulk_insert_start = time.time()
-                    bulk_insert_user_image_states(connect_session, user_ids=user_ids, image_id=mysql_image_id, project_id=project_id, is_clustered=0)
-                except Exception as state_error:
-                    # フォールバック: 個別挿入
-                    for user_id in user_ids:
-                        try:
-                            insert_user_image_state(connect_session, user_id=user_id, image_id=mysql_image_id, project_id=project_id, is_clustered=0)
-                        except Exception as fallback_error:
-                            pass
-            
-            # 初期クラスタリングが完了している全メンバーのcontinuous_clustering_stateを2（実行可能）に更新
-            try:
-                state_update_start = time.time()
-                update_project_members_continuous_state(connect_session, project_id)
-            except Exception as state_update_error:
-                pass
+        # 表示用サムネイルをバックグラウンドで事前生成
+        ThumbnailManager.schedule_generation(save_path, original_images_folder_path, png_path)
         
         processing_time = round(time.time() - start_time, 2)
         return UploadResult(
@@ -459,7 +498,8 @@ async def process_single_upload(
                 "chromadb_sentence_id": sentence_id,  # 文章埋め込みのUUID
                 "chromadb_image_id": image_id,  # 画像埋め込みのUUID
                 "mysql_image_id": mysql_image_id,  # MySQLの自動採番ID
-                "processing_time": processing_time
+                "processing_time": processing_time,
+                "stage_timings": timer.finish()
             },
             status_code=201
         )
@@ -490,7 +530,12 @@ async def process_single_upload(
     500: {"description": "Internal Server Error", "model": CustomResponseModel}
 
 })
-def read_images(project_id: int = None):
+def read_images(
+    project_id: int = None,
+    response_format: str = Query(default="json", alias="format", description="json: 従来の形式 / ndjson: 1行1件で逐次返す"),
+    cursor: str = Query(default=None, description="前のページの最後の行のキー（next_cursor）"),
+    limit: int = Query(default=None, ge=1, le=LISTING_MAX_LIMIT, description="省略時は全件を逐次返す")
+):
     if project_id is None:
         return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -504,28 +549,13 @@ def read_images(project_id: int = None):
             content={"message": "failed to connect to database", "data": None}
         )
 
-    result, _ = get_images_by_project(connect_session, project_id)
-    
-    if result:
-        rows = result.mappings().all()
-        # datetime を文字列に変換
-        formatted_rows = []
-        for row in rows:
-            row_dict = dict(row)
-
-            if isinstance(row_dict.get("created_at"), datetime):
-                row_dict["created_at"] = row_dict["created_at"].isoformat()
-            formatted_rows.append(row_dict)
-
-        return JSONResponse(
-            status_code=status.HTTP_200_OK,
-            content={"message": "succeeded to read images", "data": formatted_rows}
-        )
-    else:
-        return JSONResponse(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            content={"message": "failed to read images", "data": None}
-        )
+    return listing_response(
+        lambda cursor_values, page_limit, stream: get_images_by_project(connect_session, project_id, cursor=cursor_values, limit=page_limit, stream=stream),
+        key_names=("id",),
+        message="succeeded to read images",
+        error_message="failed to read images",
+        response_format=response_format, cursor=cursor, limit=limit
+    )
 
 @images_endpoint.get("/images/folder/{folder_id}", tags=["images"], description="フォルダ内の画像一覧を取得")
 def list_images_in_folder(folder_id: str):
@@ -548,8 +578,103 @@ def list_images_in_folder(folder_id: str):
     return JSONResponse(status_code=200, content={"message": "画像一覧を取得しました", "data": image_files})
 
 
+# SSEでイベントが無い間に送るキープアライブの間隔（秒）
+UPLOAD_STATUS_KEEPALIVE = 15.0
+
+# アップロード進捗状況取得用エンドポイント
+# /images/{folder_id}/{name} に一致してしまうため、画像取得より前に定義する
+@images_endpoint.get('/images/upload-status/{batch_id}', tags=["images"], description="バッチアップロードの進捗状況を取得（waitを指定するとロングポーリング）")
+async def get_upload_status(
+    batch_id: str,
+    since: int = Query(default=0, ge=0, description="前回受け取ったversion。これより後に更新されたファイルのみ返す"),
+    wait: float = Query(default=0, ge=0, le=30, description="更新が無い場合に待機する秒数")
+):
+    """
+    バッチアップロードの進捗状況を取得
+    """
+    tracker = get_upload_tracker()
+    if wait > 0:
+        snapshot = await tracker.wait_for_update(batch_id, since, wait)
+    else:
+        snapshot = tracker.snapshot(batch_id, since)
+    
+    if snapshot is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": "指定されたバッチIDが見つかりません", "data": None}
+        )
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"message": "進捗状況を取得しました", "data": snapshot}
+    )
+
+@images_endpoint.get('/images/upload-status/{batch_id}/stream', tags=["images"], description="バッチアップロードの進捗状況をServer-Sent Eventsで配信")
+async def stream_upload_status(batch_id: str, request: Request, since: int = Query(default=0, ge=0)):
+    """
+    バッチアップロードの進捗をSSEで配信する
+    - progress: 状態が変化するたびに、変化したファイルのみを含む状態を送信
+    - done: バッチ完了時に集計結果を含めて送信し、ストリームを終了
+    再接続時は Last-Event-ID（version）以降の変化から再開する
+    """
+    tracker = get_upload_tracker()
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    
+    if tracker.snapshot(batch_id, since) is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": "指定されたバッチIDが見つかりません", "data": None}
+        )
+    
+    async def event_stream():
+        version = since
+        while not await request.is_disconnected():
+            snapshot = await tracker.wait_for_update(batch_id, version, UPLOAD_STATUS_KEEPALIVE)
+            if snapshot is None:
+                yield "event: expired\ndata: {}\n\n"
+                return
+            
+            is_done = snapshot["status"] == "completed"
+            if snapshot["version"] > version or is_done:
+                version = snapshot["version"]
+                event = "done" if is_done else "progress"
+                yield f"id: {version}\nevent: {event}\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+                if is_done:
+                    return
+            else:
+                yield ": keep-alive\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@images_endpoint.get('/images/upload-status-stats', tags=["images"], description="アップロード進捗管理の保持状況を取得")
+def get_upload_status_stats():
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"message": "進捗管理の統計を取得しました", "data": get_upload_tracker().stats()}
+    )
+
+# コンテンツキャッシュのヒット/ミス数取得用エンドポイント
+@images_endpoint.get('/images/content-cache-stats', tags=["images"], description="画像内容ハッシュキャッシュのヒット/ミス数を取得")
+def get_content_cache_stats():
+    content_cache = get_content_cache()
+    if content_cache is None:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"message": "コンテンツキャッシュが利用できません", "data": None}
+        )
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"message": "コンテンツキャッシュの統計を取得しました", "data": content_cache.get_stats()}
+    )
+
+
 @images_endpoint.get("/images/{folder_id}/{name}")
-def get_image(folder_id: str, name: str):
+def get_image(folder_id: str, name: str, request: Request, width: int = ThumbnailManager.DEFAULT_WIDTH):
     backend_dir = Path(__file__).parent.parent  # backend/
     images_root_dir = backend_dir / "images"
     folder_path = images_root_dir / folder_id
@@ -567,39 +692,40 @@ def get_image(folder_id: str, name: str):
     if not image_path.is_file():
         return JSONResponse(status_code=400, content={"message": "指定されたパスはファイルではありません", "data": None})
 
+    if width not in ThumbnailManager.WIDTHS:
+        return JSONResponse(status_code=400, content={"message": f"widthは {list(ThumbnailManager.WIDTHS)} のいずれかを指定してください", "data": None})
+
     try:
-        # 画像を開く
-        img = Image.open(image_path)
-        
-        # RGBAの場合はRGBに変換（JPEGはRGBAをサポートしないため）
-        if img.mode in ('RGBA', 'LA', 'P'):
-            # 透過部分を白背景に変換
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-            img = background
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # リサイズ（幅を最大600pxに制限、アスペクト比維持）
-        max_width = 600
-        if img.width > max_width:
-            ratio = max_width / img.width
-            new_height = int(img.height * ratio)
-            img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
-        
-        # メモリ上に圧縮画像を保存
-        img_io = BytesIO()
-        img.save(img_io, format='PNG', quality=1, optimize=True)
-        img_io.seek(0)
-        
-        # 圧縮した画像を返す
-        return Response(
-            content=img_io.getvalue(),
+        # 事前生成されたサムネイルを使用（未生成または元画像より古い場合のみ生成）
+        thumbnail_path = ThumbnailManager.get_thumbnail(image_path, folder_id, name, width)
+        stat_result = thumbnail_path.stat()
+        etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+        last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+        headers = {
+            "Cache-Control": "public, max-age=3600",  # 1時間キャッシュ
+            "ETag": etag,
+            "Last-Modified": last_modified,
+        }
+
+        # 条件付きGET（If-None-Matchを優先し、無い場合のみIf-Modified-Sinceを評価）
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        else:
+            if_modified_since = request.headers.get("if-modified-since")
+            if if_modified_since:
+                try:
+                    if int(stat_result.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp():
+                        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+                except (TypeError, ValueError):
+                    pass
+
+        return FileResponse(
+            thumbnail_path,
             media_type="image/png",
             headers={
-                "Cache-Control": "public, max-age=3600",  # 1時間キャッシュ
+                **headers,
                 "Content-Disposition": f"inline; filename={Path(name).stem}.jpg"
             }
         )
@@ -674,77 +800,13 @@ async def upload_image(
             }
         )
 
-# バッチアップロード用エンドポイント
-@images_endpoint.post('/images/batch', tags=["images"], description="複数画像の並列アップロード", responses={
-    201: {"description": "All uploads succeeded", "model": CustomResponseModel},
-    207: {"description": "Multi-Status - Some uploads succeeded, some failed", "model": CustomResponseModel},
-    400: {"description": "Bad Request - All uploads failed or invalid request", "model": CustomResponseModel},
-    500: {"description": "Internal Server Error", "model": CustomResponseModel}
-})
-async def batch_upload_images(
-    project_id: int = Form(...),
-    uploaded_user_id: int = Form(...),
-    files: List[UploadFile] = File(...),
-    max_concurrent: int = Form(default=3),  # 最大同時実行数
-    upload_delay: float = Form(default=0.1),  # アップロード間隔（秒）
-    folder_names: str = Form(default=None)  # JSON配列の文字列（各ファイルのフォルダ名）
-):
+def _summarize_batch_results(project_id: int, uploaded_user_id: int, filenames: list[str], results: list, total_time: float, settings: dict) -> tuple[int, str, bool, dict]:
     """
-    複数画像の並列アップロード
-    - max_concurrent: 最大同時実行数（デフォルト3）
-    - upload_delay: 各アップロード間の遅延時間（デフォルト0.1秒）
-    - folder_names: 各ファイルのフォルダ名のJSON配列（例: '["folder1", "folder2", null]'）
+    バッチアップロードの結果を集計する
+
+    Returns:
+        tuple[int, str, bool, dict]: (ステータスコード, メッセージ, 全件成功したか, レスポンスのdata)
     """
-    if not files:
-        return JSONResponse(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            content={"message": "ファイルが指定されていません", "data": None}
-        )
-    
-    if len(files) > 50:  # 最大50ファイルまで
-        return JSONResponse(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            content={"message": "一度にアップロードできるファイル数は50個までです", "data": None}
-        )
-    
-    # folder_namesをパース
-    import json
-    folder_name_list = []
-    if folder_names:
-        try:
-            folder_name_list = json.loads(folder_names)
-            if not isinstance(folder_name_list, list):
-                return JSONResponse(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    content={"message": "folder_namesは配列形式である必要があります", "data": None}
-                )
-            if len(folder_name_list) != len(files):
-                return JSONResponse(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    content={"message": f"folder_namesの要素数({len(folder_name_list)})とファイル数({len(files)})が一致しません", "data": None}
-                )
-        except json.JSONDecodeError:
-            return JSONResponse(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                content={"message": "folder_namesのJSON形式が不正です", "data": None}
-            )
-    else:
-        folder_name_list = [None] * len(files)
-    
-    # セマフォで同時実行数を制限
-    semaphore = asyncio.Semaphore(max_concurrent)
-    
-    async def limited_upload(file: UploadFile, index: int, folder_name: str = None) -> UploadResult:
-        async with semaphore:
-            delay = index * upload_delay  # インデックスに応じて遅延
-            return await process_single_upload(project_id, uploaded_user_id, file, delay, folder_name)
-    
-    start_time = time.time()
-    
-    # 並列でアップロード処理を実行
-    tasks = [limited_upload(file, i, folder_name_list[i]) for i, file in enumerate(files)]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    
     # 結果を集計
     success_count = 0
     failure_count = 0
@@ -759,7 +821,7 @@ async def batch_upload_images(
             failure_count += 1
             server_error_count += 1
             failure_results.append({
-                "filename": files[i].filename if i < len(files) else "unknown",
+                "filename": filenames[i] if i < len(filenames) else "unknown",
                 "success": False,
                 "message": str(result),
                 "error_type": type(result).__name__,
@@ -800,7 +862,7 @@ async def batch_upload_images(
             failure_count += 1
             server_error_count += 1
             failure_results.append({
-                "filename": files[i].filename if i < len(files) else "unknown",
+                "filename": filenames[i] if i < len(filenames) else "unknown",
                 "success": False,
                 "message": "予期しない結果タイプ",
                 "error_type": "UnexpectedResultType",
@@ -808,8 +870,6 @@ async def batch_upload_images(
                 "data": {}
             })
     
-    total_time = round(time.time() - start_time, 2)
-    
     # すべて成功した場合は201、一部失敗は207（Multi-Status）、すべて失敗は適切なエラーコード
     if failure_count == 0:
         response_status_code = status.HTTP_201_CREATED
@@ -825,7 +885,7 @@ async def batch_upload_images(
         print(f"\n=== 400 Bad Request: Batch Upload All Failed ===")
         print(f"Project ID: {project_id}")
         print(f"User ID: {uploaded_user_id}")
-        print(f"Total Files: {len(files)}")
+        print(f"Total Files: {len(filenames)}")
         print(f"Failure Count: {failure_count}")
         print(f"Conflict Count: {conflict_count}")
         print(f"Validation Error Count: {validation_error_count}")
@@ -848,7 +908,7 @@ async def batch_upload_images(
             print(f"\n=== 500 Internal Server Error: Batch Upload Partial Server Errors ===")
             print(f"Project ID: {project_id}")
             print(f"User ID: {uploaded_user_id}")
-            print(f"Total Files: {len(files)}")
+            print(f"Total Files: {len(filenames)}")
             print(f"Success Count: {success_count}")
             print(f"Failure Count: {failure_count}")
             print(f"Server Error Count: {server_error_count}")
@@ -861,74 +921,356 @@ async def batch_upload_images(
                     print(f"     Status Code: {fail_result.get('status_code', 'unknown')}")
             print("===================================================================\n")
     
+    data = {
+        "total_files": len(filenames),
+        "success_count": success_count,
+        "failure_count": failure_count,
+        "conflict_count": conflict_count,
+        "validation_error_count": validation_error_count,
+        "server_error_count": server_error_count,
+        "total_processing_time": total_time,
+        "settings": settings,
+        "success_results": success_results,
+        "failure_results": failure_results,
+        "summary": {
+            "all_succeeded": failure_count == 0,
+            "all_failed": success_count == 0,
+            "partial_success": success_count > 0 and failure_count > 0
+        }
+    }
+    return response_status_code, response_message, response_success, data
+
+
+async def _run_batch_upload(
+    batch_id: str,
+    project_id: int,
+    uploaded_user_id: int,
+    files: List[UploadFile],
+    folder_name_list: list,
+    max_concurrent: int,
+    upload_delay: float
+) -> tuple[int, str, bool, dict]:
+    """
+    バッチ内の画像を並列でアップロードし、ファイルごとの進捗と段階別の所要時間を進捗管理に記録する
+    """
+    tracker = get_upload_tracker()
+    settings = {"max_concurrent": max_concurrent, "upload_delay": upload_delay}
+    
+    # セマフォで同時実行数を制限
+    semaphore = asyncio.Semaphore(max_concurrent)
+    
+    async def limited_upload(file: UploadFile, index: int, folder_name: str = None) -> UploadResult:
+        async with semaphore:
+            delay = index * upload_delay  # インデックスに応じて遅延
+            timer = StageTimer(lambda stage, timings: tracker.file_stage(batch_id, index, stage, timings))
+            try:
+                result = await process_single_upload(project_id, uploaded_user_id, file, delay, folder_name, timer, create_member_states=False)
+            except Exception as e:
+                failed = UploadResult(file.filename, False, str(e), error_type=type(e).__name__, status_code=500)
+                tracker.file_finished(batch_id, index, failed.to_dict(), timer.finish())
+                raise
+            tracker.file_finished(batch_id, index, result.to_dict(), timer.finish())
+            return result
+    
+    start_time = time.time()
+    
+    # 並列でアップロード処理を実行
+    tasks = [limited_upload(file, i, folder_name_list[i]) for i, file in enumerate(files)]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    
+    # 成功した画像のuser_image_clustering_statesをメンバー全員分まとめて1回で挿入
+    mysql_image_ids = [
+        result.data["mysql_image_id"] for result in results
+        if isinstance(result, UploadResult) and result.success
+    ]
+    if mysql_image_ids:
+        member_states_start = time.time()
+        connect_session = await run_io(create_connect_session)
+        if connect_session is None:
+            print(f"⚠️ user_image_clustering_statesを作成できませんでした（データベース接続失敗, batch_id: {batch_id}）")
+        else:
+            await run_io(_create_member_states, connect_session, project_id, mysql_image_ids)
+            print(f"👥 メンバーのクラスタリング状態を一括作成: {len(mysql_image_ids)}枚 ({time.time() - member_states_start:.3f}秒)")
+    
+    total_time = round(time.time() - start_time, 2)
+    filenames = [file.filename for file in files]
+    summary = _summarize_batch_results(project_id, uploaded_user_id, filenames, results, total_time, settings)
+    response_status_code, response_message, response_success, data = summary
+    tracker.finish_batch(batch_id, {
+        "status_code": response_status_code,
+        "success": response_success,
+        "message": response_message,
+        "data": data
+    })
+    print(f"📦 バッチアップロード完了 (batch_id: {batch_id}): {response_message} {total_time}秒")
+    return summary
+
+
+# バッチアップロード用エンドポイント
+@images_endpoint.post('/images/batch', tags=["images"], description="複数画像の並列アップロード", responses={
+    201: {"description": "All uploads succeeded (wait=true)", "model": CustomResponseModel},
+    202: {"description": "Accepted - processing in background, follow /images/upload-status/{batch_id}", "model": CustomResponseModel},
+    207: {"description": "Multi-Status - Some uploads succeeded, some failed", "model": CustomResponseModel},
+    400: {"description": "Bad Request - All uploads failed or invalid request", "model": CustomResponseModel},
+    500: {"description": "Internal Server Error", "model": CustomResponseModel}
+})
+async def batch_upload_images(
+    project_id: int = Form(...),
+    uploaded_user_id: int = Form(...),
+    files: List[UploadFile] = File(...),
+    max_concurrent: int = Form(default=3),  # 最大同時実行数
+    upload_delay: float = Form(default=0.1),  # アップロード間隔（秒）
+    folder_names: str = Form(default=None),  # JSON配列の文字列（各ファイルのフォルダ名）
+    wait: bool = Form(default=False),  # Trueの場合は全件の処理完了後に結果を返す
+    background_tasks: BackgroundTasks = None
+):
+    """
+    複数画像の並列アップロード
+    - max_concurrent: 最大同時実行数（デフォルト3）
+    - upload_delay: 各アップロード間の遅延時間（デフォルト0.1秒）
+    - folder_names: 各ファイルのフォルダ名のJSON配列（例: '["folder1", "folder2", null]'）
+    - wait: Falseの場合（デフォルト）はバッチIDを即座に返してバックグラウンドで処理する。
+      進捗は GET /images/upload-status/{batch_id}（ロングポーリング）または .../stream（SSE）で取得する
+    """
+    if not files:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"message": "ファイルが指定されていません", "data": None}
+        )
+    
+    if len(files) > 50:  # 最大50ファイルまで
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"message": "一度にアップロードできるファイル数は50個までです", "data": None}
+        )
+    
+    # folder_namesをパース
+    import json
+    folder_name_list = []
+    if folder_names:
+        try:
+            folder_name_list = json.loads(folder_names)
+            if not isinstance(folder_name_list, list):
+                return JSONResponse(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    content={"message": "folder_namesは配列形式である必要があります", "data": None}
+                )
+            if len(folder_name_list) != len(files):
+                return JSONResponse(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    content={"message": f"folder_namesの要素数({len(folder_name_list)})とファイル数({len(files)})が一致しません", "data": None}
+                )
+        except json.JSONDecodeError:
+            return JSONResponse(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content={"message": "folder_namesのJSON形式が不正です", "data": None}
+            )
+    else:
+        folder_name_list = [None] * len(files)
+    
+    tracker = get_upload_tracker()
+    settings = {"max_concurrent": max_concurrent, "upload_delay": upload_delay}
+    batch_id = tracker.create_batch(project_id, uploaded_user_id, [file.filename for file in files], settings)
+    
+    if wait:
+        response_status_code, response_message, response_success, data = await _run_batch_upload(
+            batch_id, project_id, uploaded_user_id, files, folder_name_list, max_concurrent, upload_delay
+        )
+        data["batch_id"] = batch_id
+        return JSONResponse(
+            status_code=response_status_code,
+            content={
+                "success": response_success,
+                "message": response_message,
+                "data": data
+            }
+        )
+    
+    # リクエスト終了後はアップロードファイルが閉じられるため、内容をメモリに読み込んでから処理を引き継ぐ
+    buffered_files = []
+    for file in files:
+        contents = await file.read()
+        buffered_files.append(UploadFile(BytesIO(contents), size=len(contents), filename=file.filename, headers=file.headers))
+    
+    background_tasks.add_task(
+        _run_batch_upload, batch_id, project_id, uploaded_user_id, buffered_files, folder_name_list, max_concurrent, upload_delay
+    )
+    
     return JSONResponse(
-        status_code=response_status_code,
+        status_code=status.HTTP_202_ACCEPTED,
         content={
-            "success": response_success,
-            "message": response_message,
+            "success": True,
+            "message": f"バッチアップロードを受け付けました ({len(files)}件)",
             "data": {
+                "batch_id": batch_id,
                 "total_files": len(files),
-                "success_count": success_count,
-                "failure_count": failure_count,
-                "conflict_count": conflict_count,
-                "validation_error_count": validation_error_count,
-                "server_error_count": server_error_count,
-                "total_processing_time": total_time,
-                "settings": {
-                    "max_concurrent": max_concurrent,
-                    "upload_delay": upload_delay
-                },
-                "success_results": success_results,
-                "failure_results": failure_results,
-                "summary": {
-                    "all_succeeded": failure_count == 0,
-                    "all_failed": success_count == 0,
-                    "partial_success": success_count > 0 and failure_count > 0
-                }
+                "settings": settings,
+                "status_url": f"/images/upload-status/{batch_id}",
+                "stream_url": f"/images/upload-status/{batch_id}/stream"
             }
         }
     )
 
-# アップロード進捗状況取得用エンドポイント（将来的に使用）
-@images_endpoint.get('/images/upload-status/{batch_id}', tags=["images"], description="バッチアップロードの進捗状況を取得")
-async def get_upload_status(batch_id: str):
+# 画像削除
+# 一括削除で一度に指定できる画像数と、ChromaDBの1回のdeleteで削除するID数
+IMAGE_DELETE_MAX = 10000
+CHROMA_DELETE_BATCH = 500
+
+
+def _delete_chroma_ids(manager: ChromaDBManager, ids: list) -> int:
+    """コレクションからIDをCHROMA_DELETE_BATCH件ずつ削除する"""
+    for offset in range(0, len(ids), CHROMA_DELETE_BATCH):
+        manager.collection.delete(ids=ids[offset:offset + CHROMA_DELETE_BATCH])
+    return len(ids)
+
+
+def _delete_images(image_ids: list) -> tuple[int, dict]:
     """
-    バッチアップロードの進捗状況を取得
+    画像をまとめて削除し、ChromaDBの埋め込みと全メンバーの分類ツリーからも取り除く
+
+    1. MySQL: imagesを1文で削除（user_image_clustering_statesはON DELETE CASCADEで削除）
+    2. ChromaDB: 4つのコレクションからバッチ単位で削除（コレクションごとに並列）
+    3. MongoDB: 対象プロジェクトの全メンバーのツリーから、メンバーごとに1回の更新で削除
+    4. サムネイル: 全サイズのサムネイルファイルを削除
+
+    Args:
+        image_ids: 削除する画像のID
+
+    Returns:
+        tuple[int, dict]: (ステータスコード, レスポンスのdata)
     """
-    if batch_id in upload_status_cache:
-        return JSONResponse(
-            status_code=status.HTTP_200_OK,
-            content={"message": "進捗状況を取得しました", "data": upload_status_cache[batch_id]}
-        )
+    timer = StageTimer()
+    image_ids = list(dict.fromkeys(image_ids))
+    connect_session = create_connect_session()
+    if connect_session is None:
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, {"stage_timings": timer.finish()}
+
+    timer.mark("lookup")
+    rows, _ = select_images_for_delete(connect_session, image_ids)
+    if rows is None:
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, {"stage_timings": timer.finish()}
+    found_ids = {row["id"] for row in rows}
+    not_found_ids = [image_id for image_id in image_ids if image_id not in found_ids]
+    data = {
+        "deleted_count": 0,
+        "not_found_ids": not_found_ids,
+        "chroma_deleted": {},
+        "tree_nodes_removed": 0,
+        "trees_updated": 0,
+        "errors": []
+    }
+    if not rows:
+        data["stage_timings"] = timer.finish()
+        return status.HTTP_200_OK, data
+
+    timer.mark("mysql_delete")
+    result, _ = delete_images(connect_session, [row["id"] for row in rows])
+    if result is None:
+        data["stage_timings"] = timer.finish()
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, data
+    data["deleted_count"] = result.rowcount
+
+    timer.mark("chroma_delete")
+    sentence_ids = [row["chromadb_sentence_id"] for row in rows if row["chromadb_sentence_id"]]
+    chroma_image_ids = [row["chromadb_image_id"] for row in rows if row["chromadb_image_id"]]
+    sentence_name_db_manager, sentence_usage_db_manager, sentence_category_db_manager, image_db_manager = get_chroma_managers()
+    if sentence_name_db_manager is None:
+        data["errors"].append("ChromaDBに接続できないため埋め込みを削除できませんでした")
     else:
-        return JSONResponse(
-            status_code=status.HTTP_404_NOT_FOUND,
-            content={"message": "指定されたバッチIDが見つかりません", "data": None}
-        )
+        targets = {
+            "sentence_name_embeddings": (sentence_name_db_manager, sentence_ids),
+            "sentence_usage_embeddings": (sentence_usage_db_manager, sentence_ids),
+            "sentence_category_embeddings": (sentence_category_db_manager, sentence_ids),
+            "image_embeddings": (image_db_manager, chroma_image_ids)
+        }
+        futures = {
+            name: get_io_pool().submit(_delete_chroma_ids, manager, ids)
+            for name, (manager, ids) in targets.items() if ids
+        }
+        for name, future in futures.items():
+            try:
+                data["chroma_deleted"][name] = future.result()
+            except Exception as e:
+                print(f"⚠️ ChromaDB ({name}) の削除に失敗: {e}")
+                data["errors"].append(f"{name}: {e}")
+
+    timer.mark("mongo_prune")
+    clustering_ids = [row["clustering_id"] for row in rows if row["clustering_id"]]
+    project_ids = sorted({row["project_id"] for row in rows})
+    members, _ = select_member_mongo_result_ids(connect_session, project_ids)
+    if members is None:
+        data["errors"].append("メンバーの分類結果IDを取得できませんでした")
+    for member in members or []:
+        if not member["mongo_result_id"]:
+            continue
+        try:
+            removed = ResultManager(member["mongo_result_id"]).remove_file_nodes(clustering_ids)
+            if removed > 0:
+                data["tree_nodes_removed"] += removed
+                data["trees_updated"] += 1
+        except Exception as e:
+            print(f"⚠️ 分類ツリー ({member['mongo_result_id']}) の更新に失敗: {e}")
+            data["errors"].append(f"{member['mongo_result_id']}: {e}")
+
+    timer.mark("thumbnail_delete")
+    for row in rows:
+        try:
+            ThumbnailManager.delete_all(row["original_images_folder_path"], row["name"])
+        except OSError as e:
+            print(f"⚠️ サムネイル ({row['original_images_folder_path']}/{row['name']}) の削除に失敗: {e}")
+            data["errors"].append(f"thumbnail {row['name']}: {e}")
+
+    data["stage_timings"] = timer.finish()
+    print(f"🗑️ 画像一括削除: {data['deleted_count']}件 {data['stage_timings']}")
+    return status.HTTP_200_OK, data
+
+
+@images_endpoint.post('/images/bulk-delete', tags=["images"], description="画像をまとめて削除（埋め込み・分類ツリーからも削除）", responses={
+    200: {"description": "OK", "model": CustomResponseModel},
+    400: {"description": "Bad Request", "model": CustomResponseModel},
+    500: {"description": "Internal Server Error", "model": CustomResponseModel}
+})
+def bulk_delete_images(request: DeleteImages):
+    if not request.image_ids:
+        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"message": "image_ids is required", "data": None})
+    if len(request.image_ids) > IMAGE_DELETE_MAX:
+        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"message": f"image_ids must be at most {IMAGE_DELETE_MAX}", "data": None})
+
+    status_code, data = _delete_images(request.image_ids)
+    if status_code != status.HTTP_200_OK:
+        return JSONResponse(status_code=status_code, content={"message": "failed to delete images", "data": data})
+    return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "succeeded to delete images", "data": data})
+
 
-# 画像削除
 @images_endpoint.delete('/images/{image_id}', tags=["images"], description="画像を削除", responses={
     204: {"description": "No Content"},
     400: {"description": "Bad Request", "model": CustomResponseModel},
     500: {"description": "Internal Server Error", "model": CustomResponseModel}
 })
 def delete_image(image_id: str):
-    connect_session = create_connect_session()
-    if connect_session is None:
-        return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"message": "failed to connect to database", "data": None})
+    try:
+        id = int(image_id)
+    except ValueError:
+        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"message": "invalid image_id", "data": None})
 
-    result, _ = delete_image(connect_session, image_id)
-    if result:
+    status_code, data = _delete_images([id])
+    if status_code == status.HTTP_200_OK:
         return Response(status_code=status.HTTP_204_NO_CONTENT)
     else:
-        return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"message": "failed to delete image", "data": None})
+        return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"message": "failed to delete image", "data": data})
 
 
-@images_endpoint.get('/images/captions', tags=["images"], description="指定フォルダ内の画像のキャプション一覧を取得")
-def get_captions_for_folder(mongo_result_id: str, folder_id: str):
+@images_endpoint.get('/images/captions', tags=["images"], description="指定フォルダ内の画像のキャプション一覧を取得（offset/limitでページング可能）")
+def get_captions_for_folder(
+    mongo_result_id: str,
+    folder_id: str,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=None, ge=1, description="省略時はフォルダ内の全件")
+):
     """
     指定された mongo_result_id と folder_id に対して、そのフォルダ内の画像(clustering_id)を取得し
     MySQL の images テーブルから caption を取得して {folder_id: ..., captions: {clustering_id: caption, ...}} を返します。
+    キャプションはINクエリでまとめて取得し、レスポンスは逐次書き出します。
     """
     # 1) Mongo から clustering_id 一覧を取得
     rm = ResultManager(mongo_result_id)
@@ -937,22 +1279,25 @@ def get_captions_for_folder(mongo_result_id: str, folder_id: str):
         return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"message": leaf_res.get('error', 'Folder not found or not leaf'), "data": None})
 
     clustering_ids = leaf_res.get('data', [])
+    total_count = len(clustering_ids)
+    page_ids = clustering_ids[offset:offset + limit] if limit else clustering_ids[offset:]
+    next_offset = offset + len(page_ids) if offset + len(page_ids) < total_count else None
 
-    # 2) DB から caption を取得
+    # 2) DB から caption をまとめて取得
     connect_session = create_connect_session()
     if connect_session is None:
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"message": "failed to connect to database", "data": None})
 
-    captions = {}
-    for cid in clustering_ids:
-        try:
-            result, _ = select_caption_by_clustering_id(connect_session, cid)
-            if result and result.rowcount > 0:
-                row = result.mappings().first()
-                captions[cid] = row.get('caption')
-            else:
-                captions[cid] = None
-        except Exception as e:
-            captions[cid] = None
-
-    return JSONResponse(status_code=status.HTTP_200_OK, content={"folder_id": folder_id, "captions": captions})
\ No newline at end of file
+    envelope = {
+        "folder_id": folder_id,
+        "captions": Utils.JSON_STREAM_PLACEHOLDER,
+        "total_count": total_count,
+        "offset": offset,
+        "limit": limit,
+        "next_offset": next_offset
+    }
+    return StreamingResponse(
+        Utils.stream_json(envelope, iter_captions_by_clustering_ids(connect_session, page_ids)),
+        status_code=status.HTTP_200_OK,
+        media_type="application/json"
+    )
\ No newline at end of file
@@ -0,0 +1,64 @@
+from fastapi import status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from db_utils.commons import decode_cursor, encode_cursor
+from clustering.utils import Utils
+
+# 一覧取得で指定できる形式と1ページあたりの最大件数
+LISTING_FORMATS = ("json", "ndjson")
+LISTING_MAX_LIMIT = 10000
+
+
+def listing_response(fetch, key_names: tuple, message: str, error_message: str,
+                     response_format: str = "json", cursor: str = None, limit: int = None):
+    """
+    一覧取得エンドポイントのレスポンスを作成する
+
+    - limit を指定しない場合: サーバーサイドカーソルで全件を逐次書き出す（dataは従来どおり配列）
+    - limit を指定した場合: キー順で cursor の次から limit 件を返し、data を {"items", "limit", "next_cursor"} にする
+    - response_format="ndjson" の場合: 1行1件のNDJSONで逐次書き出す（次のページのカーソルは最後の行のキーから作る）
+
+    Args:
+        fetch: (cursor, limit, stream) を受け取りクエリ関数の結果を返す関数
+        key_names: 並び順のキーとなる行の項目名（カーソルの作成に使う）
+        message: 成功時のメッセージ
+        error_message: 失敗時のメッセージ
+        response_format: "json" または "ndjson"
+        cursor: 前のページの最後の行のキー（":"区切り）
+        limit: 取得件数
+
+    Returns:
+        JSONResponse | StreamingResponse
+    """
+    if response_format not in LISTING_FORMATS:
+        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"message": "format must be json or ndjson", "data": None})
+
+    try:
+        cursor_values = decode_cursor(cursor, len(key_names)) if cursor else None
+    except ValueError:
+        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"message": "invalid cursor", "data": None})
+
+    if response_format == "json" and limit is not None:
+        result, _ = fetch(cursor_values, limit, False)
+        if result is None:
+            return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"message": error_message, "data": None})
+        items = [dict(row) for row in result.mappings()]
+        next_cursor = encode_cursor(items[-1], key_names) if len(items) == limit else None
+        return JSONResponse(
+            status_code=status.HTTP_200_OK,
+            content={"message": message, "data": {"items": jsonable_encoder(items), "limit": limit, "next_cursor": next_cursor}}
+        )
+
+    rows, _ = fetch(cursor_values, limit, True)
+    if rows is None:
+        return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"message": error_message, "data": None})
+
+    if response_format == "ndjson":
+        return StreamingResponse(Utils.stream_ndjson(rows), media_type="application/x-ndjson")
+
+    envelope = {"message": message, "data": Utils.JSON_STREAM_PLACEHOLDER}
+    return StreamingResponse(Utils.stream_json_list(envelope, rows), media_type="application/json")
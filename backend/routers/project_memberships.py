@@ -1,5 +1,7 @@
 import json
-from fastapi import APIRouter, status,Response
+import time
+from functools import partial
+from fastapi import APIRouter, status, Response, Query
 import sys
 import os
 from fastapi.responses import JSONResponse
@@ -7,7 +9,9 @@ from fastapi.responses import JSONResponse
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
 from db_utils.commons import create_connect_session
 from db_utils import project_memberships_queries as pm_queries
-from db_utils.auth_queries import select_images_by_project, insert_user_image_state
+from db_utils.auth_queries import insert_user_image_states_for_project
+from db_utils.metadata_cache import invalidate_membership
+from routers.listing import listing_response, LISTING_MAX_LIMIT
 from db_utils.validators import validate_data
 from db_utils.models import CustomResponseModel, NewProjectMembership, UpdateProjectMembershipState
 from clustering.utils import Utils
@@ -21,7 +25,13 @@ project_memberships_endpoint = APIRouter()
     400: {"description": "Bad Request", "model": CustomResponseModel},
     500: {"description": "Internal Server Error", "model": CustomResponseModel}
 })
-def read_project_memberships(user_id=None, project_id=None):
+def read_project_memberships(
+    user_id=None,
+    project_id=None,
+    response_format: str = Query(default="json", alias="format", description="json: 従来の形式 / ndjson: 1行1件で逐次返す"),
+    cursor: str = Query(default=None, description="前のページの最後の行のキー（next_cursor）"),
+    limit: int = Query(default=None, ge=1, le=LISTING_MAX_LIMIT, description="省略時は全件を逐次返す")
+):
     connect_session = create_connect_session()
     if connect_session is None:
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,content={"message": "failed to connect to database", "data":None})
@@ -37,7 +47,7 @@ def read_project_memberships(user_id=None, project_id=None):
             print(e)
             return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,content={"message":"invalid project_id", "data":None})
         # SQLの実行
-        result,_ = pm_queries.get_memberships_by_project(connect_session, id)
+        query_func = partial(pm_queries.get_memberships_by_project, connect_session, id)
     elif(user_id is not None):
         try:
             id = int(user_id)
@@ -45,17 +55,18 @@ def read_project_memberships(user_id=None, project_id=None):
             print(e)
             return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,content={"message":"invalid project_id", "data":None})
         # SQLの実行
-        result,_ = pm_queries.get_memberships_by_user(connect_session, id)
+        query_func = partial(pm_queries.get_memberships_by_user, connect_session, id)
     else:
         # SQLの実行
-        result,_ = pm_queries.get_all_memberships(connect_session)
+        query_func = partial(pm_queries.get_all_memberships, connect_session)
     
-    if result is not None:
-        rows = result.mappings().all()
-        project_membership_list = [dict(row) for row in rows]
-        return JSONResponse(status_code=status.HTTP_200_OK,content={"message": "succeeded to read project", "data":project_membership_list})
-    else:
-        return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,content={"message": "failed to read project_memberships", "data":None})
+    return listing_response(
+        lambda cursor_values, page_limit, stream: query_func(cursor=cursor_values, limit=page_limit, stream=stream),
+        key_names=("user_id", "project_id"),
+        message="succeeded to read project",
+        error_message="failed to read project_memberships",
+        response_format=response_format, cursor=cursor, limit=limit
+    )
 
 #ユーザとプロジェクトの紐付けを作成
 @project_memberships_endpoint.post('/project_memberships',tags=["project_memberships"],description="ユーザとプロジェクト間の紐付けを行う",responses={
@@ -81,23 +92,16 @@ def create_project_membership(project_membership:NewProjectMembership):
     result,_ = pm_queries.insert_project_membership(session=connect_session, user_id=project_membership.user_id, project_id=project_membership.project_id, mongo_result_id=mongo_result_id)
     
     if not(result is None):
-        # プロジェクトメンバーシップ作成成功時、既存の画像に対してuser_image_clustering_statesレコードを作成
+        invalidate_membership(project_membership.project_id, project_membership.user_id)
+        # プロジェクトメンバーシップ作成成功時、既存の画像に対してuser_image_clustering_statesレコードを作成（INSERT ... SELECTの1文で作成）
         try:
-            # プロジェクト内の既存画像を取得
-            images_result, _ = select_images_by_project(session=connect_session, project_id=project_membership.project_id)
-
-            if images_result:
-                images = images_result.mappings().all()
-                created_count = 0
-
-                for image in images:
-                    image_id = image["id"]
-                    # user_image_clustering_statesレコードを作成
-                    state_result, _ = insert_user_image_state(session=connect_session, user_id=project_membership.user_id, image_id=image_id, project_id=project_membership.project_id, is_clustered=0)
-                    if state_result:
-                        created_count += 1
-
-                print(f"✅ ユーザ{project_membership.user_id}に対して{created_count}個の画像クラスタリング状態レコードを作成しました")
+            start_time = time.time()
+            state_result, _ = insert_user_image_states_for_project(session=connect_session, user_id=project_membership.user_id, project_id=project_membership.project_id, is_clustered=0)
+            elapsed_time = round(time.time() - start_time, 3)
+            if state_result is not None:
+                print(f"✅ ユーザ{project_membership.user_id}に対して{state_result.rowcount}個の画像クラスタリング状態レコードを作成しました ({elapsed_time}秒)")
+            else:
+                print(f"⚠️ user_image_clustering_statesの作成に失敗しました ({elapsed_time}秒)")
         except Exception as e:
             print(f"⚠️ user_image_clustering_states作成エラー: {e}")
             # エラーが発生してもproject_membership作成自体は成功しているので処理は続行
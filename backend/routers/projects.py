@@ -1,6 +1,6 @@
 from datetime import datetime
 import json
-from fastapi import APIRouter, status
+from fastapi import APIRouter, status, Query
 import sys
 import os
 from fastapi.responses import JSONResponse
@@ -15,6 +15,8 @@ from db_utils.projects_queries import (
     insert_project,
     delete_project,
 )
+from db_utils.metadata_cache import invalidate_project
+from routers.listing import listing_response, LISTING_MAX_LIMIT
 from db_utils.validators import validate_data
 from db_utils.models import CustomResponseModel, NewProject
 from pathlib import Path
@@ -28,29 +30,28 @@ projects_endpoint = APIRouter()
     200: {"description": "OK", "model": CustomResponseModel},
     500: {"description": "Internal Server Error", "model": CustomResponseModel}
 })
-def read_projects(user_id=None):
+def read_projects(
+    user_id=None,
+    response_format: str = Query(default="json", alias="format", description="json: 従来の形式 / ndjson: 1行1件で逐次返す"),
+    cursor: str = Query(default=None, description="前のページの最後の行のキー（next_cursor）"),
+    limit: int = Query(default=None, ge=1, le=LISTING_MAX_LIMIT, description="省略時は全件を逐次返す")
+):
     connect_session = create_connect_session()
     if connect_session is None:
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"message": "failed to connect to database", "data": None})
 
-    if user_id is None:
-        result, _ = get_projects(session=connect_session)
-    else:
-        result, _ = get_projects_for_user(session=connect_session, user_id=user_id)
-    if result is not None:
-        rows = result.mappings().all()
-        res_data = []
-        for row in rows:
-            row_dict = dict(row)
-            # すべての datetime を文字列に変換
-            for k, v in row_dict.items():
-                if isinstance(v, datetime):
-                    row_dict[k] = v.isoformat()
-            res_data.append(row_dict)
-        print(res_data)
-        return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "succeeded to read projects", "data": res_data})
-    else:
-        return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"message": "failed to read projects", "data": None})
+    def fetch(cursor_values, page_limit, stream):
+        if user_id is None:
+            return get_projects(session=connect_session, cursor=cursor_values, limit=page_limit, stream=stream)
+        return get_projects_for_user(session=connect_session, user_id=user_id, cursor=cursor_values, limit=page_limit, stream=stream)
+
+    return listing_response(
+        fetch,
+        key_names=("id",),
+        message="succeeded to read projects",
+        error_message="failed to read projects",
+        response_format=response_format, cursor=cursor, limit=limit
+    )
 
 # 単一のプロジェクトを取得
 @projects_endpoint.get('/projects/{project_id}', tags=["projects"], description="単一プロジェクトの情報を取得", responses={
@@ -132,6 +133,7 @@ def delete_project(project_id: str):
 
     result, _ = delete_project(session=connect_session, project_id=id)
     if result:
+        invalidate_project(id)
         return JSONResponse(status_code=status.HTTP_204_NO_CONTENT)
     else:
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"message": "failed to delete project", "data": None})
\ No newline at end of file
@@ -7,8 +7,9 @@ from typing import List
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
 from db_utils.commons import create_connect_session
 from db_utils.models import CustomResponseModel
+from routers.listing import listing_response, LISTING_MAX_LIMIT
 from db_utils.user_image_clustering_states_queries import (
-    get_user_image_clustering_states,
+    get_user_image_clustering_states as select_user_image_clustering_states,
     get_unclustered_count,
     mark_images_as_clustered,
     mark_all_images_as_clustered,
@@ -31,7 +32,10 @@ user_image_clustering_states_endpoint = APIRouter()
 def get_user_image_clustering_states(
     user_id: int = None,
     project_id: int = None,
-    is_clustered: int = None  # 0: 未クラスタリング, 1: クラスタリング済み
+    is_clustered: int = None,  # 0: 未クラスタリング, 1: クラスタリング済み
+    response_format: str = Query(default="json", alias="format", description="json: 従来の形式 / ndjson: 1行1件で逐次返す"),
+    cursor: str = Query(default=None, description="前のページの最後の行のキー（next_cursor、user_id:image_id）"),
+    limit: int = Query(default=None, ge=1, le=LISTING_MAX_LIMIT, description="省略時は全件を逐次返す")
 ):
     """
     ユーザの画像クラスタリング状態を取得
@@ -40,6 +44,9 @@ def get_user_image_clustering_states(
         user_id: ユーザID（オプション）
         project_id: プロジェクトID（オプション）
         is_clustered: クラスタリング状態（オプション、0 or 1）
+        response_format: json または ndjson
+        cursor: 前のページの最後の行のキー（limit指定時は (user_id, image_id) 順）
+        limit: 取得件数
     """
     connect_session = create_connect_session()
     if connect_session is None:
@@ -51,33 +58,28 @@ def get_user_image_clustering_states(
     # クエリ条件を構築
     conditions = []
     if user_id is not None:
-        conditions.append(f"user_id = {user_id}")
+        conditions.append(f"uics.user_id = {user_id}")
     if project_id is not None:
-        conditions.append(f"project_id = {project_id}")
+        conditions.append(f"uics.project_id = {project_id}")
     if is_clustered is not None:
         if is_clustered not in [0, 1]:
             return JSONResponse(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 content={"message": "is_clustered must be 0 or 1", "data": None}
             )
-        conditions.append(f"is_clustered = {is_clustered}")
+        conditions.append(f"uics.is_clustered = {is_clustered}")
     
     where_clause = " AND ".join(conditions) if conditions else "1=1"
     
-    result, _ = get_user_image_clustering_states(session=connect_session, where_clause=where_clause)
-    
-    if result:
-        rows = result.mappings().all()
-        states_list = [dict(row) for row in rows]
-        return JSONResponse(
-            status_code=status.HTTP_200_OK,
-            content={"message": "succeeded to read user image clustering states", "data": states_list}
-        )
-    else:
-        return JSONResponse(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            content={"message": "failed to read user image clustering states", "data": None}
-        )
+    return listing_response(
+        lambda cursor_values, page_limit, stream: select_user_image_clustering_states(
+            session=connect_session, where_clause=where_clause, cursor=cursor_values, limit=page_limit, stream=stream
+        ),
+        key_names=("user_id", "image_id"),
+        message="succeeded to read user image clustering states",
+        error_message="failed to read user image clustering states",
+        response_format=response_format, cursor=cursor, limit=limit
+    )
 
 
 @user_image_clustering_states_endpoint.get(
@@ -1,5 +1,5 @@
 import json
-from fastapi import APIRouter, status
+from fastapi import APIRouter, status, Query
 import sys
 import os
 from fastapi.responses import JSONResponse
@@ -7,6 +7,8 @@ from fastapi.responses import JSONResponse
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
 from db_utils.commons import create_connect_session
 from db_utils.users_queries import select_all_users, insert_user, delete_user
+from db_utils.metadata_cache import invalidate_user
+from routers.listing import listing_response, LISTING_MAX_LIMIT
 from db_utils.validators import validate_data
 from db_utils.models import CustomResponseModel, NewUser
 
@@ -18,18 +20,22 @@ users_endpoint = APIRouter()
     200: {"description": "OK", "model": CustomResponseModel},
     500: {"description": "Internal Server Error", "model": CustomResponseModel}
 })
-def read_users():
+def read_users(
+    response_format: str = Query(default="json", alias="format", description="json: 従来の形式 / ndjson: 1行1件で逐次返す"),
+    cursor: str = Query(default=None, description="前のページの最後の行のキー（next_cursor）"),
+    limit: int = Query(default=None, ge=1, le=LISTING_MAX_LIMIT, description="省略時は全件を逐次返す")
+):
     connect_session = create_connect_session()
     if connect_session is None:
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,content={"message": "failed to connect to database", "data":None})
     
-    result,_ = select_all_users(session=connect_session)
-    if result is not None:
-        rows = result.mappings().all()
-        user_list = [dict(row) for row in rows]
-        return JSONResponse(status_code=status.HTTP_200_OK,content={"message": "succeeded to read users", "data":user_list})
-    else:
-        return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,content={"message": "failed to read users", "data":None})
+    return listing_response(
+        lambda cursor_values, page_limit, stream: select_all_users(session=connect_session, cursor=cursor_values, limit=page_limit, stream=stream),
+        key_names=("id",),
+        message="succeeded to read users",
+        error_message="failed to read users",
+        response_format=response_format, cursor=cursor, limit=limit
+    )
     
 #ユーザの作成
 @users_endpoint.post('/users',tags=["users"],description="新規ユーザの作成",responses={
@@ -80,6 +86,7 @@ def delete_user(user_id:str):
     
     result,_ = delete_user(session=connect_session, user_id=id)
     if not(result is None):
+        invalidate_user(id)
         return JSONResponse(status_code=status.HTTP_204_NO_CONTENT)
     else:
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,content={"message": "failed to delete user", "data":None})
\ No newline at end of file
@@ -13,6 +13,10 @@ from routers.images import images_endpoint
 from routers.test import test_endpoint
 from routers.action import action_endpoint
 from routers.user_image_clustering_states import user_image_clustering_states_endpoint
+from clustering.caption_store import get_caption_store
+from clustering.utils import CAPTION_STORE_PREFIX
+from clustering.upload_workers import shutdown_pools
+from clustering.job_queue import start_worker_processes, stop_worker_processes
 import json
 from routers.systems import HTML_TEMPLATE
 import sys
@@ -71,6 +75,26 @@ app.include_router(test_endpoint)
 app.include_router(action_endpoint)
 app.include_router(user_image_clustering_states_endpoint)
 
+# 起動時にコンパイル済みキャプションストアを開く（メモリマップのため読み込み待ちは発生しない）
+@app.on_event("startup")
+def open_caption_store():
+    get_caption_store(CAPTION_STORE_PREFIX)
+
+# 起動時にクラスタリングジョブのワーカープロセスを起動する（JOB_WORKERS=0 の場合は別プロセスで起動する想定）
+@app.on_event("startup")
+def start_job_workers():
+    start_worker_processes()
+
+# 終了時にアップロード処理用のワーカープールを停止する
+@app.on_event("shutdown")
+def stop_upload_workers():
+    shutdown_pools()
+
+# 終了時にクラスタリングジョブのワーカープロセスを停止する
+@app.on_event("shutdown")
+def stop_job_workers():
+    stop_worker_processes()
+
 #バックエンドエンドポイントルート
 @app.get("/",tags=["systems"],description="特に使用しない")
 def root():
@@ -0,0 +1,15 @@
+import os
+import sys
+
+# config.py は必須の環境変数を読み込むため、テスト用のダミー値を設定してから import する
+for name in (
+    "FRONTEND_PORT", "FRONTEND_PORT_IN_CONTAINER", "BACKEND_PORT",
+    "DATABASE_PORT", "DATABASE_PORT_IN_CONTAINER", "MYSQL_ROOT_PASSWORD", "MYSQL_DATABASE",
+    "MYSQL_USER", "MYSQL_PASSWORD", "MYSQL_HOST",
+    "MONGO_USER", "MONGO_PASSWORD", "MONGO_HOST", "MONGO_PORT", "MONGO_DB", "MONGO_AUTH_DB",
+    "MONGO_INITDB_ROOT_USERNAME", "MONGO_INITDB_ROOT_PASSWORD",
+    "ADMINISTRATOR_CODE", "OPENAI_API_KEY",
+):
+    os.environ.setdefault(name, "test")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -0,0 +1,129 @@
+"""
+CaptionManager の非同期キャプション生成パイプラインのテスト
+
+OpenAI API の代わりに httpx.MockTransport のスタブを使い、
+同時実行数の上限・トークンバケット・429/5xx でのリトライを確認する。
+"""
+
+import asyncio
+import json
+import time
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+openai = pytest.importorskip("openai")
+
+from clustering.caption_manager import CaptionManager, CaptionPipelineStats, TokenBucket
+
+VALID_CAPTION = (
+    "The main object is black pen. Its size is small. Its weight is very light. "
+    "It's used for writing. Its material is plastic. Its safety is safe. Its category is stationery."
+)
+
+
+def completion_response(caption: str = VALID_CAPTION) -> httpx.Response:
+    return httpx.Response(200, json={
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-4o",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": caption}, "finish_reason": "stop"}],
+    })
+
+
+def stub_client(handler) -> openai.AsyncOpenAI:
+    """handler がリクエストに応答するクライアント（SDK側のリトライは無効）"""
+    return openai.AsyncOpenAI(
+        api_key="test",
+        base_url="http://caption-stub/v1",
+        max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+
+def test_concurrency_limit(tmp_path):
+    image_paths = []
+    for i in range(6):
+        path = tmp_path / f"image_{i}.jpg"
+        path.write_bytes(b"jpeg")
+        image_paths.append(str(path))
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def handler(request):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        return completion_response()
+
+    jsonl_path = tmp_path / "captions.jsonl"
+    stats = asyncio.run(CaptionManager.run_pipeline(
+        image_paths, jsonl_path, openai_api_key="test",
+        concurrency=2, requests_per_minute=6000, client=stub_client(handler)
+    ))
+
+    assert max_in_flight == 2
+    assert stats.succeeded == 6
+    records = [json.loads(line) for line in jsonl_path.read_text(encoding="utf-8").splitlines()]
+    assert sorted(r["path"] for r in records) == sorted(f"image_{i}.jpg" for i in range(6))
+    assert all(r["is_success"] for r in records)
+
+
+def test_token_bucket_limits_rate():
+    async def acquire_all():
+        bucket = TokenBucket(rate_per_minute=600, capacity=2)
+        started = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # 最初の2つは即時、残り3つは 1/10 秒ごとに補充される
+    assert asyncio.run(acquire_all()) >= 0.25
+
+
+def test_retry_on_429_and_5xx():
+    responses = [
+        httpx.Response(429, json={"error": {"message": "rate limited"}}),
+        httpx.Response(500, json={"error": {"message": "server error"}}),
+        completion_response(),
+    ]
+
+    def handler(request):
+        return responses.pop(0)
+
+    stats = CaptionPipelineStats()
+    success, caption = asyncio.run(CaptionManager.generate_caption_async(
+        stub_client(handler), "aW1hZ2U=", TokenBucket(rate_per_minute=6000, capacity=5), stats,
+        max_retries=3, base_delay=0.01
+    ))
+
+    assert success is True
+    assert caption == VALID_CAPTION
+    assert stats.requests == 3
+    assert stats.retries == 2
+    assert stats.api_errors == 2
+
+
+def test_no_backoff_after_last_attempt():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(503, json={"error": {"message": "unavailable"}})
+
+    stats = CaptionPipelineStats()
+    started = time.monotonic()
+    success, caption = asyncio.run(CaptionManager.generate_caption_async(
+        stub_client(handler), "aW1hZ2U=", TokenBucket(rate_per_minute=6000, capacity=5), stats,
+        max_retries=2, base_delay=0.2, max_delay=1.0
+    ))
+    elapsed = time.monotonic() - started
+
+    assert (success, caption) == (False, None)
+    assert len(requests) == 2
+    # 1回目の失敗後の待機（0.1〜0.2秒）のみで、最後の失敗後の待機（0.2〜0.4秒）は行わない
+    assert elapsed < 0.3
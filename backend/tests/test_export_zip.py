@@ -0,0 +1,80 @@
+"""
+分類結果ZIPのストリーミング生成のテスト
+
+直前のZIPから変更の無い画像エントリをコピーし、新規・変更された画像だけを元画像から読むことを確認する。
+"""
+
+import builtins
+import io
+import os
+import zipfile
+
+import pytest
+
+pytest.importorskip("PIL")
+
+from clustering.utils import Utils
+
+
+def build_zip(result, source_images_path, previous_archive=None) -> bytes:
+    return b"".join(Utils.stream_classification_zip(result, {}, source_images_path, previous_archive=previous_archive))
+
+
+def test_reuses_unchanged_entries(tmp_path, monkeypatch):
+    images_path = tmp_path / "images"
+    images_path.mkdir()
+    for name in ("a.png", "b.png", "c.png"):
+        (images_path / name).write_bytes(os.urandom(4096))
+    (images_path / "note.txt").write_bytes(b"text" * 100)
+    result = {
+        "f1": {"name": "A", "is_leaf": True, "data": {"c_a": "a.png", "c_b": "b.png", "c_note": "note.txt"}},
+        "f2": {"name": "B", "is_leaf": True, "data": {"c_c": "c.png"}},
+    }
+    previous_archive = tmp_path / "previous.zip"
+    previous_archive.write_bytes(build_zip(result, images_path))
+
+    # b.png を変更し、フォルダ B の名前を変える
+    (images_path / "b.png").write_bytes(os.urandom(2048))
+    os.utime(images_path / "b.png", ns=(0, 10 ** 18))
+    result["f2"]["name"] = "Renamed"
+
+    opened = []
+    real_open = builtins.open
+
+    def recording_open(file, *args, **kwargs):
+        opened.append(os.path.basename(os.fspath(file)) if isinstance(file, (str, os.PathLike)) else file)
+        return real_open(file, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "open", recording_open)
+    archive = build_zip(result, images_path, previous_archive=previous_archive)
+    monkeypatch.setattr(builtins, "open", real_open)
+
+    # 変更の無い無圧縮エントリ（a.png, c.png）は元画像を開かない
+    assert "a.png" not in opened and "c.png" not in opened
+    assert "b.png" in opened and "note.txt" in opened
+
+    with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+        assert zf.testzip() is None
+        assert sorted(zf.namelist()) == sorted([
+            "result.json", "all_nodes.json",
+            "images/A/a.png", "images/A/b.png", "images/A/note.txt", "images/Renamed/c.png",
+        ])
+        for name in zf.namelist():
+            if name.startswith("images/"):
+                assert zf.read(name) == (images_path / name.rsplit("/", 1)[-1]).read_bytes()
+
+
+def test_same_name_with_different_clustering_id_is_not_reused(tmp_path):
+    images_path = tmp_path / "images"
+    images_path.mkdir()
+    (images_path / "a.png").write_bytes(os.urandom(4096))
+    previous_archive = tmp_path / "previous.zip"
+    previous_archive.write_bytes(build_zip({"f1": {"name": "A", "is_leaf": True, "data": {"old_id": "a.png"}}}, images_path))
+
+    archive = build_zip({"f1": {"name": "A", "is_leaf": True, "data": {"new_id": "a.png"}}}, images_path,
+                        previous_archive=previous_archive)
+
+    with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+        info = zf.getinfo("images/A/a.png")
+        assert info.comment.decode("utf-8").startswith("new_id:")
+        assert zf.read(info) == (images_path / "a.png").read_bytes()
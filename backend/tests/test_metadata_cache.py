@@ -0,0 +1,57 @@
+"""
+メタデータキャッシュのテスト
+
+見つからなかった場合（None）とクエリが失敗した場合（MetadataLookupError）を区別し、どちらもキャッシュしないことを確認する。
+"""
+
+import pytest
+
+from db_utils import action_queries, metadata_cache
+from db_utils.metadata_cache import MetadataCache, MetadataLookupError, get_membership_metadata
+
+
+class FakeResult:
+    def __init__(self, row):
+        self._row = row
+
+    def mappings(self):
+        return self
+
+    def first(self):
+        return self._row
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = MetadataCache(ttl=60, max_entries=10)
+    monkeypatch.setattr(metadata_cache, "_metadata_cache", cache)
+    return cache
+
+
+def stub_membership_query(monkeypatch, results):
+    calls = []
+
+    def query(session, user_id, project_id):
+        calls.append((user_id, project_id))
+        return results.pop(0), None
+
+    monkeypatch.setattr(action_queries, "get_membership_init_and_mongo", query)
+    return calls
+
+
+def test_membership_query_failure_raises_and_is_not_cached(cache, monkeypatch):
+    calls = stub_membership_query(monkeypatch, [None, FakeResult({"init_clustering_state": 2, "mongo_result_id": "m1"})])
+
+    with pytest.raises(MetadataLookupError):
+        get_membership_metadata(None, project_id=1, user_id=2)
+    assert get_membership_metadata(None, project_id=1, user_id=2) == {"mongo_result_id": "m1"}
+    assert get_membership_metadata(None, project_id=1, user_id=2) == {"mongo_result_id": "m1"}
+    assert len(calls) == 2
+
+
+def test_missing_membership_returns_none_and_is_not_cached(cache, monkeypatch):
+    calls = stub_membership_query(monkeypatch, [FakeResult(None), FakeResult({"init_clustering_state": 0, "mongo_result_id": "m2"})])
+
+    assert get_membership_metadata(None, project_id=1, user_id=3) is None
+    assert get_membership_metadata(None, project_id=1, user_id=3) == {"mongo_result_id": "m2"}
+    assert len(calls) == 2
@@ -96,10 +96,13 @@ CREATE TABLE user_image_clustering_states (
 -- -- ========================
 -- -- インデックス（検索性能向上）
 -- -- ========================
-CREATE INDEX idx_images_project_id ON images(project_id);
-CREATE INDEX idx_user_image_clustering_states_user_id ON user_image_clustering_states(user_id);
+CREATE UNIQUE INDEX uq_images_clustering_id ON images(clustering_id);
+CREATE UNIQUE INDEX uq_images_project_id_name ON images(project_id, name);
+CREATE INDEX idx_images_project_id_is_created_caption ON images(project_id, is_created_caption);
+CREATE INDEX idx_user_image_clustering_states_user_project_clustered ON user_image_clustering_states(user_id, project_id, is_clustered);
 CREATE INDEX idx_user_image_clustering_states_project_id ON user_image_clustering_states(project_id);
 CREATE INDEX idx_user_image_clustering_states_is_clustered ON user_image_clustering_states(is_clustered);
+CREATE INDEX idx_project_memberships_project_id_init_state ON project_memberships(project_id, init_clustering_state);
 
 -- ========================
 -- 初期データの挿入
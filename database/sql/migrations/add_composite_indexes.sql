@@ -0,0 +1,41 @@
+-- 頻出クエリの検索条件に合わせた複合インデックス・UNIQUEインデックスを追加するマイグレーションスクリプト
+-- 使用方法: docker exec -i <mysql-container-name> mysql -u root -p<password> pss_db < add_composite_indexes.sql
+--
+-- 事前確認: 以下のクエリが1件でも返す場合はUNIQUEインデックスの追加に失敗するため、重複を解消してから実行する
+--   SELECT clustering_id, COUNT(*) FROM images GROUP BY clustering_id HAVING COUNT(*) > 1;
+--   SELECT project_id, name, COUNT(*) FROM images GROUP BY project_id, name HAVING COUNT(*) > 1;
+--
+-- 検証: backend/ で python -m benchmarks.query_plan_benchmark を実行すると、各クエリの実行計画とレイテンシを確認できる
+
+USE `pss_db`;
+
+-- images テーブル
+-- clustering_id: 画像ごとに一意（select_image_id_by_clustering_id / get_chromadb_*_by_clustering_id / キャプション一括取得）
+-- (project_id, name): 同名画像の重複チェック（check_image_exists）。アップロードの同時実行による重複登録も防ぐ
+-- (project_id, is_created_caption): 初期/継続的クラスタリング対象の取得（select_images_for_init / get_unclustered_images）
+ALTER TABLE images
+    ADD UNIQUE INDEX uq_images_clustering_id (clustering_id),
+    ADD UNIQUE INDEX uq_images_project_id_name (project_id, name),
+    ADD INDEX idx_images_project_id_is_created_caption (project_id, is_created_caption);
+
+-- project_id 単独のインデックスは上記の複合インデックスで代替できるため削除（外部キーは複合インデックスを使用）
+ALTER TABLE images
+    DROP INDEX idx_images_project_id;
+
+-- user_image_clustering_states テーブル
+-- (user_id, project_id, is_clustered): 未クラスタリング件数の取得・クラスタリング済みへの一括更新
+ALTER TABLE user_image_clustering_states
+    ADD INDEX idx_user_image_clustering_states_user_project_clustered (user_id, project_id, is_clustered);
+
+-- user_id 単独は主キー (user_id, image_id) の先頭列と重複するため削除
+-- is_clustered 単独は残す: 上記の複合インデックスは user_id を先頭に指定するクエリにしか使えず、
+-- クラスタリング状態一覧（GET /user-image-clustering-states?is_clustered=）は is_clustered だけで絞り込めるため
+ALTER TABLE user_image_clustering_states
+    DROP INDEX idx_user_image_clustering_states_user_id;
+
+-- project_memberships テーブル
+-- (project_id, init_clustering_state): プロジェクトメンバーの取得・初期クラスタリング完了メンバーの状態更新
+ALTER TABLE project_memberships
+    ADD INDEX idx_project_memberships_project_id_init_state (project_id, init_clustering_state);
+
+SELECT '✅ マイグレーション完了: 複合インデックス・UNIQUEインデックスを追加しました' AS message;